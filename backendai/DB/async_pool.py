@@ -0,0 +1,155 @@
+"""
+Async PostgreSQL access for request handlers.
+
+Uses a psycopg 3 AsyncConnectionPool so async routes query the database
+without blocking the event loop or borrowing a thread from the default
+executor. Connections are checked before being handed out, recycled
+after DB_POOL_MAX_IDLE / DB_POOL_MAX_LIFETIME seconds, and acquisition
+waits up to DB_POOL_TIMEOUT seconds.
+
+psycopg 3 is optional: without it (or when called from an event loop
+other than the one the pool was opened on, e.g. a training thread's
+asyncio.run) the helpers fall back to the psycopg2 pool via
+asyncio.to_thread, so callers never need to care.
+
+Usage:
+    rows = await fetch_all("SELECT ... WHERE chatbot_id = %s", (chatbot_id,))
+    row = await fetch_one(...)
+    ok = await execute("UPDATE ...", params)
+"""
+
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+try:
+    from psycopg.conninfo import make_conninfo
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:  # psycopg 3 is optional, helpers fall back to the psycopg2 pool
+    AsyncConnectionPool = None
+
+from DB.postgresDB import (
+    DB_CONFIG, DB_SCHEMA, DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE, DB_POOL_MAX_LIFETIME,
+    get_db_connection, run_query, run_write_query,
+)
+from utils import metrics
+
+DB_ASYNC_POOL_MIN = int(os.getenv("DB_ASYNC_POOL_MIN", "2"))
+DB_ASYNC_POOL_MAX = int(os.getenv("DB_ASYNC_POOL_MAX", "20"))
+
+_pool = None
+_pool_loop = None
+
+
+def _conninfo() -> str:
+    params = {
+        "dbname": DB_CONFIG["dbname"],
+        "user": DB_CONFIG["user"],
+        "password": DB_CONFIG["password"],
+        "host": DB_CONFIG["host"],
+        "port": DB_CONFIG["port"],
+        "keepalives": 1,
+        "keepalives_idle": 30,
+    }
+    if DB_SCHEMA and DB_SCHEMA != "public":
+        params["options"] = f"-c search_path={DB_SCHEMA},public"
+    return make_conninfo(**{k: v for k, v in params.items() if v is not None})
+
+
+async def open_async_pool():
+    """Opens the pool on the running loop (called from the FastAPI lifespan)."""
+    global _pool, _pool_loop
+    if AsyncConnectionPool is None:
+        logging.info("psycopg 3 not installed - async DB helpers use the psycopg2 pool in worker threads")
+        return None
+    if _pool is not None:
+        return _pool
+
+    try:
+        pool = AsyncConnectionPool(
+            _conninfo(),
+            min_size=DB_ASYNC_POOL_MIN,
+            max_size=DB_ASYNC_POOL_MAX,
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            max_lifetime=DB_POOL_MAX_LIFETIME,
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+        await pool.open(wait=False)
+        _pool, _pool_loop = pool, asyncio.get_running_loop()
+        metrics.register_gauge("db_async_pool", pool.get_stats)
+        print("PostgreSQL async connection pool created successfully")
+    except Exception as e:
+        print(f"Error creating async PostgreSQL pool: {e}")
+    return _pool
+
+
+async def close_async_pool():
+    global _pool, _pool_loop
+    if _pool is not None:
+        await _pool.close()
+        _pool, _pool_loop = None, None
+
+
+def _usable_pool():
+    if _pool is None:
+        return None
+    try:
+        return _pool if asyncio.get_running_loop() is _pool_loop else None
+    except RuntimeError:
+        return None
+
+
+@asynccontextmanager
+async def get_async_db_connection():
+    """
+    Async connection from the pool; committed on success, rolled back on error.
+    Requires psycopg 3 and an open pool - prefer fetch_all / fetch_one / execute otherwise.
+    """
+    pool = _usable_pool()
+    if pool is None:
+        raise RuntimeError("Async PostgreSQL pool is not available on this event loop")
+    async with pool.connection() as conn:
+        yield conn
+
+
+async def fetch_all(query: str, params=None) -> list:
+    pool = _usable_pool()
+    if pool is None:
+        def run():
+            with get_db_connection() as conn:
+                rows = run_query(conn, query, params)
+                conn.rollback()
+                return rows
+        return await asyncio.to_thread(run)
+
+    async with pool.connection() as conn:
+        cur = await conn.execute(query, params)
+        return await cur.fetchall()
+
+
+async def fetch_one(query: str, params=None):
+    rows = await fetch_all(query, params)
+    return rows[0] if rows else None
+
+
+async def execute(query: str, params=None) -> bool:
+    """
+    Executes a write query and commits. Returns False on error (like run_write_query).
+    """
+    pool = _usable_pool()
+    if pool is None:
+        def run():
+            with get_db_connection() as conn:
+                return run_write_query(conn, query, params)
+        return await asyncio.to_thread(run)
+
+    try:
+        async with pool.connection() as conn:
+            await conn.execute(query, params)
+        return True
+    except Exception as e:
+        print(f"Database write error: {e}")
+        return False
@@ -0,0 +1,232 @@
+"""
+Per-request chatbot context.
+
+A chat turn used to run a separate pooled query for each of: chatbot
+existence, organization type, pre-chat form, conversation email/history
+and the customer record (whose lookup re-fetched organization_id, as did
+save_customer and move_customer_to_pipeline later in the turn).
+
+load_chatbot_context / load_chatbot_context_async fetch all of it with one
+joined query on one connection. Pass the result as `context=` to
+get_customer_by_email, save_customer and move_customer_to_pipeline so they
+skip the lookups it already answers.
+
+The configuration part (organization, org type, form) comes from
+DB/config_cache when cached; the query then only reads the conversation and
+customer, and is skipped entirely for a new chat without an email.
+
+The customer is matched on the email passed by the caller, falling back to
+the email stored on the conversation. History is the rolling summary of
+older messages, if any, plus the last CHAT_HISTORY_LIMIT messages after it
+(see DB/conversation_store.py and controller/conversation_summary.py).
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Optional
+
+from DB.config_cache import ChatbotConfig, cache_config, config_from_row, get_cached_config
+from DB.conversation_store import CHAT_HISTORY_LIMIT
+from DB.postgresDB import get_db_connection, run_query
+from DB.transcript_buffer import with_pending
+
+CHATBOT_CONTEXT_SQL = """
+    SELECT
+        c.organization_id,
+        o.organization_type,
+        f.pre_chat_form,
+        conv.conversation_id IS NOT NULL AS conversation_exists,
+        conv.user_email,
+        COALESCE(m.messages, CASE WHEN s.conversation_id IS NULL AND jsonb_typeof(conv.history) = 'array' THEN conv.history END),
+        s.summary,
+        s.message_count,
+        cu.id,
+        cu.email,
+        cu.custom_data
+    FROM chatbots c
+    LEFT JOIN organizations o ON o.id = c.organization_id
+    LEFT JOIN LATERAL (
+        SELECT pre_chat_form FROM forms WHERE chatbot_id = c.chatbot_id LIMIT 1
+    ) f ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT conversation_id, user_email, history
+        FROM bot_conversations
+        WHERE conversation_id = %(conversation_id)s::text
+        LIMIT 1
+    ) conv ON TRUE
+    LEFT JOIN bot_conversation_summaries s ON s.conversation_id = conv.conversation_id
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(recent.data ORDER BY recent.seq) AS messages
+        FROM (
+            SELECT seq, data FROM bot_conversation_messages
+            WHERE conversation_id = conv.conversation_id
+              AND seq > COALESCE(s.through_seq, 0)
+            ORDER BY seq DESC
+            LIMIT %(history_limit)s
+        ) recent
+    ) m ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT id, email, custom_data
+        FROM customers
+        WHERE organization_id = c.organization_id
+          AND email = COALESCE(NULLIF(%(user_email)s::text, ''), conv.user_email)
+        LIMIT 1
+    ) cu ON TRUE
+    WHERE c.chatbot_id = %(chatbot_id)s
+"""
+
+# Same as above for a cached configuration: conversation and customer only
+CONVERSATION_CONTEXT_SQL = """
+    SELECT
+        conv.conversation_id IS NOT NULL AS conversation_exists,
+        conv.user_email,
+        COALESCE(m.messages, CASE WHEN s.conversation_id IS NULL AND jsonb_typeof(conv.history) = 'array' THEN conv.history END),
+        s.summary,
+        s.message_count,
+        cu.id,
+        cu.email,
+        cu.custom_data
+    FROM (SELECT 1) one
+    LEFT JOIN LATERAL (
+        SELECT conversation_id, user_email, history
+        FROM bot_conversations
+        WHERE conversation_id = %(conversation_id)s::text
+        LIMIT 1
+    ) conv ON TRUE
+    LEFT JOIN bot_conversation_summaries s ON s.conversation_id = conv.conversation_id
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(recent.data ORDER BY recent.seq) AS messages
+        FROM (
+            SELECT seq, data FROM bot_conversation_messages
+            WHERE conversation_id = conv.conversation_id
+              AND seq > COALESCE(s.through_seq, 0)
+            ORDER BY seq DESC
+            LIMIT %(history_limit)s
+        ) recent
+    ) m ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT id, email, custom_data
+        FROM customers
+        WHERE organization_id = %(organization_id)s
+          AND email = COALESCE(NULLIF(%(user_email)s::text, ''), conv.user_email)
+        LIMIT 1
+    ) cu ON TRUE
+"""
+
+
+@dataclass
+class ChatbotContext(ChatbotConfig):
+    conversation_exists: bool = False
+    conversation_email: Optional[str] = None
+    history: list = field(default_factory=list)     # last CHAT_HISTORY_LIMIT messages after the summary, oldest first
+    summary: Optional[str] = None                   # compacted older messages (controller/conversation_summary.py)
+    summarized_count: int = 0                       # number of messages covered by the summary
+    customer: Optional[dict] = None                 # {id, email, name, phone}
+
+    def customer_for(self, email: str) -> Optional[dict]:
+        """The loaded customer if it is the one with this email."""
+        if self.customer and email and self.customer["email"] == email:
+            return self.customer
+        return None
+
+
+def _params(config, chatbot_id, conversation_id, user_email):
+    if conversation_id == "NEW_CHAT":
+        conversation_id = None
+    return {
+        "chatbot_id": chatbot_id,
+        "organization_id": config.organization_id if config else None,
+        "conversation_id": conversation_id,
+        "user_email": user_email,
+        "history_limit": CHAT_HISTORY_LIMIT,
+    }
+
+
+def _needs_query(config, params) -> bool:
+    return config is None or bool(params["conversation_id"] or params["user_email"])
+
+
+def _build(chatbot_id, config, row, conversation_row, conversation_id=None) -> Optional[ChatbotContext]:
+    """
+    row is a CHATBOT_CONTEXT_SQL row (config is None) and conversation_row
+    a CONVERSATION_CONTEXT_SQL row (config is cached; None when not queried).
+    Messages still in this worker's write-behind buffer are appended to the history.
+    """
+    if config is None:
+        if not row:
+            return None
+        config = config_from_row(chatbot_id, row[:3])
+        cache_config(config)
+        conversation_row = row[3:]
+
+    (conversation_exists, conversation_email, history, summary, summarized_count,
+     customer_id, customer_email, custom_data) = conversation_row or (False, None, None, None, None, None, None, None)
+
+    if isinstance(history, str):
+        try:
+            history = json.loads(history)
+        except Exception:
+            history = []
+
+    customer = None
+    if customer_id is not None:
+        if isinstance(custom_data, str):
+            try:
+                custom_data = json.loads(custom_data)
+            except Exception:
+                custom_data = {}
+        custom_data = custom_data or {}
+        customer = {
+            "id": customer_id,
+            "email": customer_email,
+            "name": custom_data.get("name", ""),
+            "phone": custom_data.get("phone", ""),
+        }
+
+    return ChatbotContext(
+        chatbot_id=chatbot_id,
+        organization_id=config.organization_id,
+        organization_type=config.organization_type,
+        pre_chat_form=config.pre_chat_form,
+        conversation_exists=bool(conversation_exists),
+        conversation_email=conversation_email,
+        history=with_pending(conversation_id, history if isinstance(history, list) else [], CHAT_HISTORY_LIMIT),
+        summary=summary,
+        summarized_count=summarized_count or 0,
+        customer=customer,
+    )
+
+
+def load_chatbot_context(chatbot_id: str, conversation_id: str = None, user_email: str = None, conn=None) -> Optional[ChatbotContext]:
+    """
+    Loads the context in (at most) one query. Returns None if the chatbot does not exist.
+    """
+    config = get_cached_config(chatbot_id)
+    params = _params(config, chatbot_id, conversation_id, user_email)
+    if not _needs_query(config, params):
+        return _build(chatbot_id, config, None, None, params["conversation_id"])
+
+    query = CONVERSATION_CONTEXT_SQL if config else CHATBOT_CONTEXT_SQL
+    if conn is None:
+        with get_db_connection() as new_conn:
+            rows = run_query(new_conn, query, params)
+    else:
+        rows = run_query(conn, query, params)
+    row = rows[0] if rows else None
+    return _build(chatbot_id, config, row, row, params["conversation_id"])
+
+
+async def load_chatbot_context_async(chatbot_id: str, conversation_id: str = None, user_email: str = None) -> Optional[ChatbotContext]:
+    """
+    Async variant for request handlers (psycopg 3 pool, or the psycopg2 pool in a worker thread).
+    Raises on database errors so callers can tell them apart from an unknown chatbot.
+    """
+    from DB.async_pool import fetch_one
+
+    config = get_cached_config(chatbot_id)
+    params = _params(config, chatbot_id, conversation_id, user_email)
+    if not _needs_query(config, params):
+        return _build(chatbot_id, config, None, None, params["conversation_id"])
+
+    row = await fetch_one(CONVERSATION_CONTEXT_SQL if config else CHATBOT_CONTEXT_SQL, params)
+    return _build(chatbot_id, config, row, row, params["conversation_id"])
@@ -0,0 +1,229 @@
+"""
+In-process cache of per-chatbot configuration.
+
+The chatbot -> organization mapping, organization type (which selects the
+INDUSTRY_PROMPTS persona) and forms.pre_chat_form rarely change but are read
+on every chat message and every realtime session. They are cached here for
+CHATBOT_CONFIG_CACHE_TTL seconds and dropped early when they change:
+
+- DB/migrations/003_config_notify.sql adds triggers that NOTIFY
+  'chatbot_config_changed' on edits to forms, chatbots and organizations.
+  start_config_listener() LISTENs on a dedicated connection and invalidates
+  the affected entries in this worker.
+- POST /api/chatbot_config/invalidate (for rtserver, or installs without the
+  triggers) invalidates locally and re-broadcasts through NOTIFY so every
+  worker drops the entry.
+
+The TTL bounds staleness if a notification is ever missed.
+"""
+
+import os
+import json
+import select
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+import psycopg2
+from psycopg2 import extensions
+
+from DB.postgresDB import DB_CONFIG, DB_KEEPALIVES, get_db_connection, run_query, run_write_query
+from resources.industry_prompts import INDUSTRY_PROMPTS
+from utils import metrics
+from utils.ttl_cache import TTLCache
+
+CHATBOT_CONFIG_CACHE_SIZE = int(os.getenv("CHATBOT_CONFIG_CACHE_SIZE", "10000"))
+CHATBOT_CONFIG_CACHE_TTL = float(os.getenv("CHATBOT_CONFIG_CACHE_TTL", "300"))
+CHATBOT_CONFIG_LISTEN = os.getenv("CHATBOT_CONFIG_LISTEN", "true").lower() == "true"
+CONFIG_CHANNEL = "chatbot_config_changed"
+
+CHATBOT_CONFIG_SQL = """
+    SELECT c.organization_id, o.organization_type, f.pre_chat_form
+    FROM chatbots c
+    LEFT JOIN organizations o ON o.id = c.organization_id
+    LEFT JOIN LATERAL (
+        SELECT pre_chat_form FROM forms WHERE chatbot_id = c.chatbot_id LIMIT 1
+    ) f ON TRUE
+    WHERE c.chatbot_id = %s
+"""
+
+config_cache = TTLCache(CHATBOT_CONFIG_CACHE_SIZE, CHATBOT_CONFIG_CACHE_TTL)
+metrics.register_gauge("chatbot_config_cache.size", lambda: len(config_cache))
+metrics.register_gauge("chatbot_config_cache.hit_rate", lambda: metrics.hit_rate("chatbot_config_cache"))
+
+
+@dataclass
+class ChatbotConfig:
+    chatbot_id: str
+    organization_id: Optional[int]
+    organization_type: str = "Default"
+    pre_chat_form: list = field(default_factory=list)
+
+    @property
+    def industry_instruction(self) -> str:
+        return INDUSTRY_PROMPTS.get(self.organization_type, INDUSTRY_PROMPTS.get("Default", ""))
+
+    def customer_for(self, email: str) -> Optional[dict]:
+        """Configuration carries no customer; see ChatbotContext."""
+        return None
+
+
+def config_from_row(chatbot_id: str, row) -> Optional[ChatbotConfig]:
+    """Builds a ChatbotConfig from (organization_id, organization_type, pre_chat_form)."""
+    if not row:
+        return None
+    org_id, org_type, form = row
+    if isinstance(form, str):
+        try:
+            form = json.loads(form)
+        except Exception:
+            form = []
+    return ChatbotConfig(
+        chatbot_id=chatbot_id,
+        organization_id=org_id,
+        organization_type=org_type or "Default",
+        pre_chat_form=form if isinstance(form, list) else [],
+    )
+
+
+def get_cached_config(chatbot_id: str) -> Optional[ChatbotConfig]:
+    config = config_cache.get(chatbot_id)
+    metrics.increment("chatbot_config_cache.hits" if config else "chatbot_config_cache.misses")
+    return config
+
+
+def cache_config(config: ChatbotConfig):
+    if config is not None:
+        config_cache.set(config.chatbot_id, config)
+
+
+def get_chatbot_config(chatbot_id: str, conn=None) -> Optional[ChatbotConfig]:
+    """
+    Cached configuration for a chatbot, or None if it does not exist.
+    """
+    config = get_cached_config(chatbot_id)
+    if config:
+        return config
+
+    try:
+        if conn is None:
+            with get_db_connection() as new_conn:
+                rows = run_query(new_conn, CHATBOT_CONFIG_SQL, (chatbot_id,))
+        else:
+            rows = run_query(conn, CHATBOT_CONFIG_SQL, (chatbot_id,))
+    except Exception as e:
+        logging.error(f"Error loading chatbot config for {chatbot_id}: {e}")
+        return None
+
+    config = config_from_row(chatbot_id, rows[0] if rows else None)
+    cache_config(config)
+    return config
+
+
+async def get_chatbot_config_async(chatbot_id: str) -> Optional[ChatbotConfig]:
+    """
+    Async variant for request handlers. Raises on database errors.
+    """
+    from DB.async_pool import fetch_one
+
+    config = get_cached_config(chatbot_id)
+    if config:
+        return config
+
+    config = config_from_row(chatbot_id, await fetch_one(CHATBOT_CONFIG_SQL, (chatbot_id,)))
+    cache_config(config)
+    return config
+
+
+def invalidate_chatbot_config(chatbot_id: str = None, organization_id=None):
+    """
+    Drops one chatbot's entry, or everything for an organization change (or when called without arguments).
+    """
+    if chatbot_id:
+        config_cache.pop(chatbot_id)
+    else:
+        config_cache.clear()
+    metrics.increment("chatbot_config_cache.invalidations")
+
+
+def notify_config_change(chatbot_id: str = None, organization_id=None) -> bool:
+    """
+    Broadcasts an invalidation to every worker listening on CONFIG_CHANNEL.
+    """
+    payload = {"chatbot_id": chatbot_id} if chatbot_id else {"organization_id": organization_id}
+    with get_db_connection() as conn:
+        return run_write_query(conn, "SELECT pg_notify(%s, %s)", (CONFIG_CHANNEL, json.dumps(payload)))
+
+
+def _handle_notification(payload: str):
+    try:
+        data = json.loads(payload) if payload else {}
+    except ValueError:
+        data = {}
+    invalidate_chatbot_config(data.get("chatbot_id"), data.get("organization_id"))
+
+
+class ConfigChangeListener(threading.Thread):
+    """
+    LISTENs on CONFIG_CHANNEL with its own connection (a LISTEN connection
+    cannot be shared through the pool) and reconnects after failures. The
+    whole cache is dropped on every (re)connect since notifications sent
+    while disconnected are lost.
+    """
+
+    def __init__(self, poll_interval: float = 5, retry_interval: float = 5):
+        super().__init__(name="config-change-listener", daemon=True)
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**DB_CONFIG, **DB_KEEPALIVES)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CONFIG_CHANNEL}")
+                invalidate_chatbot_config()
+                logging.info(f"Listening for chatbot config changes on '{CONFIG_CHANNEL}'")
+
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        _handle_notification(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logging.warning(f"Chatbot config listener error: {e} - retrying in {self.retry_interval}s")
+                self._stop_event.wait(self.retry_interval)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+_listener = None
+
+
+def start_config_listener():
+    """Starts the LISTEN thread (called from the FastAPI lifespan)."""
+    global _listener
+    if not CHATBOT_CONFIG_LISTEN or (_listener and _listener.is_alive()):
+        return _listener
+    _listener = ConfigChangeListener()
+    _listener.start()
+    return _listener
+
+
+def stop_config_listener():
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
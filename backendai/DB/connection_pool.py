@@ -0,0 +1,191 @@
+"""
+Thread-safe psycopg2 connection pool with health checks.
+
+Replaces psycopg2.pool.SimpleConnectionPool, which is not safe to share
+between the asyncio.to_thread workers that call get_db_connection and
+raises as soon as every connection is checked out. This pool:
+
+- blocks up to `timeout` seconds for a free connection instead of failing,
+- validates connections that sat idle longer than `check_after` seconds
+  (SELECT 1) before handing them out, so dead RDS connections are replaced
+  transparently instead of failing mid-chat,
+- closes connections idle for more than `max_idle` or older than
+  `max_lifetime` seconds,
+- rolls back transactions left open by callers on return,
+- reports size / in-use / waiting counts and acquisition wait times to utils.metrics.
+"""
+
+import time
+import logging
+import threading
+
+import psycopg2
+from psycopg2 import extensions, pool as pg_pool_module
+
+from utils import metrics
+
+
+class PoolTimeout(pg_pool_module.PoolError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 10, max_idle: float = 300,
+                 max_lifetime: float = 3600, check_after: float = 30, name: str = "db_pool", **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.name = name
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []         # [(conn, returned_at)], most recently used last
+        self._created = {}      # id(conn) -> created_at, for every open connection
+        self._in_use = set()    # id(conn)
+        self._size = 0          # open + being opened
+        self._waiting = 0
+        self.closed = False
+
+        for _ in range(minconn):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+        metrics.register_gauge(self.name, self.stats)
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            conn, idle_for = self._acquire(deadline)
+            if conn is None:
+                conn = self._open_reserved()
+            elif idle_for > self.check_after and not self._is_alive(conn):
+                metrics.increment(f"{self.name}.dead_connections")
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._in_use.add(id(conn))
+            metrics.observe(f"{self.name}.wait", time.monotonic() - start)
+            return conn
+
+    def putconn(self, conn, close: bool = False):
+        if conn is None:
+            return
+        with self._cond:
+            if id(conn) not in self._in_use:
+                raise pg_pool_module.PoolError("trying to put unkeyed connection")
+            self._in_use.discard(id(conn))
+
+        if not close and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                close = True
+
+        if close or conn.closed or self.closed or self._expired(conn):
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "max": self.maxconn,
+            }
+
+    # ---- internals ------------------------------------------------------
+
+    def _acquire(self, deadline):
+        """
+        Returns (idle_conn, idle_seconds), or (None, 0) after reserving a slot for a new connection.
+        Waits until deadline when the pool is saturated.
+        """
+        with self._cond:
+            while True:
+                if self.closed:
+                    raise pg_pool_module.PoolError("connection pool is closed")
+
+                now = time.monotonic()
+                while self._idle:
+                    conn, returned_at = self._idle.pop()
+                    if conn.closed or now - returned_at > self.max_idle or self._expired(conn):
+                        self._close_locked(conn)
+                        continue
+                    return conn, now - returned_at
+
+                if self._size < self.maxconn:
+                    self._size += 1
+                    return None, 0
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    metrics.increment(f"{self.name}.timeouts")
+                    raise PoolTimeout(f"no connection available within {self.timeout}s ({self.maxconn} in use)")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+    def _open_reserved(self):
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        self._created[id(conn)] = time.monotonic()
+        metrics.increment(f"{self.name}.connections_opened")
+        return conn
+
+    def _is_alive(self, conn) -> bool:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logging.warning(f"Discarding dead pooled connection: {e}")
+            return False
+
+    def _expired(self, conn) -> bool:
+        created = self._created.get(id(conn))
+        return created is not None and time.monotonic() - created > self.max_lifetime
+
+    def _discard(self, conn):
+        with self._cond:
+            self._close_locked(conn)
+
+    def _close_locked(self, conn):
+        self._created.pop(id(conn), None)
+        self._size -= 1
+        self._cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,231 @@
+"""
+Append-only conversation message storage.
+
+Chat history used to live in bot_conversations.history as one JSONB array
+appended with `COALESCE(history, '[]') || new`. Every append rewrote the
+whole TOASTed array (O(n^2) bytes written over a conversation) and every
+turn read all of it back to keep the last 100 entries.
+
+Messages now go to bot_conversation_messages (created in init_vector_db),
+one row per message, ordered by seq (a BIGSERIAL, so it only increases) and
+indexed on (conversation_id, seq). An append is a plain INSERT and history reads fetch
+only the last N rows. `data` keeps the original {role, text, timestamp}
+object so readers see the same shape as before.
+
+Legacy conversations are migrated by DB/migrations/004_conversation_messages.sql.
+A conversation that was not migrated yet is copied over the first time a
+message is appended to it. Until then, readers fall back to the array.
+The array is left as it was (rtserver prefers the table when it has rows).
+
+Older messages of long conversations are compacted into
+bot_conversation_summaries (controller/conversation_summary.py); prompt
+history reads (fetch_prompt_history, DB/chatbot_context.py) return the
+summary plus the messages after it.
+"""
+
+import os
+import logging
+from datetime import datetime, timezone
+
+from psycopg2.extras import Json, execute_values
+
+from DB.postgresDB import get_db_connection, run_query, run_write_query
+
+CHAT_HISTORY_LIMIT = int(os.getenv("CHAT_HISTORY_LIMIT", "100"))
+
+# Copies legacy history arrays into the table, once (no-op for conversations that already have rows)
+COPY_LEGACY_HISTORY_SQL = """
+    INSERT INTO bot_conversation_messages (conversation_id, role, text, data)
+    SELECT c.conversation_id, e.msg->>'role', e.msg->>'text', e.msg
+    FROM bot_conversations c
+    CROSS JOIN LATERAL jsonb_array_elements(c.history) WITH ORDINALITY AS e(msg, ord)
+    WHERE c.conversation_id = ANY(%(conversation_ids)s)
+      AND jsonb_typeof(c.history) = 'array'
+      AND NOT EXISTS (SELECT 1 FROM bot_conversation_messages m WHERE m.conversation_id = c.conversation_id)
+    ORDER BY c.conversation_id, e.ord
+"""
+
+# Locks the conversations in a fixed order, so concurrent batches touching the same ones cannot deadlock
+LOCK_CONVERSATIONS_SQL = """
+    SELECT 1 FROM bot_conversations
+    WHERE conversation_id = ANY(%s)
+    ORDER BY conversation_id
+    FOR UPDATE
+"""
+
+# Last N messages (all when limit is NULL), oldest first; the legacy array only when the table has none
+RECENT_MESSAGES_SQL = """
+    SELECT c.conversation_id,
+           COALESCE(m.messages, CASE WHEN jsonb_typeof(c.history) = 'array' THEN c.history END)
+    FROM bot_conversations c
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(recent.data ORDER BY recent.seq) AS messages
+        FROM (
+            SELECT seq, data FROM bot_conversation_messages
+            WHERE conversation_id = c.conversation_id
+            ORDER BY seq DESC
+            LIMIT %(limit)s
+        ) recent
+    ) m ON TRUE
+    WHERE c.conversation_id = %(conversation_id)s
+"""
+
+
+# Summary plus the last N messages after it; the legacy array only when the conversation was never migrated
+PROMPT_HISTORY_SQL = """
+    SELECT s.summary,
+           COALESCE(s.message_count, 0),
+           COALESCE(m.messages, CASE WHEN s.conversation_id IS NULL AND jsonb_typeof(c.history) = 'array' THEN c.history END)
+    FROM bot_conversations c
+    LEFT JOIN bot_conversation_summaries s ON s.conversation_id = c.conversation_id
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(recent.data ORDER BY recent.seq) AS messages
+        FROM (
+            SELECT seq, data FROM bot_conversation_messages
+            WHERE conversation_id = c.conversation_id
+              AND seq > COALESCE(s.through_seq, 0)
+            ORDER BY seq DESC
+            LIMIT %(limit)s
+        ) recent
+    ) m ON TRUE
+    WHERE c.conversation_id = %(conversation_id)s
+"""
+
+SAVE_SUMMARY_SQL = """
+    INSERT INTO bot_conversation_summaries (conversation_id, summary, through_seq, message_count, tokens, updated_at)
+    VALUES (%s, %s, %s, %s, %s, NOW())
+    ON CONFLICT (conversation_id) DO UPDATE
+    SET summary = EXCLUDED.summary,
+        through_seq = EXCLUDED.through_seq,
+        message_count = EXCLUDED.message_count,
+        tokens = EXCLUDED.tokens,
+        updated_at = NOW()
+    WHERE bot_conversation_summaries.through_seq < EXCLUDED.through_seq
+"""
+
+
+def _tail(messages, limit):
+    if not isinstance(messages, list):
+        return []
+    return messages[-limit:] if limit and len(messages) > limit else messages
+
+
+def append_messages(conn, conversation_id: str, messages: list, updated_at=None) -> bool:
+    """
+    Appends messages ({role, text, timestamp}) to a conversation and bumps its updated_at.
+    Commits. Returns False on error (like run_write_query).
+    """
+    return append_message_batches(conn, {conversation_id: (messages, updated_at)})
+
+
+def append_message_batches(conn, batches: dict, new_conversations: list = None) -> bool:
+    """
+    Appends messages to several conversations in one transaction.
+    batches: {conversation_id: (messages, updated_at or None)}, messages in order.
+    new_conversations: bot_conversations rows ({conversation_id, user_id, user_email,
+    user_plan, chatbot_id, title, created_at}) to insert first unless they exist.
+    Commits. Returns False on error (like run_write_query).
+    """
+    batches = {cid: batch for cid, batch in batches.items() if batch[0]}
+    if not batches:
+        return True
+    now = datetime.now(timezone.utc)
+    conversation_ids = sorted(batches)
+    try:
+        with conn.cursor() as cur:
+            if new_conversations:
+                execute_values(cur, """
+                    INSERT INTO bot_conversations (conversation_id, user_id, user_email, user_plan, chatbot_id, title, history, created_at, updated_at)
+                    SELECT v.conversation_id, v.user_id, v.user_email, v.user_plan, v.chatbot_id, v.title, '[]'::jsonb, v.created_at, v.created_at
+                    FROM (VALUES %s) AS v(conversation_id, user_id, user_email, user_plan, chatbot_id, title, created_at)
+                    WHERE NOT EXISTS (SELECT 1 FROM bot_conversations c WHERE c.conversation_id = v.conversation_id)
+                """, [
+                    (c["conversation_id"], c.get("user_id"), c.get("user_email"), c.get("user_plan"),
+                     c.get("chatbot_id"), c.get("title"), c.get("created_at") or now)
+                    for c in new_conversations
+                ], template="(%s, %s, %s, %s, %s, %s, %s::timestamptz)")
+            # Locking the conversation rows orders concurrent appends and the one-off
+            # legacy copy. Touching updated_at does not rewrite the TOASTed history.
+            cur.execute(LOCK_CONVERSATIONS_SQL, (conversation_ids,))
+            execute_values(cur, """
+                UPDATE bot_conversations c SET updated_at = v.updated_at
+                FROM (VALUES %s) AS v(conversation_id, updated_at)
+                WHERE c.conversation_id = v.conversation_id
+            """, [(cid, batches[cid][1] or now) for cid in conversation_ids], template="(%s, %s::timestamptz)")
+            cur.execute(COPY_LEGACY_HISTORY_SQL, {"conversation_ids": conversation_ids})
+            execute_values(cur, """
+                INSERT INTO bot_conversation_messages (conversation_id, role, text, data)
+                VALUES %s
+            """, [
+                (cid, m.get("role"), m.get("text"), Json(m))
+                for cid, (messages, _) in batches.items()
+                for m in messages
+            ], page_size=1000)
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error appending messages to {len(batches)} conversation(s): {e}")
+        return False
+
+
+def get_recent_messages(conversation_id: str, limit: int = CHAT_HISTORY_LIMIT, conn=None):
+    """
+    Returns the last `limit` messages (all when limit is None), oldest first,
+    or None if the conversation does not exist.
+    """
+    if conn is None:
+        with get_db_connection() as new_conn:
+            return get_recent_messages(conversation_id, limit, new_conn)
+
+    rows = run_query(conn, RECENT_MESSAGES_SQL, {"conversation_id": conversation_id, "limit": limit})
+    if not rows:
+        return None
+    return _tail(rows[0][1], limit)
+
+
+async def fetch_recent_messages(conversation_id: str, limit: int = CHAT_HISTORY_LIMIT):
+    """
+    Async variant of get_recent_messages for request handlers.
+    """
+    from DB.async_pool import fetch_one
+
+    row = await fetch_one(RECENT_MESSAGES_SQL, {"conversation_id": conversation_id, "limit": limit})
+    if not row:
+        return None
+    return _tail(row[1], limit)
+
+
+async def fetch_prompt_history(conversation_id: str, limit: int = CHAT_HISTORY_LIMIT):
+    """
+    Returns (summary or None, messages covered by the summary, last `limit`
+    messages after it), or None if the conversation does not exist.
+    """
+    from DB.async_pool import fetch_one
+
+    row = await fetch_one(PROMPT_HISTORY_SQL, {"conversation_id": conversation_id, "limit": limit})
+    if not row:
+        return None
+    return row[0], row[1], _tail(row[2], limit)
+
+
+def get_unsummarized_messages(conn, conversation_id: str):
+    """
+    Returns (summary or None, messages covered by the summary, [(seq, message), ...]
+    after the summary, oldest first).
+    """
+    rows = run_query(conn, """
+        SELECT summary, message_count, through_seq FROM bot_conversation_summaries WHERE conversation_id = %s
+    """, (conversation_id,))
+    summary, message_count, through_seq = rows[0] if rows else (None, 0, 0)
+    messages = run_query(conn, """
+        SELECT seq, data FROM bot_conversation_messages
+        WHERE conversation_id = %s AND seq > %s
+        ORDER BY seq
+    """, (conversation_id, through_seq))
+    return summary, message_count, messages or []
+
+
+def save_summary(conn, conversation_id: str, summary: str, through_seq: int, message_count: int, tokens: int = None) -> bool:
+    """Stores a summary unless a newer one (covering more messages) is already saved."""
+    return run_write_query(conn, SAVE_SUMMARY_SQL, (conversation_id, summary, through_seq, message_count, tokens))
@@ -0,0 +1,147 @@
+"""
+In-process exact vector search for small knowledge bases.
+
+Most chatbots have a few thousand chunks, where a brute-force cosine
+similarity over a contiguous NumPy matrix is faster than a round-trip to
+Postgres. search_vectors routes tenants with at most
+LOCAL_VECTOR_SEARCH_MAX_CHUNKS chunks here.
+
+Each tenant's matrix is keyed by its training generation (reloaded after
+retraining), and the total size across tenants is bounded by
+LOCAL_VECTOR_SEARCH_MEMORY_MB with LRU eviction. A tenant that would not
+fit in that budget on its own is never made resident (search returns None
+and the caller queries Postgres).
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, search_vectors falls back to Postgres
+    np = None
+
+from utils import metrics
+
+LOCAL_VECTOR_SEARCH_ENABLED = os.getenv("LOCAL_VECTOR_SEARCH", "true").lower() == "true"
+LOCAL_VECTOR_SEARCH_MAX_CHUNKS = int(os.getenv("LOCAL_VECTOR_SEARCH_MAX_CHUNKS", "5000"))
+LOCAL_VECTOR_SEARCH_MEMORY_MB = int(os.getenv("LOCAL_VECTOR_SEARCH_MEMORY_MB", "512"))
+LOCAL_VECTOR_SEARCH_DTYPE = os.getenv("LOCAL_VECTOR_SEARCH_DTYPE", "float32")
+LOAD_LOCK_STRIPES = 64
+
+
+class _TenantIndex:
+    __slots__ = ("generation", "matrix", "contents", "nbytes")
+
+    def __init__(self, generation, matrix, contents):
+        self.generation = generation
+        self.matrix = matrix
+        self.contents = contents
+        self.nbytes = matrix.nbytes + sum(len(c) for c in contents)
+
+
+class LocalVectorIndex:
+    def __init__(self, max_bytes: int, dtype: str = "float32"):
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self._tenants = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # Striped so the number of locks stays fixed however many tenants are seen
+        self._load_locks = [threading.Lock() for _ in range(LOAD_LOCK_STRIPES)]
+
+    @property
+    def enabled(self) -> bool:
+        return LOCAL_VECTOR_SEARCH_ENABLED and np is not None
+
+    def search(self, chatbot_id: str, generation: int, query_vector: list, limit: int, loader, rows: int = None):
+        """
+        Top-k cosine similarity for one tenant.
+        loader() returns [(content, embedding_list)] and is only called when the
+        tenant is not resident at this generation. rows (the tenant's chunk count)
+        lets a tenant too large for the memory budget be refused without loading it.
+        Returns: [{'content': str, 'similarity': float}], or None when the tenant
+        does not fit in the budget.
+        """
+        if rows and rows * len(query_vector) * np.dtype(self.dtype).itemsize > self.max_bytes:
+            metrics.increment("local_vector_index.oversized")
+            return None
+        index = self._get_or_load(chatbot_id, generation, loader)
+        if index is None:
+            return None
+        if not len(index.contents):
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query /= norm
+
+        scores = (index.matrix @ query.astype(index.matrix.dtype)).astype(np.float32)
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{"content": index.contents[i], "similarity": float(scores[i])} for i in top]
+
+    def _get_or_load(self, chatbot_id: str, generation: int, loader):
+        index = self._get(chatbot_id, generation)
+        if index is not None:
+            return index
+
+        # One load per tenant at a time; concurrent requests wait for it
+        with self._load_locks[hash(chatbot_id) % LOAD_LOCK_STRIPES]:
+            index = self._get(chatbot_id, generation)
+            if index is not None:
+                return index
+
+            start = time.perf_counter()
+            rows = loader()
+            contents = [r[0] for r in rows]
+            matrix = np.asarray([r[1] for r in rows], dtype=np.float32).reshape(len(rows), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            matrix = np.ascontiguousarray(matrix / norms, dtype=self.dtype)
+            index = _TenantIndex(generation, matrix, contents)
+            metrics.observe("local_vector_index.load", time.perf_counter() - start)
+
+            if index.nbytes > self.max_bytes:
+                # Would evict every other tenant and still be over budget
+                metrics.increment("local_vector_index.oversized")
+                logging.info(f"Local vector index: {chatbot_id} ({index.nbytes} bytes) exceeds the memory budget")
+                return None
+            self._put(chatbot_id, index)
+            return index
+
+    def _get(self, chatbot_id: str, generation: int):
+        with self._lock:
+            index = self._tenants.get(chatbot_id)
+            if index is None or index.generation != generation:
+                return None
+            self._tenants.move_to_end(chatbot_id)
+            return index
+
+    def _put(self, chatbot_id: str, index: _TenantIndex):
+        with self._lock:
+            old = self._tenants.pop(chatbot_id, None)
+            if old is not None:
+                self._total_bytes -= old.nbytes
+            self._tenants[chatbot_id] = index
+            self._total_bytes += index.nbytes
+
+            while self._total_bytes > self.max_bytes and len(self._tenants) > 1:
+                evicted_id, evicted = self._tenants.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+                metrics.increment("local_vector_index.evictions")
+                logging.info(f"Local vector index evicted {evicted_id} ({evicted.nbytes} bytes)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"tenants": len(self._tenants), "bytes": self._total_bytes}
+
+
+# Global instance
+local_vector_index = LocalVectorIndex(LOCAL_VECTOR_SEARCH_MEMORY_MB * 1024 * 1024, LOCAL_VECTOR_SEARCH_DTYPE)
+metrics.register_gauge("local_vector_index", local_vector_index.stats)
@@ -0,0 +1,27 @@
+-- Migrates training_chunks from the global ivfflat index to HNSW.
+--
+-- The old `ivfflat (lists = 100)` index probed neighbours across every tenant
+-- and filtered by chatbot_id afterwards, so small chatbots got fewer than
+-- `limit` results. search_vectors now scans tenants with at most
+-- VECTOR_EXACT_SEARCH_MAX_CHUNKS chunks exactly and uses this HNSW index with
+-- iterative scan (pgvector >= 0.8.0) for larger ones.
+--
+-- Run with psql outside a transaction block (CONCURRENTLY keeps the table writable):
+--     psql "$DATABASE_URL" -f DB/migrations/001_hnsw_vector_index.sql
+
+\set ON_ERROR_STOP on
+
+-- Optional: upgrade pgvector first to enable iterative scans.
+-- ALTER EXTENSION vector UPDATE;
+
+SET maintenance_work_mem = '2GB';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS training_chunks_embedding_hnsw_idx
+    ON training_chunks
+    USING hnsw (embedding vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+-- Only drop the legacy index once the HNSW build above has succeeded.
+DROP INDEX CONCURRENTLY IF EXISTS training_chunks_embedding_idx;
+
+ANALYZE training_chunks;
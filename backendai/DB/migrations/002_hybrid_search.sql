@@ -0,0 +1,30 @@
+-- Adds full-text search to training_chunks for hybrid (keyword + vector) retrieval.
+--
+-- Embeddings miss exact tokens such as product names, SKUs and error codes.
+-- search_vectors in 'hybrid' mode ranks chunks by both cosine distance and
+-- ts_rank_cd over this column and fuses the two lists with reciprocal rank fusion.
+--
+-- Adding a STORED generated column rewrites the table under an ACCESS EXCLUSIVE
+-- lock; run it in a maintenance window on large installs. The GIN index is
+-- built CONCURRENTLY so it does not block writes.
+--     psql "$DATABASE_URL" -f DB/migrations/002_hybrid_search.sql
+
+\set ON_ERROR_STOP on
+
+ALTER TABLE training_chunks
+    ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+
+SET maintenance_work_mem = '1GB';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_training_chunks_content_tsv
+    ON training_chunks
+    USING gin (content_tsv);
+
+CREATE TABLE IF NOT EXISTS chatbot_retrieval_settings (
+    chatbot_id VARCHAR(255) PRIMARY KEY,
+    retrieval_mode VARCHAR(32) NOT NULL DEFAULT 'vector',
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+ANALYZE training_chunks;
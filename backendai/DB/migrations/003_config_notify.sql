@@ -0,0 +1,47 @@
+-- Notifies backendai workers when cached chatbot configuration changes.
+--
+-- DB/config_cache.py keeps organization type, pre-chat form and the
+-- chatbot -> organization mapping in memory. Each worker LISTENs on
+-- 'chatbot_config_changed' and drops the affected entries when these
+-- triggers fire, so edits made through rtserver apply on the next message
+-- instead of after CHATBOT_CONFIG_CACHE_TTL.
+--     psql "$DATABASE_URL" -f DB/migrations/003_config_notify.sql
+
+\set ON_ERROR_STOP on
+
+CREATE OR REPLACE FUNCTION notify_chatbot_config_change() RETURNS trigger AS $$
+DECLARE
+    payload json;
+BEGIN
+    IF TG_TABLE_NAME = 'organizations' THEN
+        IF TG_OP = 'DELETE' THEN
+            payload := json_build_object('organization_id', OLD.id);
+        ELSE
+            payload := json_build_object('organization_id', NEW.id);
+        END IF;
+    ELSE
+        IF TG_OP = 'DELETE' THEN
+            payload := json_build_object('chatbot_id', OLD.chatbot_id);
+        ELSE
+            payload := json_build_object('chatbot_id', NEW.chatbot_id);
+        END IF;
+    END IF;
+    PERFORM pg_notify('chatbot_config_changed', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chatbot_config_notify ON forms;
+CREATE TRIGGER chatbot_config_notify
+    AFTER INSERT OR UPDATE OF pre_chat_form, chatbot_id OR DELETE ON forms
+    FOR EACH ROW EXECUTE FUNCTION notify_chatbot_config_change();
+
+DROP TRIGGER IF EXISTS chatbot_config_notify ON chatbots;
+CREATE TRIGGER chatbot_config_notify
+    AFTER UPDATE OF organization_id OR DELETE ON chatbots
+    FOR EACH ROW EXECUTE FUNCTION notify_chatbot_config_change();
+
+DROP TRIGGER IF EXISTS chatbot_config_notify ON organizations;
+CREATE TRIGGER chatbot_config_notify
+    AFTER UPDATE OF organization_type OR DELETE ON organizations
+    FOR EACH ROW EXECUTE FUNCTION notify_chatbot_config_change();
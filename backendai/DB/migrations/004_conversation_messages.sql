@@ -0,0 +1,46 @@
+-- Moves chat history out of the bot_conversations.history JSONB array.
+--
+-- Each append to the array rewrote the whole (TOASTed) value, so a long
+-- conversation cost O(n^2) bytes written, and every chat turn read the full
+-- array back. DB/conversation_store.py stores one row per message in
+-- bot_conversation_messages instead and reads only the last N rows.
+--
+-- This creates the table (init_vector_db also does on startup) and copies
+-- existing arrays into it. Conversations that already have rows are skipped,
+-- so the script can be re-run; conversations not copied yet are migrated on
+-- their next append by the application. The history column is left in place
+-- (readers fall back to it) and can be dropped once nothing reads it.
+--     psql "$DATABASE_URL" -f DB/migrations/004_conversation_messages.sql
+--
+-- On very large tables, run the INSERT per range of bot_conversations.id to
+-- keep transactions short.
+
+\set ON_ERROR_STOP on
+
+CREATE TABLE IF NOT EXISTS bot_conversation_messages (
+    seq BIGSERIAL PRIMARY KEY,
+    conversation_id VARCHAR(255) NOT NULL,
+    role VARCHAR(32),
+    text TEXT,
+    data JSONB NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_bot_conversation_messages_conversation
+    ON bot_conversation_messages(conversation_id, seq);
+
+INSERT INTO bot_conversation_messages (conversation_id, role, text, data, created_at)
+SELECT c.conversation_id,
+       e.msg->>'role',
+       e.msg->>'text',
+       e.msg,
+       COALESCE(c.updated_at, NOW())
+FROM bot_conversations c
+CROSS JOIN LATERAL jsonb_array_elements(c.history) WITH ORDINALITY AS e(msg, ord)
+WHERE jsonb_typeof(c.history) = 'array'
+  AND NOT EXISTS (
+      SELECT 1 FROM bot_conversation_messages m WHERE m.conversation_id = c.conversation_id
+  )
+ORDER BY c.id, e.ord;
+
+ANALYZE bot_conversation_messages;
@@ -0,0 +1,48 @@
+-- Durable training job queue.
+--
+-- /api/ingest used to start training in a daemon thread of the API worker,
+-- so a deploy or crash lost the job and left automations.training_status
+-- at 'training'. Jobs are now rows of training_jobs, claimed with
+-- FOR UPDATE SKIP LOCKED by training_worker.py processes (DB/training_jobs.py).
+--
+-- init_vector_db creates the same table on startup; this script is for
+-- databases where the application role cannot run DDL. It also fails
+-- trainings left at 'training' by the old threads, since nothing will finish them.
+--     psql "$DATABASE_URL" -f DB/migrations/005_training_jobs.sql
+
+\set ON_ERROR_STOP on
+
+CREATE TABLE IF NOT EXISTS training_jobs (
+    job_id VARCHAR(64) PRIMARY KEY,
+    chatbot_id VARCHAR(255) NOT NULL,
+    organization_id INTEGER,
+    webhook_url TEXT,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    worker_id VARCHAR(255),
+    heartbeat_at TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Due jobs, oldest first
+CREATE INDEX IF NOT EXISTS idx_training_jobs_due ON training_jobs(run_after, created_at) WHERE status = 'queued';
+-- Per-organization concurrency check
+CREATE INDEX IF NOT EXISTS idx_training_jobs_running ON training_jobs(organization_id) WHERE status = 'running';
+-- One active job per chatbot
+CREATE UNIQUE INDEX IF NOT EXISTS idx_training_jobs_active_chatbot ON training_jobs(chatbot_id) WHERE status IN ('queued', 'running');
+
+-- Trainings orphaned by the thread-based runner
+UPDATE automations a
+SET training_status = 'failed',
+    training_message = 'Training was interrupted, please start it again'
+WHERE a.training_status = 'training'
+  AND NOT EXISTS (
+      SELECT 1 FROM training_jobs j
+      WHERE j.organization_id = a.organization_id AND j.status IN ('queued', 'running')
+  );
@@ -0,0 +1,13 @@
+-- Per-page checkpoints of training jobs.
+--
+-- A failed training job used to start over on retry: sources were only
+-- marked trained at the end of the run. The ingestion pipeline now records
+-- the id of the job that finished each page in training_pages.checkpoint, and
+-- a retry of the same job skips those pages (controller/ingestion_pipeline.py).
+--
+-- init_vector_db also adds the column on startup; the script can be re-run.
+--     psql "$DATABASE_URL" -f DB/migrations/006_training_checkpoints.sql
+
+\set ON_ERROR_STOP on
+
+ALTER TABLE training_pages ADD COLUMN IF NOT EXISTS checkpoint VARCHAR(64);
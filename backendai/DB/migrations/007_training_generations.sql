@@ -0,0 +1,18 @@
+-- Per-chatbot training generation shared across processes.
+--
+-- Retrieval caches and local vector indexes are keyed by a chatbot's training
+-- generation, which was kept in process memory unless REDIS_URL was set.
+-- Training runs in training_worker.py, a separate process, so its bumps never
+-- reached the API processes and stale results were served after retraining.
+-- The counter now lives in this table (DB/training_generation.py).
+--
+-- init_vector_db also creates the table on startup; the script can be re-run.
+--     psql "$DATABASE_URL" -f DB/migrations/007_training_generations.sql
+
+\set ON_ERROR_STOP on
+
+CREATE TABLE IF NOT EXISTS chatbot_training_generations (
+    chatbot_id VARCHAR(255) PRIMARY KEY,
+    generation BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
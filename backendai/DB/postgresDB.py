@@ -1,8 +1,16 @@
 import os
+import time
+import array
+import hashlib
 import psycopg2
 from psycopg2 import sql
 from dotenv import load_dotenv
 
+from DB.training_generation import get_generation, bump_generation
+from DB.local_vector_index import local_vector_index, LOCAL_VECTOR_SEARCH_MAX_CHUNKS
+from utils import metrics
+from utils.ttl_cache import TTLCache
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -35,14 +43,64 @@ DB_CONFIG = {
     "port": DB_PORT,
 }
 
+# Retrieval result cache, invalidated through the per-chatbot training generation
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "10000"))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))
+retrieval_cache = TTLCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+metrics.register_gauge("retrieval_cache.size", lambda: len(retrieval_cache))
+metrics.register_gauge("retrieval_cache.hit_rate", lambda: metrics.hit_rate("retrieval_cache"))
+
+# Hybrid retrieval: full-text + vector lists fused with reciprocal rank fusion
+RETRIEVAL_MODES = ("vector", "hybrid")
+DEFAULT_RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE_DEFAULT", "vector")
+TEXT_SEARCH_CONFIG = "english"
+RRF_K = 60
+HYBRID_CANDIDATES = 20
+retrieval_mode_cache = TTLCache(10000, ttl=60)
+
+# Vector search strategy (see search_vectors)
+EXACT_SEARCH_MAX_CHUNKS = int(os.getenv("VECTOR_EXACT_SEARCH_MAX_CHUNKS", "20000"))
+HNSW_EF_SEARCH = int(os.getenv("VECTOR_HNSW_EF_SEARCH", "100"))
+tenant_size_cache = TTLCache(50000)
+_pgvector_iterative_scan = None
+_content_tsv_available = None
+
 # Debug logging
 print(f"PostgreSQL Config: host={DB_HOST}, port={DB_PORT}, dbname={DB_NAME}, user={DB_USERNAME}")
 
-from psycopg2 import pool
+from DB.connection_pool import ConnectionPool
 
 # Global Connection Pool
 pg_pool = None
 
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "50"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))          # seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))       # close connections idle longer than this
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))  # validate connections idle longer than this
+
+DB_KEEPALIVES = dict(keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
+
+# CRM pool (pipelines live in CRM_DB_NAME); only created when it differs from DB_NAME
+crm_pg_pool = None
+CRM_DB_POOL_MIN = int(os.getenv("CRM_DB_POOL_MIN", "0"))
+CRM_DB_POOL_MAX = int(os.getenv("CRM_DB_POOL_MAX", "10"))
+CRM_USES_MAIN_POOL = CRM_DB_NAME == DB_NAME
+
+def _create_pool(minconn, maxconn, name, **db_args):
+    # TCP keepalives let the OS notice connections dropped by RDS failovers or NAT timeouts
+    db_args.update(DB_KEEPALIVES)
+    return ConnectionPool(
+        minconn, maxconn,
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_POOL_MAX_IDLE,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        check_after=DB_POOL_CHECK_AFTER,
+        name=name,
+        **db_args
+    )
+
 def init_db_pool():
     global pg_pool
     try:
@@ -56,15 +114,32 @@ def init_db_pool():
         if DB_SCHEMA and DB_SCHEMA != "public":
              db_args["options"] = f"-c search_path={DB_SCHEMA},public"
 
-        pg_pool = pool.SimpleConnectionPool(1, 50, **db_args)
+        pg_pool = _create_pool(DB_POOL_MIN, DB_POOL_MAX, "db_pool", **db_args)
         if pg_pool:
             print("PostgreSQL Connection Pool created successfully")
     except (Exception, psycopg2.DatabaseError) as error:
         print("Error while connecting to PostgreSQL", error)
 
+def init_crm_pool():
+    global crm_pg_pool
+    try:
+        db_args = DB_CONFIG.copy()
+        db_args["dbname"] = CRM_DB_NAME
+        crm_pg_pool = _create_pool(CRM_DB_POOL_MIN, CRM_DB_POOL_MAX, "crm_db_pool", **db_args)
+        print("CRM PostgreSQL Connection Pool created successfully")
+    except (Exception, psycopg2.DatabaseError) as error:
+        print("Error while connecting to CRM PostgreSQL", error)
+
+def close_db_pools():
+    """Closes the main and CRM pools (called on shutdown)."""
+    for pool in (pg_pool, crm_pg_pool):
+        if pool:
+            pool.closeall()
+
 def postgres_connection():
     """
-    Get a connection from the pool.
+    Get a connection from the pool (waits up to DB_POOL_TIMEOUT seconds when all are in use).
+    Must be returned with release_connection / close_db_connection, or use get_db_connection().
     """
     global pg_pool
     if not pg_pool:
@@ -108,13 +183,19 @@ def get_pre_chat_form(chatbot_id, conn=None):
     with get_db_connection() as new_conn:
         return get_pre_chat_form(chatbot_id, new_conn)
 
-def get_customer_by_email(chatbot_id: str, email: str, conn=None):
+def get_customer_by_email(chatbot_id: str, email: str, conn=None, context=None):
     """
     Looks up a customer by email for a given chatbot's organization.
+    Pass a ChatbotConfig or ChatbotContext to reuse its organization_id (and customer, if the email matches).
     Returns: dict with {name, phone, email} or None if not found
     """
+    if context is not None:
+        customer = context.customer_for(email)
+        if customer:
+            return {"email": customer["email"], "name": customer["name"], "phone": customer["phone"]}
+
     # 1. Get Org ID from Chatbot DB
-    org_id = None
+    org_id = context.organization_id if context is not None else None
     
     # helper to run query on specific connection
     def query_db(connection, q, p):
@@ -123,17 +204,18 @@ def get_customer_by_email(chatbot_id: str, email: str, conn=None):
             return cur.fetchall()
 
     if conn:
-        try:
-            org_query = "SELECT organization_id FROM chatbots WHERE chatbot_id = %s"
-            org_result = query_db(conn, org_query, (chatbot_id,))
-            if org_result and org_result[0]:
-                org_id = org_result[0][0]
-        except Exception as e:
-            print(f"Error finding org in chatbot db: {e}")
-            return None
+        if org_id is None:
+            try:
+                org_query = "SELECT organization_id FROM chatbots WHERE chatbot_id = %s"
+                org_result = query_db(conn, org_query, (chatbot_id,))
+                if org_result and org_result[0]:
+                    org_id = org_result[0][0]
+            except Exception as e:
+                print(f"Error finding org in chatbot db: {e}")
+                return None
     else:
         with get_db_connection() as cb_conn:
-            return get_customer_by_email(chatbot_id, email, cb_conn)
+            return get_customer_by_email(chatbot_id, email, cb_conn, context)
             
     if not org_id:
         return None
@@ -169,31 +251,52 @@ def get_customer_by_email(chatbot_id: str, email: str, conn=None):
         return None
 
 
+@contextmanager
 def get_crm_db_connection():
     """
-    Establishes a connection to the CRM database.
-    This is separate from the Chatbot DB pool.
+    Pooled connection to the CRM database, returned to its pool on exit.
+    Uses the main pool when CRM_DB_NAME is the chatbot database.
+    Yields None when no connection can be obtained.
     """
+    if CRM_USES_MAIN_POOL:
+        getconn, putconn = postgres_connection, release_connection
+    else:
+        if not crm_pg_pool:
+            init_crm_pool()
+
+        def getconn():
+            return crm_pg_pool.getconn() if crm_pg_pool else None
+
+        def putconn(conn):
+            try:
+                crm_pg_pool.putconn(conn)
+            except Exception as e:
+                print(f"Error releasing CRM connection: {e}")
+
     try:
-        conn = psycopg2.connect(
-            dbname=CRM_DB_NAME,
-            user=DB_USERNAME,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        return conn
+        conn = getconn()
     except Exception as e:
         print(f"Error connecting to CRM DB: {e}")
-        return None
+        conn = None
+    try:
+        yield conn
+    finally:
+        if conn:
+            putconn(conn)
 
-def move_customer_to_pipeline(chatbot_id: str, email: str, conn=None):
+
+def move_customer_to_pipeline(chatbot_id: str, email: str, conn=None, context=None):
     """
     Moves a customer to the 'default_customers' pipeline for the organization.
     Adds them to the first stage.
+    Pass a ChatbotConfig or ChatbotContext to reuse its organization_id (and customer id).
     """
     # 1. Get Org ID from Chatbot DB (conn provided or new)
-    org_id = None
+    org_id = context.organization_id if context is not None else None
+    customer = context.customer_for(email) if context is not None else None
+    if org_id and customer:
+        with get_crm_db_connection() as crm_conn:
+            return _add_customer_to_default_pipeline(crm_conn, org_id, customer["id"])
     
     # helper to run query on specific connection
     def query_db(connection, q, p):
@@ -202,18 +305,19 @@ def move_customer_to_pipeline(chatbot_id: str, email: str, conn=None):
             return cur.fetchall()
 
     if conn:
-        try:
-            org_query = "SELECT organization_id FROM chatbots WHERE chatbot_id = %s"
-            org_result = query_db(conn, org_query, (chatbot_id,))
-            if org_result and org_result[0]:
-                org_id = org_result[0][0]
-        except Exception as e:
-            print(f"Error finding org in chatbot db: {e}")
-            return False
+        if org_id is None:
+            try:
+                org_query = "SELECT organization_id FROM chatbots WHERE chatbot_id = %s"
+                org_result = query_db(conn, org_query, (chatbot_id,))
+                if org_result and org_result[0]:
+                    org_id = org_result[0][0]
+            except Exception as e:
+                print(f"Error finding org in chatbot db: {e}")
+                return False
     else:
         # Create temp connection for chatbot DB
         with get_db_connection() as cb_conn:
-            return move_customer_to_pipeline(chatbot_id, email, cb_conn)
+            return move_customer_to_pipeline(chatbot_id, email, cb_conn, context)
             
     if not org_id:
         print(f"Organization not found for chatbot {chatbot_id}")
@@ -239,7 +343,11 @@ def move_customer_to_pipeline(chatbot_id: str, email: str, conn=None):
         return False
         
     # 3. Connect to CRM DB for Pipeline operations ONLY
-    crm_conn = get_crm_db_connection()
+    with get_crm_db_connection() as crm_conn:
+        return _add_customer_to_default_pipeline(crm_conn, org_id, customer_id)
+
+def _add_customer_to_default_pipeline(crm_conn, org_id, customer_id):
+    """Appends the customer to the first stage of the org's default pipeline (CRM DB)."""
     if not crm_conn:
         print("Failed to connect to CRM DB")
         return False
@@ -253,7 +361,7 @@ def move_customer_to_pipeline(chatbot_id: str, email: str, conn=None):
             ORDER BY created_at ASC 
             LIMIT 1
         """
-        pipe_result = query_db(crm_conn, pipe_query, (org_id,))
+        pipe_result = run_query(crm_conn, pipe_query, (org_id,))
         
         if not pipe_result or not pipe_result[0]:
             print("Default pipeline not found in CRM DB")
@@ -300,15 +408,14 @@ def move_customer_to_pipeline(chatbot_id: str, email: str, conn=None):
         print(f"Error in CRM DB operations: {e}")
         if crm_conn: crm_conn.rollback()
         return False
-    finally:
-        if crm_conn: crm_conn.close()
 
-def save_customer(chatbot_id: str, email: str, custom_data: dict, conn=None):
+def save_customer(chatbot_id: str, email: str, custom_data: dict, conn=None, context=None):
     """
     Saves or updates a customer in the Chatbot DB.
+    Pass a ChatbotConfig or ChatbotContext to reuse its organization_id.
     """
     # 1. Get Org ID from Chatbot DB
-    org_id = None
+    org_id = context.organization_id if context is not None else None
     
     # helper to run query on specific connection
     def query_db(connection, q, p):
@@ -327,10 +434,11 @@ def save_customer(chatbot_id: str, email: str, custom_data: dict, conn=None):
         if not target_conn:
              return False
 
-        org_query = "SELECT organization_id FROM chatbots WHERE chatbot_id = %s"
-        org_result = query_db(target_conn, org_query, (chatbot_id,))
-        if org_result and org_result[0]:
-            org_id = org_result[0][0]
+        if org_id is None:
+            org_query = "SELECT organization_id FROM chatbots WHERE chatbot_id = %s"
+            org_result = query_db(target_conn, org_query, (chatbot_id,))
+            if org_result and org_result[0]:
+                org_id = org_result[0][0]
             
         if not org_id:
             print(f"Organization not found for chatbot {chatbot_id}")
@@ -509,17 +617,124 @@ def init_vector_db():
                     END $$;
                 """)
                 
-                # Index on training_chunks
-                cur.execute("""
-                    CREATE INDEX IF NOT EXISTS training_chunks_embedding_idx 
-                    ON training_chunks 
-                    USING ivfflat (embedding vector_cosine_ops)
-                    WITH (lists = 100);
-                """)
+                # ANN index on training_chunks: HNSW (small tenants are searched exactly, see search_vectors).
+                # Existing deployments still on the global ivfflat index migrate with
+                # DB/migrations/001_hnsw_vector_index.sql (CONCURRENTLY, so not at import time).
+                cur.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'training_chunks_embedding_idx';")
+                if cur.fetchone():
+                    print("Legacy ivfflat index on training_chunks found - run DB/migrations/001_hnsw_vector_index.sql")
+                else:
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS training_chunks_embedding_hnsw_idx
+                        ON training_chunks
+                        USING hnsw (embedding vector_cosine_ops)
+                        WITH (m = 16, ef_construction = 64);
+                    """)
                 
                 cur.execute("CREATE INDEX IF NOT EXISTS idx_training_chunks_chatbot_id ON training_chunks(chatbot_id);")
                 cur.execute("CREATE INDEX IF NOT EXISTS idx_training_chunks_source ON training_chunks(source);")
 
+                # Incremental retraining: chunks remember their page and content hash so unchanged
+                # pages are skipped and identical chunks reuse an existing embedding.
+                # heading_path is the Markdown section a chunk came from (see utils/markdown_chunker.py)
+                cur.execute("""
+                    ALTER TABLE training_chunks
+                    ADD COLUMN IF NOT EXISTS page_url TEXT,
+                    ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64),
+                    ADD COLUMN IF NOT EXISTS heading_path TEXT;
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_training_chunks_content_hash ON training_chunks(chatbot_id, content_hash);")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_training_chunks_page ON training_chunks(chatbot_id, page_url);")
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS training_pages (
+                        chatbot_id VARCHAR(255) NOT NULL,
+                        page_url TEXT NOT NULL,
+                        source VARCHAR(512),
+                        etag TEXT,
+                        last_modified TEXT,
+                        body_hash VARCHAR(64),
+                        updated_at TIMESTAMPTZ DEFAULT NOW(),
+                        PRIMARY KEY (chatbot_id, page_url)
+                    );
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_training_pages_source ON training_pages(chatbot_id, source);")
+                # Training job that last completed the page; a resumed job skips its own pages
+                cur.execute("ALTER TABLE training_pages ADD COLUMN IF NOT EXISTS checkpoint VARCHAR(64);")
+
+                # Full-text column for hybrid retrieval. Adding a stored generated column rewrites
+                # the table under ACCESS EXCLUSIVE, so it is never done at startup; until the
+                # migration has run, hybrid retrieval falls back to vector search.
+                cur.execute("SELECT 1 FROM information_schema.columns WHERE table_name='training_chunks' AND column_name='content_tsv';")
+                if not cur.fetchone():
+                    print("training_chunks.content_tsv missing - run DB/migrations/002_hybrid_search.sql")
+
+                # Append-only chat history (see DB/conversation_store.py); existing
+                # bot_conversations.history arrays are copied by DB/migrations/004_conversation_messages.sql
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS bot_conversation_messages (
+                        seq BIGSERIAL PRIMARY KEY,
+                        conversation_id VARCHAR(255) NOT NULL,
+                        role VARCHAR(32),
+                        text TEXT,
+                        data JSONB NOT NULL,
+                        created_at TIMESTAMPTZ DEFAULT NOW()
+                    );
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_bot_conversation_messages_conversation ON bot_conversation_messages(conversation_id, seq);")
+                # Rolling summary of messages up to through_seq (see controller/conversation_summary.py)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS bot_conversation_summaries (
+                        conversation_id VARCHAR(255) PRIMARY KEY,
+                        summary TEXT NOT NULL,
+                        through_seq BIGINT NOT NULL,
+                        message_count INTEGER NOT NULL,
+                        tokens INTEGER,
+                        updated_at TIMESTAMPTZ DEFAULT NOW()
+                    );
+                """)
+
+                # Durable training job queue (see DB/training_jobs.py)
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS training_jobs (
+                        job_id VARCHAR(64) PRIMARY KEY,
+                        chatbot_id VARCHAR(255) NOT NULL,
+                        organization_id INTEGER,
+                        webhook_url TEXT,
+                        status VARCHAR(16) NOT NULL DEFAULT 'queued',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        max_attempts INTEGER NOT NULL DEFAULT 3,
+                        run_after TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                        worker_id VARCHAR(255),
+                        heartbeat_at TIMESTAMPTZ,
+                        last_error TEXT,
+                        created_at TIMESTAMPTZ DEFAULT NOW(),
+                        started_at TIMESTAMPTZ,
+                        finished_at TIMESTAMPTZ,
+                        updated_at TIMESTAMPTZ DEFAULT NOW()
+                    );
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_training_jobs_due ON training_jobs(run_after, created_at) WHERE status = 'queued';")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_training_jobs_running ON training_jobs(organization_id) WHERE status = 'running';")
+                cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_training_jobs_active_chatbot ON training_jobs(chatbot_id) WHERE status IN ('queued', 'running');")
+
+                # Per-chatbot retrieval settings ('vector' or 'hybrid')
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS chatbot_retrieval_settings (
+                        chatbot_id VARCHAR(255) PRIMARY KEY,
+                        retrieval_mode VARCHAR(32) NOT NULL DEFAULT 'vector',
+                        updated_at TIMESTAMPTZ DEFAULT NOW()
+                    );
+                """)
+
+                # Training generation per chatbot, shared by the API and training worker processes
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS chatbot_training_generations (
+                        chatbot_id VARCHAR(255) PRIMARY KEY,
+                        generation BIGINT NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMPTZ DEFAULT NOW()
+                    );
+                """)
+
                 conn.commit()
                 print("Vector DB Initialized (training_chunks updated)")
     except Exception as e:
@@ -531,7 +746,10 @@ def delete_chunks(chatbot_id: str):
     """
     try:
         with get_db_connection() as conn:
-            run_write_query(conn, "DELETE FROM training_chunks WHERE chatbot_id = %s;", (chatbot_id,))
+            deleted = run_write_query(conn, "DELETE FROM training_chunks WHERE chatbot_id = %s;", (chatbot_id,))
+            run_write_query(conn, "DELETE FROM training_pages WHERE chatbot_id = %s;", (chatbot_id,))
+        if deleted:
+            bump_generation(chatbot_id)
     except Exception as e:
         print(f"Delete Chunks Error: {e}")
 
@@ -541,64 +759,438 @@ def delete_specific_chunks(chatbot_id: str, source: str):
     """
     try:
         with get_db_connection() as conn:
-            run_write_query(conn, "DELETE FROM training_chunks WHERE chatbot_id = %s AND source = %s;", (chatbot_id, source))
+            deleted = run_write_query(conn, "DELETE FROM training_chunks WHERE chatbot_id = %s AND source = %s;", (chatbot_id, source))
+            run_write_query(conn, "DELETE FROM training_pages WHERE chatbot_id = %s AND source = %s;", (chatbot_id, source))
             print(f"Deleted chunks for source: {source}")
+        if deleted:
+            bump_generation(chatbot_id)
     except Exception as e:
         print(f"Delete Specific Chunks Error: {e}")
 
+def _insert_chunks(cur, chatbot_id: str, chunks: list):
+    from psycopg2.extras import execute_values
+
+    # Ensure 'source' is in keys, default to None if missing
+    tuples = [
+        (chatbot_id, c.get('index'), c.get('content'), c.get('embedding'), c.get('source'), c.get('page_url'), c.get('content_hash'), c.get('heading_path'))
+        for c in chunks
+    ]
+
+    execute_values(cur, """
+        INSERT INTO training_chunks (chatbot_id, chunk_index, content, embedding, source, page_url, content_hash, heading_path)
+        VALUES %s
+    """, tuples)
+
 def insert_chunk_batch(chatbot_id: str, chunks: list):
     """
     Batch inserts chunks.
-    chunks: list of dicts [{'index': int, 'content': str, 'embedding': list, 'source': str}]
+    chunks: list of dicts [{'index': int, 'content': str, 'embedding': list, 'source': str,
+                            'page_url': str, 'content_hash': str, 'heading_path': str (optional)}]
     """
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                from psycopg2.extras import execute_values
-                
-                # Ensure 'source' is in keys, default to None if missing
-                tuples = [
-                    (chatbot_id, c.get('index'), c.get('content'), c.get('embedding'), c.get('source')) 
-                    for c in chunks
-                ]
-                
-                execute_values(cur, """
-                    INSERT INTO training_chunks (chatbot_id, chunk_index, content, embedding, source)
-                    VALUES %s
-                """, tuples)
-                
+                _insert_chunks(cur, chatbot_id, chunks)
             conn.commit()
+        bump_generation(chatbot_id)
     except Exception as e:
         print(f"Batch Insert Error: {e}")
 
-def search_vectors(chatbot_id: str, query_vector: list, limit: int = 5):
+def get_page_states(chatbot_id: str, source: str) -> dict:
     """
-    Searches for similar chunks.
+    Returns what was stored for each page of a source at the last training run.
+    Returns: {page_url: {'etag': str, 'last_modified': str, 'body_hash': str, 'checkpoint': str}}
+    """
+    try:
+        with get_db_connection() as conn:
+            result = run_query(conn, """
+                SELECT page_url, etag, last_modified, body_hash, checkpoint
+                FROM training_pages
+                WHERE chatbot_id = %s AND source = %s;
+            """, (chatbot_id, source))
+            conn.rollback()
+            return {r[0]: {'etag': r[1], 'last_modified': r[2], 'body_hash': r[3], 'checkpoint': r[4]} for r in result}
+    except Exception as e:
+        print(f"Get Page States Error: {e}")
+        return {}
+
+def save_page_state(chatbot_id: str, source: str, page_url: str, etag: str, last_modified: str, body_hash: str, checkpoint: str = None):
+    """
+    Upserts the validators (ETag / Last-Modified) and body hash of a trained page.
+    """
+    try:
+        with get_db_connection() as conn:
+            return run_write_query(conn, """
+                INSERT INTO training_pages (chatbot_id, page_url, source, etag, last_modified, body_hash, checkpoint, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (chatbot_id, page_url) DO UPDATE SET
+                    source = EXCLUDED.source, etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified,
+                    body_hash = EXCLUDED.body_hash, checkpoint = EXCLUDED.checkpoint, updated_at = NOW();
+            """, (chatbot_id, page_url, source, etag, last_modified, body_hash, checkpoint))
+    except Exception as e:
+        print(f"Save Page State Error: {e}")
+        return False
+
+def checkpoint_page(chatbot_id: str, page_url: str, checkpoint: str):
+    """
+    Records that a training job finished a page without rewriting it (unchanged content).
+    """
+    try:
+        with get_db_connection() as conn:
+            return run_write_query(conn, """
+                UPDATE training_pages SET checkpoint = %s
+                WHERE chatbot_id = %s AND page_url = %s;
+            """, (checkpoint, chatbot_id, page_url))
+    except Exception as e:
+        print(f"Checkpoint Page Error: {e}")
+        return False
+
+def get_embeddings_by_hash(chatbot_id: str, content_hashes: list) -> dict:
+    """
+    Looks up embeddings already stored for identical chunks of this chatbot (any source).
+    Returns: {content_hash: embedding_list}
+    """
+    if not content_hashes:
+        return {}
+    try:
+        with get_db_connection() as conn:
+            result = run_query(conn, """
+                SELECT DISTINCT ON (content_hash) content_hash, embedding::real[]
+                FROM training_chunks
+                WHERE chatbot_id = %s AND content_hash = ANY(%s) AND embedding IS NOT NULL;
+            """, (chatbot_id, list(content_hashes)))
+            conn.rollback()
+            return {r[0]: list(r[1]) for r in result}
+    except Exception as e:
+        print(f"Get Embeddings By Hash Error: {e}")
+        return {}
+
+def replace_page_chunks(chatbot_id: str, source: str, page_url: str, chunks: list, page_state: dict = None):
+    """
+    Atomically swaps the chunks of one page and records its page state.
+    Chunks stored before pages were tracked (page_url IS NULL) are dropped for the source.
+    Does not bump the training generation; the caller does once the source is written
+    (controller/ingestion_pipeline.py), so caches are not invalidated page by page.
     """
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT content, 1 - (embedding <=> %s::vector) as similarity
-                    FROM training_chunks
-                    WHERE chatbot_id = %s
-                    ORDER BY embedding <=> %s::vector
-                    LIMIT %s;
-                    """,
-                    (query_vector, chatbot_id, query_vector, limit)
-                )
-                results = cur.fetchall()
-                if not results:
-                     # Fallback to bot_assistants for legacy/transition support ??
-                     # No, we want a clean cut. But maybe helpful? 
-                     # Let's keep it strict as requested.
-                     return []
-                     
-                return [{"content": r[0], "similarity": r[1]} for r in results]
+                cur.execute("""
+                    DELETE FROM training_chunks
+                    WHERE chatbot_id = %s AND source = %s AND (page_url = %s OR page_url IS NULL);
+                """, (chatbot_id, source, page_url))
+                if chunks:
+                    _insert_chunks(cur, chatbot_id, chunks)
+                if page_state is not None:
+                    cur.execute("""
+                        INSERT INTO training_pages (chatbot_id, page_url, source, etag, last_modified, body_hash, checkpoint, updated_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+                        ON CONFLICT (chatbot_id, page_url) DO UPDATE SET
+                            source = EXCLUDED.source, etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified,
+                            body_hash = EXCLUDED.body_hash, checkpoint = EXCLUDED.checkpoint, updated_at = NOW();
+                    """, (chatbot_id, page_url, source, page_state.get('etag'), page_state.get('last_modified'),
+                          page_state.get('body_hash'), page_state.get('checkpoint')))
+            conn.commit()
+            return True
+    except Exception as e:
+        print(f"Replace Page Chunks Error: {e}")
+        return False
+
+def delete_page(chatbot_id: str, source: str, page_url: str) -> bool:
+    """
+    Removes one page's chunks and page state (the page is gone or has no text left),
+    so the next run indexes it from scratch if it comes back.
+    Does not bump the training generation (see replace_page_chunks).
+    """
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM training_chunks WHERE chatbot_id = %s AND source = %s AND page_url = %s;", (chatbot_id, source, page_url))
+                cur.execute("DELETE FROM training_pages WHERE chatbot_id = %s AND page_url = %s;", (chatbot_id, page_url))
+            conn.commit()
+            return True
+    except Exception as e:
+        print(f"Delete Page Error: {e}")
+        return False
+
+def delete_stale_pages(chatbot_id: str, source: str, current_pages: list):
+    """
+    Removes chunks and page state for pages of a source that no longer exist (e.g. dropped from the sitemap).
+    Does not bump the training generation (see replace_page_chunks).
+    """
+    try:
+        with get_db_connection() as conn:
+            run_write_query(conn, """
+                DELETE FROM training_chunks
+                WHERE chatbot_id = %s AND source = %s AND page_url IS NOT NULL AND NOT (page_url = ANY(%s));
+            """, (chatbot_id, source, list(current_pages)))
+            run_write_query(conn, """
+                DELETE FROM training_pages
+                WHERE chatbot_id = %s AND source = %s AND NOT (page_url = ANY(%s));
+            """, (chatbot_id, source, list(current_pages)))
+    except Exception as e:
+        print(f"Delete Stale Pages Error: {e}")
+
+def _vector_hash(query_vector: list) -> str:
+    return hashlib.sha1(array.array("f", query_vector).tobytes()).hexdigest()
+
+def get_retrieval_mode(chatbot_id: str) -> str:
+    """
+    Returns the chatbot's retrieval mode ('vector' or 'hybrid'), cached briefly.
+    """
+    mode = retrieval_mode_cache.get(chatbot_id)
+    if mode is not None:
+        return mode
+
+    mode = DEFAULT_RETRIEVAL_MODE
+    try:
+        with get_db_connection() as conn:
+            result = run_query(conn, "SELECT retrieval_mode FROM chatbot_retrieval_settings WHERE chatbot_id = %s;", (chatbot_id,))
+            conn.rollback()
+            if result and result[0][0] in RETRIEVAL_MODES:
+                mode = result[0][0]
+    except Exception as e:
+        print(f"Get Retrieval Mode Error: {e}")
+        return DEFAULT_RETRIEVAL_MODE
+
+    retrieval_mode_cache.set(chatbot_id, mode)
+    return mode
+
+def set_retrieval_mode(chatbot_id: str, mode: str):
+    """
+    Selects 'vector' or 'hybrid' retrieval for a chatbot.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"retrieval_mode must be one of {RETRIEVAL_MODES}")
+
+    with get_db_connection() as conn:
+        success = run_write_query(conn, """
+            INSERT INTO chatbot_retrieval_settings (chatbot_id, retrieval_mode, updated_at)
+            VALUES (%s, %s, NOW())
+            ON CONFLICT (chatbot_id) DO UPDATE SET retrieval_mode = EXCLUDED.retrieval_mode, updated_at = NOW();
+        """, (chatbot_id, mode))
+    retrieval_mode_cache.pop(chatbot_id)
+    return success
+
+def search_vectors(chatbot_id: str, query_vector: list, limit: int = 5, query_text: str = None, mode: str = None):
+    """
+    Searches for similar chunks.
+    mode: 'vector' or 'hybrid' (defaults to the chatbot's setting). Hybrid needs query_text.
+    Results are cached per (chatbot_id, training generation, mode, query, limit).
+    """
+    mode = mode or get_retrieval_mode(chatbot_id)
+    if mode == "hybrid" and not query_text:
+        mode = "vector"
+
+    cache_key = None
+    generation = get_generation(chatbot_id)
+    if generation is not None and query_vector:
+        cache_key = (chatbot_id, generation, mode, _vector_hash(query_vector), query_text if mode == "hybrid" else None, limit)
+        cached = retrieval_cache.get(cache_key)
+        if cached is not None:
+            results, db_seconds = cached
+            metrics.increment("retrieval_cache.hits")
+            metrics.increment("retrieval_cache.saved_db_ms", db_seconds * 1000)
+            return [dict(r) for r in results]
+        metrics.increment("retrieval_cache.misses")
+
+    start = time.perf_counter()
+    results = None
+    if mode == "vector" and generation is not None and query_vector and local_vector_index.enabled:
+        results = _search_vectors_local(chatbot_id, query_vector, limit, generation)
+
+    if results is None:
+        results = _search_vectors_db(chatbot_id, query_vector, limit, generation, query_text if mode == "hybrid" else None)
+        if results is None:
+            return []
+        db_seconds = time.perf_counter() - start
+        metrics.observe("search_vectors.db", db_seconds)
+    else:
+        db_seconds = time.perf_counter() - start
+        metrics.observe("search_vectors.local", db_seconds)
+
+    if cache_key:
+        retrieval_cache.set(cache_key, (results, db_seconds))
+    return [dict(r) for r in results]
+
+# Small tenants are scanned exactly (chatbot_id index + sort), which is both exact and
+# cheaper than an ANN probe over every tenant's vectors. Larger tenants use HNSW with
+# iterative scan so the chatbot_id filter cannot starve the result set.
+EXACT_SEARCH_SQL = """
+    WITH tenant_chunks AS MATERIALIZED (
+        SELECT content, embedding FROM training_chunks WHERE chatbot_id = %s
+    )
+    SELECT content, 1 - (embedding <=> %s::vector) AS similarity
+    FROM tenant_chunks
+    ORDER BY embedding <=> %s::vector
+    LIMIT %s;
+"""
+
+ANN_SEARCH_SQL = """
+    WITH nearest AS MATERIALIZED (
+        SELECT content, embedding <=> %s::vector AS distance
+        FROM training_chunks
+        WHERE chatbot_id = %s
+        ORDER BY embedding <=> %s::vector
+        LIMIT %s
+    )
+    SELECT content, 1 - distance AS similarity FROM nearest ORDER BY distance;
+"""
+
+# One round-trip: top candidates from the vector and full-text legs, fused by
+# reciprocal rank (score = sum of 1 / (RRF_K + rank)). Query terms are OR-ed so
+# natural-language questions still match exact product names, SKUs and error codes.
+HYBRID_SEARCH_SQL = f"""
+    WITH vector_hits AS MATERIALIZED (
+        SELECT id, row_number() OVER (ORDER BY distance) AS rank
+        FROM (
+            SELECT id, embedding <=> %(vector)s::vector AS distance
+            FROM training_chunks
+            WHERE chatbot_id = %(chatbot_id)s
+            ORDER BY embedding <=> %(vector)s::vector
+            LIMIT %(candidates)s
+        ) nearest
+    ),
+    text_hits AS MATERIALIZED (
+        SELECT id, row_number() OVER (ORDER BY ts_rank_cd(content_tsv, q.query) DESC) AS rank
+        FROM training_chunks,
+             (SELECT replace(plainto_tsquery('{TEXT_SEARCH_CONFIG}', %(text)s)::text, '&', '|')::tsquery AS query) q
+        WHERE chatbot_id = %(chatbot_id)s AND content_tsv @@ q.query
+        ORDER BY ts_rank_cd(content_tsv, q.query) DESC
+        LIMIT %(candidates)s
+    )
+    SELECT c.content,
+           1 - (c.embedding <=> %(vector)s::vector) AS similarity,
+           COALESCE(1.0 / (%(rrf_k)s + v.rank), 0) + COALESCE(1.0 / (%(rrf_k)s + t.rank), 0) AS rrf_score
+    FROM vector_hits v
+    FULL OUTER JOIN text_hits t ON v.id = t.id
+    JOIN training_chunks c ON c.id = COALESCE(v.id, t.id)
+    ORDER BY rrf_score DESC
+    LIMIT %(limit)s;
+"""
+
+def _tenant_chunk_count(chatbot_id: str, generation, cur=None) -> int:
+    """
+    Number of chunks for a chatbot, cached per training generation.
+    Uses cur when given, otherwise checks out its own connection on a cache miss.
+    """
+    key = (chatbot_id, generation)
+    if generation is not None:
+        count = tenant_size_cache.get(key)
+        if count is not None:
+            return count
+
+    query = "SELECT count(*) FROM training_chunks WHERE chatbot_id = %s;"
+    if cur is not None:
+        cur.execute(query, (chatbot_id,))
+        count = cur.fetchone()[0]
+    else:
+        with get_db_connection() as conn:
+            count = run_query(conn, query, (chatbot_id,))[0][0]
+            conn.rollback()
+
+    if generation is not None:
+        tenant_size_cache.set(key, count)
+    return count
+
+def _load_tenant_embeddings(chatbot_id: str) -> list:
+    """
+    All (content, embedding) rows of a chatbot, for the local vector index.
+    """
+    with get_db_connection() as conn:
+        rows = run_query(
+            conn,
+            "SELECT content, embedding::real[] FROM training_chunks WHERE chatbot_id = %s AND embedding IS NOT NULL;",
+            (chatbot_id,)
+        )
+        conn.rollback()
+        return rows
+
+def _search_vectors_local(chatbot_id: str, query_vector: list, limit: int, generation: int):
+    """
+    Searches small tenants in process. Returns None when the tenant is too
+    large (or on error) so the caller falls back to Postgres.
+    """
+    try:
+        count = _tenant_chunk_count(chatbot_id, generation)
+        if count > LOCAL_VECTOR_SEARCH_MAX_CHUNKS:
+            return None
+        if count == 0:
+            return []
+        metrics.increment("search_vectors.local")
+        return local_vector_index.search(
+            chatbot_id, generation, query_vector, limit,
+            lambda: _load_tenant_embeddings(chatbot_id), rows=count
+        )
+    except Exception as e:
+        print(f"Local Search Error: {e}")
+        return None
+
+def _supports_iterative_scan(cur) -> bool:
+    """
+    hnsw.iterative_scan needs pgvector >= 0.8.0.
+    """
+    global _pgvector_iterative_scan
+    if _pgvector_iterative_scan is None:
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector';")
+        row = cur.fetchone()
+        try:
+            version = tuple(int(p) for p in row[0].split(".")[:2]) if row else (0, 0)
+        except ValueError:
+            version = (0, 0)
+        _pgvector_iterative_scan = version >= (0, 8)
+    return _pgvector_iterative_scan
+
+def _has_text_search(cur) -> bool:
+    """
+    Whether training_chunks.content_tsv exists (see DB/migrations/002_hybrid_search.sql).
+    """
+    global _content_tsv_available
+    if _content_tsv_available is None:
+        cur.execute("SELECT 1 FROM information_schema.columns WHERE table_name='training_chunks' AND column_name='content_tsv';")
+        _content_tsv_available = cur.fetchone() is not None
+    return _content_tsv_available
+
+def _search_vectors_db(chatbot_id: str, query_vector: list, limit: int, generation=None, query_text: str = None):
+    """
+    Runs the similarity query (hybrid when query_text is given).
+    Returns None on error so failures are not cached.
+    """
+    try:
+        with get_db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    is_small = _tenant_chunk_count(chatbot_id, generation, cur) <= EXACT_SEARCH_MAX_CHUNKS
+                    if not is_small:
+                        if _supports_iterative_scan(cur):
+                            cur.execute("SET LOCAL hnsw.iterative_scan = relaxed_order;")
+                        cur.execute("SET LOCAL hnsw.ef_search = %s;", (max(HNSW_EF_SEARCH, limit, HYBRID_CANDIDATES),))
+
+                    if query_text and _has_text_search(cur):
+                        metrics.increment("search_vectors.hybrid")
+                        cur.execute(HYBRID_SEARCH_SQL, {
+                            "vector": query_vector,
+                            "chatbot_id": chatbot_id,
+                            "text": query_text,
+                            "candidates": max(HYBRID_CANDIDATES, limit),
+                            "rrf_k": RRF_K,
+                            "limit": limit,
+                        })
+                    elif is_small:
+                        metrics.increment("search_vectors.exact")
+                        cur.execute(EXACT_SEARCH_SQL, (chatbot_id, query_vector, query_vector, limit))
+                    else:
+                        metrics.increment("search_vectors.ann")
+                        cur.execute(ANN_SEARCH_SQL, (query_vector, chatbot_id, query_vector, limit))
+                    results = cur.fetchall()
+            finally:
+                # Ends the read transaction so SET LOCAL does not leak into the pooled connection
+                conn.rollback()
+
+            return [{"content": r[0], "similarity": r[1]} for r in results]
     except Exception as e:
         print(f"Search Error: {e}")
-        return []
+        return None
 
 def save_bot_message(conversation_id: str, chatbot_id: str, role: str, content: str, user_id: str = None, user_email: str = None):
     """
@@ -0,0 +1,68 @@
+"""
+Per-chatbot training generation counter.
+
+Every write to a chatbot's training_chunks bumps its generation, and anything
+derived from those chunks (retrieval cache entries, in-memory indexes) is
+keyed by it, so stale results are never served after retraining.
+
+The counter lives in Postgres (chatbot_training_generations): training runs
+in a separate process (training_worker.py), so a process-local counter never
+reached the API processes. Reads are cached per process for
+TRAINING_GENERATION_TTL seconds, which bounds how long another process's
+retraining can go unnoticed; a bump is visible at once in its own process.
+"""
+
+import os
+import logging
+
+from utils.ttl_cache import TTLCache
+
+TRAINING_GENERATION_TTL = float(os.getenv("TRAINING_GENERATION_TTL", "5"))
+
+_cache = TTLCache(50000, TRAINING_GENERATION_TTL)
+
+def get_generation(chatbot_id: str):
+    """
+    Returns the current generation, or None if it cannot be determined
+    (callers must then bypass their caches).
+    """
+    generation = _cache.get(chatbot_id)
+    if generation is not None:
+        return generation
+
+    # Imported here: DB.postgresDB imports this module
+    from DB.postgresDB import get_db_connection, run_query
+    try:
+        with get_db_connection() as conn:
+            rows = run_query(conn, "SELECT generation FROM chatbot_training_generations WHERE chatbot_id = %s;", (chatbot_id,))
+            conn.rollback()
+    except Exception as e:
+        logging.warning(f"Training generation read failed for {chatbot_id}: {e}")
+        return None
+
+    generation = rows[0][0] if rows else 0
+    _cache.set(chatbot_id, generation)
+    return generation
+
+def bump_generation(chatbot_id: str):
+    """
+    Invalidates everything cached for this chatbot's training data, in every process.
+    """
+    _cache.pop(chatbot_id)
+
+    from DB.postgresDB import get_db_connection
+    try:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO chatbot_training_generations (chatbot_id, generation, updated_at)
+                    VALUES (%s, 1, NOW())
+                    ON CONFLICT (chatbot_id) DO UPDATE SET
+                        generation = chatbot_training_generations.generation + 1, updated_at = NOW()
+                    RETURNING generation;
+                """, (chatbot_id,))
+                generation = cur.fetchone()[0]
+            conn.commit()
+        _cache.set(chatbot_id, generation)
+    except Exception as e:
+        logging.error(f"Training generation bump failed for {chatbot_id}: {e}")
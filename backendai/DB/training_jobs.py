@@ -0,0 +1,258 @@
+"""
+Durable queue of training jobs.
+
+Training used to run in a daemon thread of the API worker that received
+/api/ingest: a deploy or crash lost the job silently (automations stayed
+'training' forever) and PDF parsing competed with chat requests. Jobs are now
+rows of training_jobs (created in init_vector_db, see
+DB/migrations/005_training_jobs.sql) run by training_worker.py processes,
+which scale independently of the API.
+
+- Claiming uses FOR UPDATE SKIP LOCKED, so any number of workers can poll
+  the table without handing the same job to two of them. At most
+  TRAINING_ORG_CONCURRENCY jobs of an organization run at once (checked
+  under a per-organization advisory lock).
+- A running job's heartbeat_at is refreshed by its worker. Jobs whose
+  heartbeat is older than TRAINING_STALE_AFTER (killed worker) are put back
+  in the queue by recover_stale_jobs.
+- Failed attempts are retried with exponential backoff until max_attempts.
+- Completing, failing or releasing a job only applies while the calling
+  worker still holds it: after a recovery requeued its job and another
+  worker claimed it, a late worker's outcome is logged and ignored.
+- One queued/running job per chatbot (unique partial index); enqueueing
+  again returns the active job.
+
+status: queued -> running -> succeeded | failed (running -> queued on retry / recovery)
+"""
+
+import os
+import uuid
+import logging
+
+from DB.postgresDB import get_db_connection, run_query, run_write_query
+
+TRAINING_MAX_ATTEMPTS = int(os.getenv("TRAINING_MAX_ATTEMPTS", "3"))
+TRAINING_ORG_CONCURRENCY = int(os.getenv("TRAINING_ORG_CONCURRENCY", "1"))
+TRAINING_RETRY_BASE_SECONDS = float(os.getenv("TRAINING_RETRY_BASE_SECONDS", "30"))
+TRAINING_RETRY_MAX_SECONDS = float(os.getenv("TRAINING_RETRY_MAX_SECONDS", "900"))
+TRAINING_STALE_AFTER = float(os.getenv("TRAINING_STALE_AFTER", "120"))
+
+# First key of the per-organization advisory lock taken while claiming
+ORG_LOCK_NAMESPACE = 0x7472_6a62  # 'trjb'
+
+ENQUEUE_SQL = """
+    INSERT INTO training_jobs (job_id, chatbot_id, organization_id, webhook_url, max_attempts)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (chatbot_id) WHERE status IN ('queued', 'running') DO NOTHING
+    RETURNING job_id
+"""
+
+# Oldest due jobs; rows locked by another claimer are skipped, not waited for
+CANDIDATES_SQL = """
+    SELECT job_id, organization_id FROM training_jobs
+    WHERE status = 'queued' AND run_after <= NOW()
+    ORDER BY run_after, created_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+CLAIM_SQL = """
+    UPDATE training_jobs
+    SET status = 'running', attempts = attempts + 1, worker_id = %s,
+        started_at = NOW(), heartbeat_at = NOW(), updated_at = NOW()
+    WHERE job_id = %s
+    RETURNING job_id, chatbot_id, organization_id, webhook_url, attempts, max_attempts
+"""
+
+# Running jobs whose worker stopped sending heartbeats; locked so two recoverers do not both requeue
+STALE_JOBS_SQL = """
+    SELECT job_id, organization_id, webhook_url, attempts, max_attempts FROM training_jobs
+    WHERE status = 'running' AND heartbeat_at < NOW() - make_interval(secs => %s)
+    FOR UPDATE SKIP LOCKED
+"""
+
+
+def retry_delay(attempts: int) -> float:
+    """Backoff before the next attempt: base * 2^(attempts - 1), capped."""
+    return min(TRAINING_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), TRAINING_RETRY_MAX_SECONDS)
+
+
+def enqueue_training_job(chatbot_id: str, organization_id: int, webhook_url: str = None):
+    """
+    Queues a training job. Returns (job_id, created); when the chatbot already
+    has a queued or running job, that job's id and False.
+    """
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(ENQUEUE_SQL, (str(uuid.uuid4()), chatbot_id, organization_id, webhook_url, TRAINING_MAX_ATTEMPTS))
+                row = cur.fetchone()
+                if not row:
+                    cur.execute(
+                        "SELECT job_id FROM training_jobs WHERE chatbot_id = %s AND status IN ('queued', 'running')",
+                        (chatbot_id,)
+                    )
+                    existing = cur.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if row:
+        return row[0], True
+    return (existing[0] if existing else None), False
+
+
+def claim_job(worker_id: str, org_limit: int = TRAINING_ORG_CONCURRENCY, scan: int = 20):
+    """
+    Claims the oldest due job whose organization is under its concurrency
+    limit. Returns a dict (job_id, chatbot_id, organization_id, webhook_url,
+    attempts, max_attempts) or None.
+    """
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(CANDIDATES_SQL, (scan,))
+                for job_id, organization_id in cur.fetchall():
+                    # Serializes claimers of the same organization until commit, so the
+                    # count below includes jobs another worker is claiming right now
+                    cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (ORG_LOCK_NAMESPACE, organization_id or 0))
+                    cur.execute(
+                        "SELECT count(*) FROM training_jobs WHERE organization_id = %s AND status = 'running'",
+                        (organization_id,)
+                    )
+                    if cur.fetchone()[0] >= org_limit:
+                        continue
+                    cur.execute(CLAIM_SQL, (worker_id, job_id))
+                    row = cur.fetchone()
+                    conn.commit()
+                    keys = ("job_id", "chatbot_id", "organization_id", "webhook_url", "attempts", "max_attempts")
+                    return dict(zip(keys, row))
+            conn.commit()
+            return None
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error claiming training job: {e}")
+            return None
+
+
+def heartbeat(job_ids: list, worker_id: str) -> bool:
+    """Refreshes heartbeat_at of jobs this worker is running."""
+    if not job_ids:
+        return True
+    with get_db_connection() as conn:
+        return run_write_query(conn, """
+            UPDATE training_jobs SET heartbeat_at = NOW()
+            WHERE job_id = ANY(%s) AND worker_id = %s AND status = 'running'
+        """, (list(job_ids), worker_id))
+
+
+def _update_owned(job_id: str, worker_id: str, set_sql: str, params: tuple, action: str) -> bool:
+    """
+    Updates a job only while worker_id is running it. Returns False (and logs)
+    when the job was recovered and possibly claimed by another worker meanwhile,
+    or on a database error (the heartbeat then lapses and recovery takes over).
+    """
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"UPDATE training_jobs SET {set_sql} WHERE job_id = %s AND worker_id = %s AND status = 'running'",
+                    params + (job_id, worker_id)
+                )
+                updated = cur.rowcount
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error updating training job {job_id} ({action}): {e}")
+            return False
+    if not updated:
+        logging.warning(f"Training job {job_id} is no longer held by {worker_id}; not {action}")
+    return bool(updated)
+
+
+def complete_job(job_id: str, worker_id: str) -> bool:
+    """Marks a job succeeded. Returns False when the worker no longer holds it."""
+    return _update_owned(
+        job_id, worker_id,
+        "status = 'succeeded', finished_at = NOW(), updated_at = NOW(), last_error = NULL",
+        (), "marking it succeeded"
+    )
+
+
+def fail_job(job_id: str, worker_id: str, attempts: int, max_attempts: int, error: str):
+    """
+    Records a failed attempt. Returns True when the job was requeued for a
+    retry, False when it is out of attempts (status 'failed'), None when the
+    worker no longer holds it (nothing changed).
+    """
+    retry = attempts < max_attempts
+    if retry:
+        updated = _update_owned(
+            job_id, worker_id,
+            "status = 'queued', run_after = NOW() + make_interval(secs => %s), "
+            "worker_id = NULL, last_error = %s, updated_at = NOW()",
+            (retry_delay(attempts), error[:2000]), "requeueing it"
+        )
+    else:
+        updated = _update_owned(
+            job_id, worker_id,
+            "status = 'failed', finished_at = NOW(), last_error = %s, updated_at = NOW()",
+            (error[:2000],), "marking it failed"
+        )
+    return retry if updated else None
+
+
+def release_job(job_id: str, worker_id: str) -> bool:
+    """Puts a job interrupted by a worker shutdown back in the queue without using up an attempt."""
+    return _update_owned(
+        job_id, worker_id,
+        "status = 'queued', attempts = GREATEST(attempts - 1, 0), worker_id = NULL, run_after = NOW(), updated_at = NOW()",
+        (), "releasing it"
+    )
+
+
+def recover_stale_jobs(stale_after: float = TRAINING_STALE_AFTER) -> list:
+    """
+    Requeues (with backoff) or fails running jobs without a recent heartbeat.
+    Returns [(job_id, organization_id, webhook_url, requeued)] for the jobs handled.
+    """
+    handled = []
+    with get_db_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(STALE_JOBS_SQL, (stale_after,))
+                for job_id, organization_id, webhook_url, attempts, max_attempts in cur.fetchall():
+                    requeue = attempts < max_attempts
+                    if requeue:
+                        cur.execute("""
+                            UPDATE training_jobs
+                            SET status = 'queued', run_after = NOW() + make_interval(secs => %s), worker_id = NULL,
+                                last_error = 'worker stopped sending heartbeats', updated_at = NOW()
+                            WHERE job_id = %s
+                        """, (retry_delay(attempts), job_id))
+                    else:
+                        cur.execute("""
+                            UPDATE training_jobs
+                            SET status = 'failed', finished_at = NOW(),
+                                last_error = 'worker stopped sending heartbeats', updated_at = NOW()
+                            WHERE job_id = %s
+                        """, (job_id,))
+                    handled.append((job_id, organization_id, webhook_url, requeue))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error recovering stale training jobs: {e}")
+            return []
+    for job_id, _, _, requeue in handled:
+        logging.warning(f"Training job {job_id} lost its worker; {'requeued' if requeue else 'marked failed'}")
+    return handled
+
+
+def get_active_job(chatbot_id: str):
+    """Returns (job_id, status, attempts) of the chatbot's queued or running job, or None."""
+    with get_db_connection() as conn:
+        rows = run_query(conn, """
+            SELECT job_id, status, attempts FROM training_jobs
+            WHERE chatbot_id = %s AND status IN ('queued', 'running')
+        """, (chatbot_id,))
+    return rows[0] if rows else None
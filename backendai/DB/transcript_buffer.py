@@ -0,0 +1,299 @@
+"""
+Write-behind buffer for chat transcripts.
+
+The end of every chat turn and every /realtime/save_conversation call used
+to write to bot_conversation_messages on the request path, and realtime
+clients flush small fragments many times per minute. Messages are now
+queued here, coalesced per conversation, and written by a background
+thread in one transaction (a multi-row INSERT, see
+conversation_store.append_message_batches) when
+TRANSCRIPT_FLUSH_MAX_MESSAGES are pending or the oldest pending message
+is TRANSCRIPT_FLUSH_INTERVAL seconds old.
+
+- Failed flushes are put back in front of newer messages and retried, so
+  nothing is dropped while the database is unavailable. When a batch fails
+  but the database is reachable, each conversation is retried on its own so
+  one bad conversation does not hold back the others; a conversation that
+  still fails after TRANSCRIPT_MAX_ATTEMPTS flushes is logged and dropped.
+- stop_transcript_buffer() (FastAPI lifespan shutdown) drains the queue.
+- Messages not written yet are returned by pending() so history reads
+  in this worker see them (see with_pending). Other workers see them after
+  the next flush.
+- Without the background thread (scripts, TRANSCRIPT_WRITE_BEHIND=false)
+  add() writes synchronously; save_messages_nowait() (chat streams, also
+  while they are being closed) then hands that write to a worker thread.
+
+Metrics: transcript_buffer.depth, transcript_buffer.flush_seconds,
+transcript_buffer.batch_messages, transcript_buffer.flush_errors,
+transcript_buffer.dropped_messages.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from DB.conversation_store import append_message_batches
+from DB.postgresDB import get_db_connection, run_query
+from utils import metrics
+
+TRANSCRIPT_WRITE_BEHIND = os.getenv("TRANSCRIPT_WRITE_BEHIND", "true").lower() == "true"
+TRANSCRIPT_FLUSH_INTERVAL = float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", "1.0"))
+TRANSCRIPT_FLUSH_MAX_MESSAGES = int(os.getenv("TRANSCRIPT_FLUSH_MAX_MESSAGES", "500"))
+TRANSCRIPT_RETRY_INTERVAL = float(os.getenv("TRANSCRIPT_RETRY_INTERVAL", "2.0"))
+TRANSCRIPT_DRAIN_TIMEOUT = float(os.getenv("TRANSCRIPT_DRAIN_TIMEOUT", "10"))
+TRANSCRIPT_MAX_ATTEMPTS = int(os.getenv("TRANSCRIPT_MAX_ATTEMPTS", "5"))
+
+
+@dataclass
+class _Pending:
+    messages: list = field(default_factory=list)
+    updated_at: object = None
+    create: Optional[dict] = None   # bot_conversations row to insert if missing
+    since: float = 0.0              # monotonic time of the oldest message
+    attempts: int = 0               # failed writes while the database was reachable
+
+
+class TranscriptBuffer:
+    """
+    Per-conversation message queue with a flusher thread.
+    """
+
+    def __init__(self, flush_interval: float = TRANSCRIPT_FLUSH_INTERVAL,
+                 max_messages: int = TRANSCRIPT_FLUSH_MAX_MESSAGES,
+                 retry_interval: float = TRANSCRIPT_RETRY_INTERVAL):
+        self.flush_interval = flush_interval
+        self.max_messages = max_messages
+        self.retry_interval = retry_interval
+        self._pending = OrderedDict()   # conversation_id -> _Pending, oldest first
+        self._inflight = {}             # conversation_id -> messages being written
+        self._depth = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._drain_deadline = None
+
+    # -- producers ---------------------------------------------------------
+
+    def add(self, conversation_id: str, messages: list, updated_at=None, create: dict = None) -> bool:
+        """
+        Queues messages for a conversation. `create` holds bot_conversations
+        columns (user_id, user_email, user_plan, chatbot_id, title, created_at)
+        for a conversation that may not exist yet.
+        Returns False only when a synchronous write (no flusher running) fails.
+        """
+        if not conversation_id or not messages:
+            return True
+
+        with self._cond:
+            if not self.running:
+                queued = False
+            else:
+                queued = True
+                self._enqueue(conversation_id, messages, updated_at, create)
+        return True if queued else self._write_now(conversation_id, messages, updated_at, create)
+
+    def _enqueue(self, conversation_id, messages, updated_at, create):
+        entry = self._pending.get(conversation_id)
+        if entry is None:
+            entry = self._pending[conversation_id] = _Pending(since=time.monotonic())
+        entry.messages.extend(messages)
+        entry.updated_at = updated_at or entry.updated_at
+        if create and entry.create is None:
+            entry.create = dict(create, conversation_id=conversation_id)
+        self._depth += len(messages)
+        if self._depth >= self.max_messages:
+            self._cond.notify()
+
+    def pending(self, conversation_id: str) -> list:
+        """Messages of a conversation that are queued or being written, oldest first."""
+        with self._cond:
+            entry = self._pending.get(conversation_id)
+            return list(self._inflight.get(conversation_id, ())) + (list(entry.messages) if entry else [])
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stopping
+
+    def _write_now(self, conversation_id, messages, updated_at, create) -> bool:
+        new_conversations = [dict(create, conversation_id=conversation_id)] if create else None
+        with get_db_connection() as conn:
+            return append_message_batches(conn, {conversation_id: (messages, updated_at)}, new_conversations)
+
+    # -- flusher -----------------------------------------------------------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="transcript-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = TRANSCRIPT_DRAIN_TIMEOUT):
+        """Stops accepting background work and drains the queue (bounded by timeout)."""
+        if not self._thread:
+            return
+        with self._cond:
+            self._stopping = True
+            self._drain_deadline = time.monotonic() + timeout
+            self._cond.notify()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"Transcript buffer did not drain in {timeout}s; {self._depth} message(s) not written")
+        self._thread = None
+
+    def _due(self) -> bool:
+        if not self._pending:
+            return False
+        if self._stopping or self._depth >= self.max_messages:
+            return True
+        oldest = next(iter(self._pending.values()))
+        return time.monotonic() - oldest.since >= self.flush_interval
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due():
+                    if self._stopping and not self._pending:
+                        return
+                    timeout = self.flush_interval
+                    if self._pending:
+                        oldest = next(iter(self._pending.values()))
+                        timeout = max(0.0, self.flush_interval - (time.monotonic() - oldest.since))
+                    self._cond.wait(timeout)
+                batch, self._pending = self._pending, OrderedDict()
+                self._inflight = {cid: entry.messages for cid, entry in batch.items()}
+
+            failed = OrderedDict()
+            if not self._flush(batch):
+                # Database down: retry everything later. Otherwise find the conversations at fault.
+                failed = self._flush_separately(batch) if self._database_available() else batch
+            retry = self._drop_exhausted(failed)
+            done = [entry for cid, entry in batch.items() if cid not in retry]
+
+            with self._cond:
+                self._inflight = {}
+                self._depth -= sum(len(entry.messages) for entry in done)
+                if retry:
+                    self._requeue(retry)
+                    if self._stopping and time.monotonic() >= self._drain_deadline:
+                        return
+            if retry:
+                time.sleep(self.retry_interval)
+
+    def _flush(self, batch) -> bool:
+        count = sum(len(entry.messages) for entry in batch.values())
+        start = time.perf_counter()
+        try:
+            with get_db_connection() as conn:
+                ok = append_message_batches(
+                    conn,
+                    {cid: (entry.messages, entry.updated_at) for cid, entry in batch.items()},
+                    [entry.create for entry in batch.values() if entry.create],
+                )
+        except Exception as e:
+            logging.error(f"Transcript buffer flush failed: {e}")
+            ok = False
+        metrics.observe("transcript_buffer.flush_seconds", time.perf_counter() - start)
+        if ok:
+            metrics.observe("transcript_buffer.batch_messages", count)
+        else:
+            metrics.increment("transcript_buffer.flush_errors")
+        return ok
+
+    def _database_available(self) -> bool:
+        try:
+            with get_db_connection() as conn:
+                run_query(conn, "SELECT 1;", None)
+                conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _flush_separately(self, batch) -> OrderedDict:
+        """Writes each conversation of a failed batch in its own transaction; returns those that failed."""
+        failed = OrderedDict()
+        for cid, entry in batch.items():
+            if len(batch) > 1 and self._flush({cid: entry}):
+                with self._cond:
+                    self._inflight.pop(cid, None)
+                continue
+            entry.attempts += 1
+            failed[cid] = entry
+        return failed
+
+    def _drop_exhausted(self, failed) -> OrderedDict:
+        """Drops conversations that failed TRANSCRIPT_MAX_ATTEMPTS times; returns the ones to retry."""
+        retry = OrderedDict()
+        for cid, entry in failed.items():
+            if entry.attempts < TRANSCRIPT_MAX_ATTEMPTS:
+                retry[cid] = entry
+                continue
+            logging.error(
+                f"Dropping {len(entry.messages)} transcript message(s) of conversation {cid} "
+                f"after {entry.attempts} failed writes"
+            )
+            metrics.increment("transcript_buffer.dropped_messages", len(entry.messages))
+        return retry
+
+    def _requeue(self, batch):
+        """Puts a failed batch back ahead of messages queued while it was being written."""
+        merged = OrderedDict()
+        for cid, entry in batch.items():
+            newer = self._pending.pop(cid, None)
+            if newer:
+                entry.messages.extend(newer.messages)
+                entry.updated_at = newer.updated_at or entry.updated_at
+                entry.create = entry.create or newer.create
+            merged[cid] = entry
+        merged.update(self._pending)
+        self._pending = merged
+
+
+transcript_buffer = TranscriptBuffer()
+metrics.register_gauge("transcript_buffer.depth", lambda: transcript_buffer.depth)
+
+
+def save_messages(conversation_id: str, messages: list, updated_at=None, create: dict = None) -> bool:
+    """Queues chat messages for persistence (see TranscriptBuffer.add)."""
+    return transcript_buffer.add(conversation_id, messages, updated_at, create)
+
+
+def save_messages_nowait(conversation_id: str, messages: list, updated_at=None, create: dict = None):
+    """
+    save_messages for the event loop: never touches the database on the loop and
+    never awaits, so it is safe in an async generator's cancellation / aclose() path.
+    """
+    if transcript_buffer.running:
+        transcript_buffer.add(conversation_id, messages, updated_at, create)
+    else:
+        asyncio.get_running_loop().run_in_executor(
+            None, transcript_buffer.add, conversation_id, messages, updated_at, create
+        )
+
+
+def with_pending(conversation_id: str, history: list, limit: Optional[int] = None) -> list:
+    """Appends this worker's unwritten messages to history read from the database."""
+    pending = transcript_buffer.pending(conversation_id) if conversation_id else []
+    history = list(history or []) + pending
+    return history[-limit:] if limit else history
+
+
+def start_transcript_buffer():
+    """Starts the flusher thread (called from the FastAPI lifespan)."""
+    if TRANSCRIPT_WRITE_BEHIND:
+        transcript_buffer.start()
+    return transcript_buffer
+
+
+def stop_transcript_buffer():
+    """Drains queued messages (called from the FastAPI lifespan before the pools close)."""
+    transcript_buffer.stop()
@@ -0,0 +1,113 @@
+"""
+Load test for the streaming chat endpoints.
+
+Opens N concurrent chats against a running backendai instance and reports
+time-to-first-token and total latency percentiles, plus streamed tokens per
+second (overall, per stream, and per server worker with --workers set to the
+uvicorn worker count). Run it once before and once after a change to compare
+p99 and throughput under load.
+
+Usage:
+    python benchmarks/chat_load_test.py --chatbot-id <id> --concurrency 100
+    python benchmarks/chat_load_test.py --chatbot-id <id> --path /gcs/standard/chat
+    python benchmarks/chat_load_test.py --chatbot-id <id> --concurrency 200 --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_chat(client, url, chatbot_id, prompt):
+    """Runs one chat and returns (ttft, total, tokens, error)."""
+    payload = {
+        "chatbot_id": chatbot_id,
+        "prompt": prompt,
+        "conversation_id": "NEW_CHAT",
+        "user_id": "loadtest",
+    }
+    start = time.perf_counter()
+    ttft = None
+    tokens = 0
+    try:
+        async with client.stream("POST", url, json=payload) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if "error" in event:
+                    return ttft, time.perf_counter() - start, tokens, event["error"]
+                if "token" in event:
+                    tokens += 1
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+    except Exception as e:
+        return ttft, time.perf_counter() - start, tokens, str(e)
+    return ttft, time.perf_counter() - start, tokens, None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:5002")
+    parser.add_argument("--path", default="/standard/chat")
+    parser.add_argument("--chatbot-id", required=True)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=1)
+    parser.add_argument("--prompt", default="What are your pricing plans?")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes, for tokens/sec per worker")
+    args = parser.parse_args()
+
+    url = f"{args.base_url}{args.path}"
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    ttfts, totals, stream_rates, errors = [], [], [], []
+    total_tokens = 0
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        wall_start = time.perf_counter()
+        for _ in range(args.rounds):
+            results = await asyncio.gather(*[
+                run_chat(client, url, args.chatbot_id, args.prompt)
+                for _ in range(args.concurrency)
+            ])
+            for ttft, total, tokens, error in results:
+                total_tokens += tokens
+                if error:
+                    errors.append(error)
+                    continue
+                if ttft is not None:
+                    ttfts.append(ttft)
+                    if total > ttft:
+                        stream_rates.append(tokens / (total - ttft))
+                totals.append(total)
+        wall = time.perf_counter() - wall_start
+
+    print(f"Endpoint:    {url}")
+    print(f"Chats:       {args.concurrency * args.rounds} ({args.concurrency} concurrent), wall {wall:.2f}s")
+    print(f"Errors:      {len(errors)}")
+    for label, values in (("TTFT", ttfts), ("Total", totals)):
+        print(
+            f"{label:<12} p50={percentile(values, 50):.3f}s "
+            f"p95={percentile(values, 95):.3f}s p99={percentile(values, 99):.3f}s"
+        )
+    throughput = total_tokens / wall if wall else 0.0
+    print(
+        f"Tokens/sec:  {throughput:.1f} total, {throughput / max(1, args.workers):.1f} per worker "
+        f"({args.workers}), per stream p50={percentile(stream_rates, 50):.1f} p5={percentile(stream_rates, 5):.1f}"
+    )
+    if errors:
+        print(f"First error: {errors[0]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
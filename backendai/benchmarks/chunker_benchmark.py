@@ -0,0 +1,146 @@
+"""
+Chunker benchmark: legacy 1000/100 character slicing vs the Markdown-aware token chunker.
+
+Throughput: chunks/sec and MB/sec over the corpus, plus token size stats.
+
+Retrieval quality (--embed, needs OPENAI_API_KEY): samples facts (table rows
+and sentences) from the corpus, embeds each fact as a query and checks
+whether a top-k chunk contains the complete fact. Facts cut in half by a
+chunk boundary can never be retrieved intact, which is what the Markdown
+chunker is meant to fix.
+
+Usage:
+    python benchmarks/chunker_benchmark.py                       # synthetic Markdown corpus
+    python benchmarks/chunker_benchmark.py --corpus ./docs --embed --k 3
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.markdown_chunker import iter_markdown_chunks  # noqa: E402
+from utils.tokenizer import count_tokens  # noqa: E402
+
+
+def legacy_chunks(text, chunk_size=1000, overlap=100):
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size - overlap)]
+
+
+def markdown_chunks(text, max_tokens, overlap_tokens):
+    return [c["content"] for c in iter_markdown_chunks(text, max_tokens, overlap_tokens)]
+
+
+def synthetic_document(doc_id, rng):
+    lines = [f"# Product {doc_id} Guide", "", f"Product {doc_id} is a managed service for teams of every size.", ""]
+    lines += ["## Pricing", "", "| Plan | SKU | Monthly price | Seats |", "|------|-----|---------------|-------|"]
+    for plan in range(rng.randint(5, 25)):
+        lines.append(f"| Plan {doc_id}-{plan} | SKU-{doc_id:03d}-{plan:02d} | ${rng.randint(5, 500)}.00 | {rng.randint(1, 200)} |")
+    lines += ["", "## Troubleshooting", ""]
+    for code in range(rng.randint(3, 12)):
+        lines.append(
+            f"Error E{doc_id}{code:02d} means the {rng.choice(['token', 'session', 'webhook', 'license'])} "
+            f"{rng.choice(['expired', 'was revoked', 'is invalid', 'reached its limit'])}. "
+            f"Restart the {rng.choice(['agent', 'connector', 'sync job'])} and retry after {rng.randint(1, 60)} minutes."
+        )
+        lines.append("")
+    lines += ["## Setup", "", "```bash", f"pip install product{doc_id}", f"product{doc_id} init --region eu", "```", ""]
+    return "\n".join(lines)
+
+
+def load_corpus(path, docs, seed):
+    if path:
+        corpus = []
+        for root, _, files in os.walk(path):
+            for name in files:
+                if name.endswith((".md", ".txt")):
+                    with open(os.path.join(root, name), encoding="utf-8", errors="ignore") as f:
+                        corpus.append(f.read())
+        return corpus
+    rng = random.Random(seed)
+    return [synthetic_document(i, rng) for i in range(docs)]
+
+
+def sample_facts(corpus, n, seed):
+    facts = []
+    for doc in corpus:
+        for line in doc.split("\n"):
+            line = line.strip()
+            if line.startswith("|") and not set(line) <= set("|-: "):
+                facts.append(line)
+            elif len(line) > 60 and not line.startswith(("#", "```")):
+                facts.extend(s for s in re.split(r"(?<=[.!?])\s+", line) if len(s) > 40)
+    random.Random(seed).shuffle(facts)
+    return facts[:n]
+
+
+def throughput(name, corpus, chunk_fn):
+    start = time.perf_counter()
+    chunks = [c for doc in corpus for c in chunk_fn(doc)]
+    elapsed = time.perf_counter() - start
+    megabytes = sum(len(doc) for doc in corpus) / 1e6
+    tokens = [count_tokens(c) for c in chunks]
+    print(
+        f"  {name:<9} {len(chunks):6d} chunks  {len(chunks) / elapsed:9.0f} chunks/s  {megabytes / elapsed:6.2f} MB/s  "
+        f"tokens avg={sum(tokens) / len(tokens):.0f} max={max(tokens)}"
+    )
+    return chunks
+
+
+def retrieval_quality(name, chunks, facts, fact_vectors, k):
+    import numpy as np
+    from services.embedding_service import embedding_service
+
+    vectors = embedding_service.embed_batch(chunks)
+    keep = [i for i, v in enumerate(vectors) if v]
+    matrix = np.asarray([vectors[i] for i in keep], dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    intact = sum(1 for fact in facts if any(fact in chunks[i] for i in keep))
+    hits = 0
+    for fact, vector in zip(facts, fact_vectors):
+        query = np.asarray(vector, dtype=np.float32)
+        top = np.argsort(-(matrix @ (query / np.linalg.norm(query))))[:k]
+        hits += any(fact in chunks[keep[i]] for i in top)
+    print(f"  {name:<9} facts intact in some chunk={intact / len(facts):.3f}  recall@{k}={hits / len(facts):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory of .md/.txt files (default: synthetic corpus)")
+    parser.add_argument("--docs", type=int, default=300, help="synthetic documents to generate")
+    parser.add_argument("--max-tokens", type=int, default=350)
+    parser.add_argument("--overlap-tokens", type=int, default=50)
+    parser.add_argument("--embed", action="store_true", help="also measure retrieval quality")
+    parser.add_argument("--facts", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.docs, args.seed)
+    print(f"Corpus: {len(corpus)} documents, {sum(len(d) for d in corpus) / 1e6:.2f} MB")
+
+    print("\nThroughput")
+    strategies = {
+        "legacy": legacy_chunks,
+        "markdown": lambda doc: markdown_chunks(doc, args.max_tokens, args.overlap_tokens),
+    }
+    chunk_sets = {name: throughput(name, corpus, fn) for name, fn in strategies.items()}
+
+    if args.embed:
+        from services.embedding_service import embedding_service
+
+        facts = sample_facts(corpus, args.facts, args.seed)
+        fact_vectors = embedding_service.embed_batch(facts)
+        facts, fact_vectors = zip(*[(f, v) for f, v in zip(facts, fact_vectors) if v])
+        print(f"\nRetrieval quality ({len(facts)} facts)")
+        for name, chunks in chunk_sets.items():
+            retrieval_quality(name, chunks, facts, fact_vectors, args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Chat history storage benchmark: JSONB array vs one row per message.
+
+Simulates --conversations conversations growing to --messages messages each
+(one user + one bot message per turn, turns interleaved across conversations
+like concurrent chats) in two scratch layouts:
+- jsonb:    bot_conversations.history, appended with `history || new`
+- messages: bot_conversation_messages rows (DB/conversation_store.py)
+
+For each layout it reports append latency for the first and last 10% of
+turns (the array rewrites its whole TOASTed value on every append, so its
+appends slow down as the conversation grows), total load time, WAL written,
+table size including TOAST and indexes, and latency of reading the last
+--read-limit messages.
+
+Usage (against a scratch database, the bench_* tables are dropped and recreated):
+    python benchmarks/conversation_storage_benchmark.py --dsn postgresql://... --conversations 200 --messages 500
+"""
+
+import argparse
+import json
+import random
+import string
+import time
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def random_text(min_len, max_len):
+    words = []
+    length = random.randint(min_len, max_len)
+    while sum(len(w) + 1 for w in words) < length:
+        words.append("".join(random.choices(string.ascii_lowercase, k=random.randint(2, 10))))
+    return " ".join(words)
+
+
+def create_tables(conn):
+    with conn.cursor() as cur:
+        cur.execute("DROP TABLE IF EXISTS bench_conversations_jsonb, bench_conversations, bench_conversation_messages;")
+        cur.execute("""
+            CREATE TABLE bench_conversations_jsonb (
+                id SERIAL PRIMARY KEY,
+                conversation_id VARCHAR(255) UNIQUE NOT NULL,
+                history JSONB,
+                updated_at TIMESTAMPTZ DEFAULT NOW()
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE bench_conversations (
+                id SERIAL PRIMARY KEY,
+                conversation_id VARCHAR(255) UNIQUE NOT NULL,
+                history JSONB,
+                updated_at TIMESTAMPTZ DEFAULT NOW()
+            );
+        """)
+        cur.execute("""
+            CREATE TABLE bench_conversation_messages (
+                seq BIGSERIAL PRIMARY KEY,
+                conversation_id VARCHAR(255) NOT NULL,
+                role VARCHAR(32),
+                text TEXT,
+                data JSONB NOT NULL,
+                created_at TIMESTAMPTZ DEFAULT NOW()
+            );
+        """)
+        cur.execute("CREATE INDEX ON bench_conversation_messages (conversation_id, seq);")
+    conn.commit()
+
+
+def append_jsonb(cur, conversation_id, messages):
+    cur.execute(
+        "UPDATE bench_conversations_jsonb SET history = COALESCE(history, '[]'::jsonb) || %s::jsonb, updated_at = NOW() WHERE conversation_id = %s",
+        (json.dumps(messages), conversation_id)
+    )
+
+
+def append_rows(cur, conversation_id, messages):
+    # Same statements as conversation_store.append_messages (minus the one-off legacy copy)
+    cur.execute("UPDATE bench_conversations SET updated_at = NOW() WHERE conversation_id = %s", (conversation_id,))
+    execute_values(cur, """
+        INSERT INTO bench_conversation_messages (conversation_id, role, text, data) VALUES %s
+    """, [(conversation_id, m["role"], m["text"], Json(m)) for m in messages])
+
+
+def read_jsonb(cur, conversation_id, limit):
+    cur.execute("SELECT history FROM bench_conversations_jsonb WHERE conversation_id = %s", (conversation_id,))
+    history = cur.fetchone()[0]
+    return history[-limit:]
+
+
+def read_rows(cur, conversation_id, limit):
+    cur.execute("""
+        SELECT jsonb_agg(recent.data ORDER BY recent.seq)
+        FROM (
+            SELECT seq, data FROM bench_conversation_messages
+            WHERE conversation_id = %s ORDER BY seq DESC LIMIT %s
+        ) recent
+    """, (conversation_id, limit))
+    return cur.fetchone()[0]
+
+
+LAYOUTS = {
+    "jsonb": (append_jsonb, read_jsonb, "bench_conversations_jsonb", ["bench_conversations_jsonb"]),
+    "messages": (append_rows, read_rows, "bench_conversations", ["bench_conversations", "bench_conversation_messages"]),
+}
+
+
+def wal_lsn(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_current_wal_lsn();")
+        lsn = cur.fetchone()[0]
+    conn.commit()
+    return lsn
+
+
+def wal_bytes_since(conn, lsn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s);", (lsn,))
+        diff = cur.fetchone()[0]
+    conn.commit()
+    return int(diff)
+
+
+def total_size(conn, tables):
+    with conn.cursor() as cur:
+        cur.execute("SELECT sum(pg_total_relation_size(t::regclass)) FROM unnest(%s::text[]) t;", (tables,))
+        size = cur.fetchone()[0]
+    conn.commit()
+    return int(size)
+
+
+def run_layout(conn, name, turns, conversation_ids, read_limit, reads):
+    append, read, parent, tables = LAYOUTS[name]
+    with conn.cursor() as cur:
+        execute_values(cur, f"INSERT INTO {parent} (conversation_id, history) VALUES %s",
+                       [(cid, "[]") for cid in conversation_ids])
+    conn.commit()
+
+    lsn = wal_lsn(conn)
+    per_turn = []
+    start = time.perf_counter()
+    for turn in turns:
+        latencies = []
+        for cid, messages in turn:
+            t0 = time.perf_counter()
+            with conn.cursor() as cur:
+                append(cur, cid, messages)
+            conn.commit()
+            latencies.append(time.perf_counter() - t0)
+        per_turn.append(latencies)
+    elapsed = time.perf_counter() - start
+    wal = wal_bytes_since(conn, lsn)
+
+    size = total_size(conn, tables)
+
+    read_latencies = []
+    for cid in random.choices(conversation_ids, k=reads):
+        t0 = time.perf_counter()
+        with conn.cursor() as cur:
+            read(cur, cid, read_limit)
+        conn.rollback()
+        read_latencies.append(time.perf_counter() - t0)
+
+    tenth = max(1, len(per_turn) // 10)
+    early = [x for lat in per_turn[:tenth] for x in lat]
+    late = [x for lat in per_turn[-tenth:] for x in lat]
+    print(
+        f"  {name:<9} append p50 first 10%={percentile(early, 50) * 1000:6.2f}ms "
+        f"last 10%={percentile(late, 50) * 1000:6.2f}ms "
+        f"(p99 {percentile(late, 99) * 1000:6.2f}ms) "
+        f"total={elapsed:6.1f}s wal={wal / 2**20:8.1f}MB size={size / 2**20:7.1f}MB "
+        f"read last {read_limit} p50={percentile(read_latencies, 50) * 1000:6.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=500, help="messages per conversation (two per turn)")
+    parser.add_argument("--min-chars", type=int, default=80)
+    parser.add_argument("--max-chars", type=int, default=800)
+    parser.add_argument("--read-limit", type=int, default=100)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--layouts", default="jsonb,messages")
+    args = parser.parse_args()
+
+    random.seed(0)
+    conversation_ids = [f"bench-{i}" for i in range(args.conversations)]
+    print(f"Generating {args.conversations} conversations x {args.messages} messages...")
+    turns = []
+    for _ in range(args.messages // 2):
+        turn = []
+        for cid in conversation_ids:
+            ts = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+            turn.append((cid, [
+                {"role": "user", "text": random_text(args.min_chars, args.max_chars // 4), "timestamp": ts},
+                {"role": "bot", "text": random_text(args.min_chars, args.max_chars), "timestamp": ts},
+            ]))
+        turns.append(turn)
+
+    conn = psycopg2.connect(args.dsn)
+    create_tables(conn)
+    print()
+    for name in args.layouts.split(","):
+        run_layout(conn, name.strip(), turns, conversation_ids, args.read_limit, args.reads)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
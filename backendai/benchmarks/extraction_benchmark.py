@@ -0,0 +1,162 @@
+"""
+PDF extraction benchmark: inline PyPDF2 parsing vs the extraction process pool.
+
+- inline: the old path, PdfReader(BytesIO(...)) and "".join of every page,
+  run in a thread (as asyncio.to_thread did) of the benchmark's event loop
+- pool:   services/document_extraction.aiter_document_pages over a temp file
+
+For each mode it reports documents/sec, pages/sec and MB/sec over the
+corpus, plus the event loop's worst scheduling delay while extracting
+(a 10 ms ticker): inline parsing holds the GIL, so chat requests served
+by the same process stall for as long.
+
+Usage:
+    python benchmarks/extraction_benchmark.py                        # synthetic 500-page PDFs
+    python benchmarks/extraction_benchmark.py --corpus ./pdfs --concurrency 4
+    python benchmarks/extraction_benchmark.py --docs 8 --pages 2000 --workers 4
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ("plan invoice seat admin export webhook token region backup policy support "
+         "refund upgrade trial license audit retention latency quota widget").split()
+
+
+def synthetic_pdf(pages, rng, lines_per_page=45) -> bytes:
+    """A minimal valid PDF with `pages` pages of Helvetica text."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        lines = [" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(lines_per_page)]
+        text = "".join(f"({line}) Tj T* " for line in [f"Page {page + 1}"] + lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 800 Td {text}ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects),)
+        )
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % k for k in kids), pages)
+
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def load_corpus(args):
+    if args.corpus:
+        paths = sorted(os.path.join(args.corpus, name) for name in os.listdir(args.corpus) if name.lower().endswith(".pdf"))
+        return paths, None
+    rng = random.Random(args.seed)
+    tmpdir = tempfile.mkdtemp(prefix="extraction_benchmark_")
+    paths = []
+    for i in range(args.docs):
+        path = os.path.join(tmpdir, f"doc_{i}.pdf")
+        with open(path, "wb") as f:
+            f.write(synthetic_pdf(args.pages, rng))
+        paths.append(path)
+    return paths, tmpdir
+
+
+def inline_extract(path):
+    import PyPDF2
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(BytesIO(f.read()))
+    return len(reader.pages), "".join(page.extract_text() for page in reader.pages)
+
+
+async def pool_extract(path):
+    from services.document_extraction import aiter_document_pages
+    pages = [text async for text in aiter_document_pages(path, ".pdf")]
+    return len(pages), "".join(pages)
+
+
+async def ticker(stop, lags):
+    """Records how late a 10 ms sleep wakes up (event loop / GIL stalls)."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append(time.perf_counter() - start - 0.01)
+
+
+async def run_mode(mode, paths, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    stop, lags = asyncio.Event(), []
+    totals = {"pages": 0, "chars": 0}
+
+    async def one(path):
+        async with semaphore:
+            if mode == "inline":
+                pages, text = await asyncio.to_thread(inline_extract, path)
+            else:
+                pages, text = await pool_extract(path)
+            totals["pages"] += pages
+            totals["chars"] += len(text)
+
+    tick = asyncio.create_task(ticker(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(path) for path in paths))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+
+    size_mb = sum(os.path.getsize(path) for path in paths) / 1024 / 1024
+    lags.sort()
+    print(
+        f"{mode:<7} {len(paths) / elapsed:7.2f} docs/s {totals['pages'] / elapsed:9.1f} pages/s "
+        f"{size_mb / elapsed:7.2f} MB/s  loop lag p99 {lags[int(len(lags) * 0.99)] * 1000 if lags else 0:7.1f} ms "
+        f"max {lags[-1] * 1000 if lags else 0:7.1f} ms  ({totals['chars']} chars, {elapsed:.1f}s)"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory of PDF files (default: synthetic corpus)")
+    parser.add_argument("--docs", type=int, default=6, help="synthetic documents")
+    parser.add_argument("--pages", type=int, default=500, help="pages per synthetic document")
+    parser.add_argument("--concurrency", type=int, default=2, help="documents extracted at once (ingestion fetch workers)")
+    parser.add_argument("--workers", type=int, help="extraction processes (EXTRACT_WORKERS)")
+    parser.add_argument("--modes", default="inline,pool")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.workers:
+        os.environ["EXTRACT_WORKERS"] = str(args.workers)
+    from services import document_extraction
+
+    paths, tmpdir = load_corpus(args)
+    size_mb = sum(os.path.getsize(path) for path in paths) / 1024 / 1024
+    print(f"{len(paths)} PDFs, {size_mb:.1f} MB, concurrency {args.concurrency}, "
+          f"{document_extraction.EXTRACT_WORKERS} extraction workers, batches of {document_extraction.EXTRACT_PAGE_BATCH} pages")
+
+    try:
+        for mode in args.modes.split(","):
+            await run_mode(mode, paths, args.concurrency)
+    finally:
+        document_extraction.shutdown_extraction_pool()
+        if tmpdir:
+            for path in paths:
+                os.unlink(path)
+            os.rmdir(tmpdir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Recall benchmark for vector vs hybrid (keyword + vector) retrieval.
+
+Samples chunks from a chatbot's knowledge base and turns each into an
+exact-match style question built around its rarest tokens (product names,
+SKUs, error codes, identifiers). The sampled chunk is the expected answer;
+the script reports recall@k and MRR for both retrieval modes using the
+application's own search_vectors.
+
+Run from backendai/ with the usual .env (Postgres + OpenAI):
+    python benchmarks/hybrid_recall_benchmark.py --chatbot-id <id> --samples 100
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DB.postgresDB import get_db_connection, run_query, search_vectors  # noqa: E402
+from services.embedding_service import embedding_service  # noqa: E402
+
+TOKEN_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_\-\.]{2,}")
+
+
+def key_terms(content, n):
+    """Picks the most identifier-like tokens: containing digits, caps or separators, then longest."""
+    tokens = set(TOKEN_RE.findall(content))
+
+    def score(token):
+        return (
+            any(c.isdigit() for c in token),
+            any(c in "-_." for c in token),
+            sum(c.isupper() for c in token) > 1,
+            len(token),
+        )
+
+    return sorted(tokens, key=score, reverse=True)[:n]
+
+
+def sample_chunks(chatbot_id, samples):
+    with get_db_connection() as conn:
+        rows = run_query(conn, "SELECT content FROM training_chunks WHERE chatbot_id = %s;", (chatbot_id,))
+        conn.rollback()
+    rows = [r[0] for r in rows or [] if len(r[0]) > 100]
+    random.shuffle(rows)
+    return rows[:samples]
+
+
+def evaluate(chatbot_id, cases, mode, k):
+    hits, reciprocal_ranks = 0, []
+    for question, vector, expected in cases:
+        results = search_vectors(chatbot_id, vector, limit=k, query_text=question, mode=mode) or []
+        contents = [r["content"] for r in results]
+        if expected in contents:
+            hits += 1
+            reciprocal_ranks.append(1 / (contents.index(expected) + 1))
+        else:
+            reciprocal_ranks.append(0.0)
+    return hits / len(cases), sum(reciprocal_ranks) / len(cases)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chatbot-id", required=True)
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--terms", type=int, default=2)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    chunks = sample_chunks(args.chatbot_id, args.samples)
+    if not chunks:
+        print("No chunks found for this chatbot")
+        return
+
+    questions = [f"What does the documentation say about {' '.join(key_terms(c, args.terms))}?" for c in chunks]
+    vectors = embedding_service.embed_batch(questions)
+    cases = [(q, v, c) for q, v, c in zip(questions, vectors, chunks) if v]
+
+    print(f"{len(cases)} queries against chatbot {args.chatbot_id}")
+    for mode in ("vector", "hybrid"):
+        recall, mrr = evaluate(args.chatbot_id, cases, mode, args.k)
+        print(f"  {mode:<7} recall@{args.k}={recall:.3f} MRR={mrr:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Vector search benchmark on synthetic multi-tenant data.
+
+Loads N random vectors spread over T tenants with a skewed size distribution
+into a scratch table, then compares per-tenant search strategies:
+- legacy:  plain `WHERE chatbot_id ... ORDER BY embedding <=> q` on the global ANN index
+- exact:   materialized per-tenant scan (used for tenants <= VECTOR_EXACT_SEARCH_MAX_CHUNKS)
+- hnsw:    HNSW with iterative scan (used for larger tenants)
+
+For the smallest, median and largest tenant it reports latency percentiles,
+average rows returned (legacy can return fewer than --limit) and recall@k
+against the exact result.
+
+Usage (against a scratch database, the table is dropped and recreated):
+    python benchmarks/vector_index_benchmark.py --dsn postgresql://... --rows 10000000
+    python benchmarks/vector_index_benchmark.py --dsn ... --skip-load
+"""
+
+import argparse
+import random
+import time
+
+import psycopg2
+
+
+def vector_literal(dim):
+    return "[" + ",".join(f"{random.uniform(-1, 1):.5f}" for _ in range(dim)) + "]"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def load(conn, table, rows, tenants, dim, batch):
+    with conn.cursor() as cur:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+        cur.execute(f"DROP TABLE IF EXISTS {table};")
+        cur.execute(f"""
+            CREATE TABLE {table} (
+                id BIGSERIAL PRIMARY KEY,
+                chatbot_id VARCHAR(255) NOT NULL,
+                content TEXT NOT NULL,
+                embedding VECTOR({dim})
+            );
+        """)
+        conn.commit()
+
+        # power(random(), 3) skews rows towards low tenant ids: a few large tenants, many small ones
+        inserted = 0
+        start = time.perf_counter()
+        while inserted < rows:
+            n = min(batch, rows - inserted)
+            cur.execute(f"""
+                INSERT INTO {table} (chatbot_id, content, embedding)
+                SELECT 'bench-' || floor(power(random(), 3) * %s)::int,
+                       'chunk ' || g,
+                       (SELECT array_agg(random() * 2 - 1) FROM generate_series(1, %s) WHERE g > 0)::vector
+                FROM generate_series(1, %s) g;
+            """, (tenants, dim, n))
+            conn.commit()
+            inserted += n
+            print(f"  loaded {inserted}/{rows} rows ({time.perf_counter() - start:.0f}s)")
+
+        print("  building chatbot_id index...")
+        cur.execute(f"CREATE INDEX ON {table} (chatbot_id);")
+        conn.commit()
+
+
+def build_index(conn, table, kind):
+    with conn.cursor() as cur:
+        cur.execute("SET maintenance_work_mem = '2GB';")
+        cur.execute(f"DROP INDEX IF EXISTS {table}_ann_idx;")
+        start = time.perf_counter()
+        if kind == "ivfflat":
+            cur.execute(f"CREATE INDEX {table}_ann_idx ON {table} USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);")
+        else:
+            cur.execute(f"CREATE INDEX {table}_ann_idx ON {table} USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);")
+        cur.execute(f"ANALYZE {table};")
+        conn.commit()
+        print(f"  built {kind} index in {time.perf_counter() - start:.0f}s")
+
+
+def pick_tenants(conn, table):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT chatbot_id, count(*) FROM {table} GROUP BY chatbot_id ORDER BY count(*);")
+        counts = cur.fetchall()
+    return [counts[0], counts[len(counts) // 2], counts[-1]]
+
+
+def run_query(conn, strategy, table, chatbot_id, query, limit, ef_search):
+    with conn.cursor() as cur:
+        if strategy == "exact":
+            cur.execute(f"""
+                WITH tenant_chunks AS MATERIALIZED (
+                    SELECT id, embedding FROM {table} WHERE chatbot_id = %s
+                )
+                SELECT id FROM tenant_chunks ORDER BY embedding <=> %s::vector LIMIT %s;
+            """, (chatbot_id, query, limit))
+        elif strategy == "hnsw":
+            cur.execute("SET LOCAL hnsw.iterative_scan = relaxed_order;")
+            cur.execute("SET LOCAL hnsw.ef_search = %s;", (ef_search,))
+            cur.execute(f"""
+                WITH nearest AS MATERIALIZED (
+                    SELECT id, embedding <=> %s::vector AS distance
+                    FROM {table} WHERE chatbot_id = %s
+                    ORDER BY embedding <=> %s::vector LIMIT %s
+                )
+                SELECT id FROM nearest ORDER BY distance;
+            """, (query, chatbot_id, query, limit))
+        else:
+            cur.execute(f"""
+                SELECT id FROM {table} WHERE chatbot_id = %s
+                ORDER BY embedding <=> %s::vector LIMIT %s;
+            """, (chatbot_id, query, limit))
+        ids = [r[0] for r in cur.fetchall()]
+    conn.rollback()
+    return ids
+
+
+def benchmark(conn, table, tenants, strategies, queries, limit, dim, ef_search):
+    for chatbot_id, size in tenants:
+        print(f"\nTenant {chatbot_id} ({size} chunks)")
+        vectors = [vector_literal(dim) for _ in range(queries)]
+        truth = [set(run_query(conn, "exact", table, chatbot_id, q, limit, ef_search)) for q in vectors]
+        for strategy in strategies:
+            latencies, returned, recall = [], [], []
+            for q, expected in zip(vectors, truth):
+                start = time.perf_counter()
+                ids = run_query(conn, strategy, table, chatbot_id, q, limit, ef_search)
+                latencies.append(time.perf_counter() - start)
+                returned.append(len(ids))
+                recall.append(len(expected & set(ids)) / len(expected) if expected else 1.0)
+            print(
+                f"  {strategy:<8} p50={percentile(latencies, 50) * 1000:7.1f}ms "
+                f"p99={percentile(latencies, 99) * 1000:7.1f}ms "
+                f"rows={sum(returned) / len(returned):.2f}/{limit} "
+                f"recall@{limit}={sum(recall) / len(recall):.3f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True)
+    parser.add_argument("--table", default="bench_training_chunks")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--tenants", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--batch", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--ef-search", type=int, default=100)
+    parser.add_argument("--skip-load", action="store_true")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    if not args.skip_load:
+        print(f"Loading {args.rows} rows over {args.tenants} tenants (dim={args.dim})...")
+        load(conn, args.table, args.rows, args.tenants, args.dim, args.batch)
+
+    tenants = pick_tenants(conn, args.table)
+
+    print("\n== Legacy global ivfflat index ==")
+    build_index(conn, args.table, "ivfflat")
+    benchmark(conn, args.table, tenants, ["legacy"], args.queries, args.limit, args.dim, args.ef_search)
+
+    print("\n== HNSW index + per-tenant exact scan ==")
+    build_index(conn, args.table, "hnsw")
+    benchmark(conn, args.table, tenants, ["exact", "hnsw"], args.queries, args.limit, args.dim, args.ef_search)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,22 @@
 # Async Training Helper Module for StandardRAGController
 # This file contains async training methods with webhook support
+# Jobs are queued in training_jobs (DB/training_jobs.py) and run by training_worker.py
 
 import logging
 import asyncio
-import uuid
-import threading
-import requests
-from DB.postgresDB import get_db_connection, run_query, delete_chunks, insert_chunk_batch
-from services.embedding_service import embedding_service
+from DB.postgresDB import get_db_connection, run_query, run_write_query
+from DB.training_jobs import enqueue_training_job, get_active_job
+from controller.ingestion_pipeline import IngestionPipeline
+from controller.training_progress import progress_reporter, TERMINAL_STATUSES
 
 async def start_training_job(chatbot_id: str, webhook_url: str = None):
-    """Start async training and return immediately."""
+    """Queue a training job (run by training_worker.py) and return immediately."""
     print(f"\n{'='*80}")
     print(f"🚀 INSIDE start_training_job()")
     print(f"   chatbot_id: {chatbot_id}")
     print(f"   webhook_url: {webhook_url}")
     print(f"{'='*80}")
     
-    job_id = str(uuid.uuid4())
-    print(f"📝 Generated job_id: {job_id}")
-    
     # Get organization_id
     def get_org_id():
         with get_db_connection() as conn:
@@ -42,58 +39,33 @@ async def start_training_job(chatbot_id: str, webhook_url: str = None):
     organization_id, current_status = result
     print(f"📊 Org: {organization_id}, Status: '{current_status}'")
     
-    if current_status == 'training':
+    # 'training' without a queued/running job is left over from a lost run: start again
+    active_job = await asyncio.to_thread(get_active_job, chatbot_id)
+    if active_job:
         print(f"⚠️  ALREADY TRAINING - returning early")
-        return {'status': 'already_training', 'message': 'Training already in progress'}
+        return {'job_id': active_job[0], 'status': 'already_training', 'message': 'Training already in progress'}
     
     print(f"✅ Status check passed, continuing...")
-    # Import here to avoid circular import
-    from controller.standard_rag_controller import StandardRAGController
-    print(f"✅ Imported RAGController")
-    
-   # Log that we're starting the job
-    logging.info(f"Starting training job {job_id} for chatbot {chatbot_id}, org {organization_id}")
+    job_id, created = await asyncio.to_thread(enqueue_training_job, chatbot_id, organization_id, webhook_url)
+    if not created:
+        return {'job_id': job_id, 'status': 'already_training', 'message': 'Training already in progress'}
+
+    # Log that we're starting the job
+    logging.info(f"Queued training job {job_id} for chatbot {chatbot_id}, org {organization_id}")
     
     print(f"💾 Updating DB status...")
     def update_db():
         with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE automations SET training_status='training', training_progress=0, training_job_id=%s, training_started_at=NOW(), training_message='Training started...' WHERE organization_id=%s",
+            run_write_query(
+                conn,
+                "UPDATE automations SET training_status='training', training_progress=0, training_job_id=%s, training_started_at=NOW(), training_message='Training queued...' WHERE organization_id=%s",
                 (job_id, organization_id)
             )
-            conn.commit()
-            cursor.close()
     await asyncio.to_thread(update_db)
     print(f"✅ DB updated")
-    await send_webhook(webhook_url, organization_id, 'training', 5, 'Training started', None)
+    await send_webhook(webhook_url, organization_id, 'training', 5, 'Training queued', None)
     print(f"📡 Webhook sent\n")
     
-    # Start background thread with proper sync wrapper
-    print(f"🎬 Defining thread wrapper function...")
-    def run_async_training():
-        """Synchronous wrapper to run async function in thread"""
-        print(f"🧵 THREAD FUNCTION EXECUTING for job {job_id}")
-        try:
-            print(f"🏃 Calling asyncio.run()...")
-            asyncio.run(ingest_to_vector_db_async(
-                job_id, chatbot_id, organization_id, webhook_url, StandardRAGController
-            ))
-            print(f"✅ asyncio.run() completed")
-        except Exception as e:
-            print(f"❌ Thread exception: {e}")
-            import traceback
-            traceback.print_exc()
-            logging.error(f"Background training thread failed: {e}", exc_info=True)
-    
-    print(f"▶️  Creating Thread object...")
-    thread = threading.Thread(target=run_async_training)
-    thread.daemon = True
-    print(f"▶️  Calling thread.start()...")
-    thread.start()
-    print(f"✅ thread.start() completed")
-    
-    logging.info(f"Training job {job_id} thread started successfully")
     return {'job_id': job_id, 'status': 'started', 'message': 'Training started'}
 
 async def ingest_to_vector_db_async(
@@ -103,126 +75,76 @@ async def ingest_to_vector_db_async(
     webhook_url: str,
     RAGController
 ):
-    """Background training with WebSocket progress updates."""
-    try:
-        logging.info(f"🚀 Starting async training job {job_id} for org {organization_id}")
-        
-        # Step 1: Fetch
-        await send_webhook(
-            webhook_url, organization_id, 'training', 10, "Fetching training data..."
-        )
-        
-        logging.info(f"📥 Fetching data for chatbot {chatbot_id}")
-        documents, processed_items = await RAGController.fetch_and_prepare_data(chatbot_id)
-        if not documents:
-            logging.info(f"ℹ️  No untrained data found for chatbot {chatbot_id}")
+    """
+    Runs one training job with webhook progress updates (called by training_worker.py).
+    Raises on failure; the worker retries the job or calls mark_training_failed.
+    Re-running a job is safe and cheap: sources are marked trained as soon as
+    they finish and pages this job already wrote are skipped (checkpoint=job_id).
+    """
+    logging.info(f"🚀 Starting async training job {job_id} for org {organization_id}")
+    
+    # Step 1: Fetch
+    await send_webhook(
+        webhook_url, organization_id, 'training', 10, "Fetching training data..."
+    )
+    
+    logging.info(f"📥 Streaming training data for chatbot {chatbot_id}")
+    training_rows = await RAGController.fetch_training_rows(chatbot_id)
+
+    # Documents flow fetch -> clean -> embed -> insert as they become ready;
+    # report 10-90% as they complete (only when the percentage moves; the
+    # reporter coalesces these, so this never waits on rtserver).
+    last_progress = 10
+
+    async def on_progress(done, total):
+        nonlocal last_progress
+        progress = 10 + int(done / max(total, 1) * 80)
+        if progress > last_progress:
+            last_progress = progress
             await send_webhook(
-                webhook_url, organization_id, 'completed', 100, "No new data to train"
+                webhook_url, organization_id, 'training', progress,
+                f"Processed {done}/{total} documents..."
             )
-            return
-        
-        logging.info(f"✅ Fetched {len(documents)} new documents for training")
-        
-        # Step 2: Prepare Chunks (Per Document)
-        await send_webhook(
-            webhook_url, organization_id, 'training', 30, "Chunking text..."
-        )
-        
-        logging.info(f"✂️  Chunking text data")
-        
-        all_chunks_data = []
-        total_chunks = 0
-        
-        # Pre-process chunks to calculate total for progress bar
-        # We prefer to embed as we go? Or chunk all first? Chunking is fast.
-        
-        temp_chunks = []
-        for doc in documents:
-            source = doc['source']
-            content = doc['content']
-            chunks = RAGController.chunk_text(content)
-            for chunk in chunks:
-                temp_chunks.append({
-                    'source': source,
-                    'content': chunk
-                })
-        
-        total_chunks = len(temp_chunks)
-        logging.info(f"✅ Generated {total_chunks} chunks total")
 
-        # Step 3: Embed
-        await send_webhook(
-             webhook_url, organization_id, 'training', 35, f"Embedding {total_chunks} chunks..."
-        )
+    async def on_source_done(items):
+        await RAGController.mark_items_as_trained(chatbot_id, items)
 
-        logging.info(f"🔢 Starting embedding for {total_chunks} chunks")
-        for i, item in enumerate(temp_chunks):
-            if (i + 1) % 10 == 0 or i == total_chunks - 1:
-                progress = 30 + int((i + 1) / total_chunks * 40)  # 30-70%
-                await send_webhook(
-                    webhook_url, organization_id, 'training', progress,
-                    f"Embedded {i + 1}/{total_chunks} chunks..."
-                )
-                logging.info(f"📊 Progress: {i + 1}/{total_chunks} chunks embedded ({progress}%)")
-            
-            vector = embedding_service.embed_text(item['content'])
-            if vector:
-                all_chunks_data.append({
-                    "index": i, # Global index or per file? Global is fine for now.
-                    "content": item['content'],
-                    "embedding": vector,
-                    "source": item['source']
-                })
-        
-        logging.info(f"✅ Embedded {len(all_chunks_data)} chunks successfully")
-        
-        # Step 4: Save
-        await send_webhook(
-            webhook_url, organization_id, 'training', 80, "Saving to database..."
-        )
-        
-        from DB.postgresDB import delete_specific_chunks 
-        
-        # Clear specific sources before inserting (Incremental Update)
-        sources_to_clear = set(d['source'] for d in documents)
-        logging.info(f"💾 Clearing old chunks for {len(sources_to_clear)} sources...")
-        for source in sources_to_clear:
-             await asyncio.to_thread(delete_specific_chunks, chatbot_id, source)
-        
-        logging.info(f"💾 Inserting {len(all_chunks_data)} new chunks")
-        await asyncio.to_thread(insert_chunk_batch, chatbot_id, all_chunks_data)
-        
-        # Step 5: Mark trained
-        await send_webhook(
-            webhook_url, organization_id, 'training', 95, "Marking items as trained..."
-        )
-        
-        logging.info(f"✅ Marking items as trained")
-        await RAGController.mark_items_as_trained(chatbot_id, processed_items)
-        
-        # Complete
-        await send_webhook(
-            webhook_url, organization_id, 'completed', 100, "Training completed!"
-        )
-        
-        logging.info(f"🎉 Training job {job_id} completed successfully!")
-        
-    except Exception as e:
-        logging.error(f"❌ Training job {job_id} failed: {e}")
-        logging.error(f"Traceback:", exc_info=True)
-        
-        # Fallback: Update DB directly in case webhook fails
-        try:
-             def mark_failed():
-                with get_db_connection() as conn:
-                    run_query(conn, "UPDATE automations SET training_status='failed', training_message=%s WHERE organization_id=%s", (str(e), organization_id))
-             await asyncio.to_thread(mark_failed)
-        except Exception as db_err:
-             logging.error(f"Failed to update DB status to failed: {db_err}")
+    pipeline = IngestionPipeline(
+        chatbot_id, RAGController.chunk_text, on_progress=on_progress,
+        checkpoint=job_id, on_source_done=on_source_done,
+    )
+    result = await pipeline.run(training_rows)
 
+    if not result['documents'] and not result['unchanged'] and not result['resumed']:
+        logging.info(f"ℹ️  No untrained data found for chatbot {chatbot_id}")
         await send_webhook(
-            webhook_url, organization_id, 'failed', 0, f"Training error: {str(e)}", str(e)
+            webhook_url, organization_id, 'completed', 100, "No new data to train"
         )
+        return
+
+    logging.info(f"✅ Saved {result['chunks']} chunks from {result['documents']} documents ({result['unchanged']} unchanged, {result['resumed']} resumed, {result['reused_embeddings']} embeddings reused, LLM cleanup ${result['llm_cost_usd']:.4f}, {result['seconds_per_document']}s/document)")
+    processed_items = result['processed_items']
+
+    # Step 2: Mark trained (sources were marked as they finished; this catches any that failed to)
+    await send_webhook(
+        webhook_url, organization_id, 'training', 95, "Marking items as trained..."
+    )
+    
+    logging.info(f"✅ Marking items as trained")
+    await RAGController.mark_items_as_trained(chatbot_id, processed_items)
+    
+    # Complete
+    await send_webhook(
+        webhook_url, organization_id, 'completed', 100, "Training completed!"
+    )
+    
+    logging.info(f"🎉 Training job {job_id} completed successfully!")
+
+async def mark_training_failed(organization_id: int, webhook_url: str, error: str):
+    """Reports a training job that is out of attempts (automations is updated even if the webhook fails)."""
+    await send_webhook(
+        webhook_url, organization_id, 'failed', 0, f"Training error: {error}", error
+    )
 
 async def send_webhook(
     webhook_url: str, 
@@ -232,22 +154,12 @@ async def send_webhook(
     message: str,
     error: str = None
 ):
-    """Send progress update to rtserver webhook."""
-    if not webhook_url:
-        logging.info(f"Training {organization_id}: {status} - {progress}% - {message}")
-        return
-    
-    def send():
-        try:
-            requests.post(webhook_url, json={
-                'organization_id': organization_id,
-                'status': status,
-                'progress': progress,
-                'message': message,
-                'error': error
-            }, timeout=5)
-        except Exception as e:
-            logging.error(f"Webhook failed: {e}")
-    
-    await asyncio.to_thread(send)
-    logging.info(f"Training {organization_id}: {status} - {progress}% - {message}")
+    """
+    Reports training progress to rtserver (webhook) and automations.
+    Progress updates are coalesced and sent in the background (controller/training_progress.py);
+    terminal states ('completed', 'failed') are delivered before returning.
+    """
+    if status in TERMINAL_STATUSES:
+        await progress_reporter.deliver(webhook_url, organization_id, status, progress, message, error)
+    else:
+        progress_reporter.report(webhook_url, organization_id, status, progress, message, error)
@@ -1,44 +1,76 @@
 
+import os
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from urllib.parse import urljoin
 import PIL.Image
 from bs4 import BeautifulSoup
-import docx
-from pptx import Presentation
 import requests
-from io import BytesIO
-import PyPDF2
 import base64
 from typing import Optional
 from services.openai_services import client
+from services.document_extraction import DOCUMENT_TYPES, extract_document_text_sync
+from utils.text_cleaner import clean_text, quality_score, split_segments
 
 def encode_image(image_bytes):
     return base64.b64encode(image_bytes).decode('utf-8')
 
-def generate_chatbot_training_instruction(content: str, image_bytes: Optional[bytes] = None) -> str:
+# Cleanup of extracted training text (see utils/text_cleaner.py):
+#   never:  deterministic cleaner only
+#   auto:   deterministic cleaner, then the LLM only for extractions scoring below INGEST_LLM_MIN_QUALITY
+#   always: deterministic cleaner, then the LLM for everything (previous behaviour)
+# Images are always transcribed by the LLM. Long texts are cleaned in segments
+# of INGEST_LLM_SEGMENT_CHARS, INGEST_LLM_CONCURRENCY at a time, instead of being cut.
+INGEST_LLM_CLEANUP = os.getenv("INGEST_LLM_CLEANUP", "auto").lower()
+INGEST_LLM_MIN_QUALITY = float(os.getenv("INGEST_LLM_MIN_QUALITY", "0.6"))
+INGEST_LLM_SEGMENT_CHARS = int(os.getenv("INGEST_LLM_SEGMENT_CHARS", "12000"))
+INGEST_LLM_CONCURRENCY = int(os.getenv("INGEST_LLM_CONCURRENCY", "4"))
+
+CLEANUP_MODEL = "gpt-4o-mini"
+# USD per 1M tokens (input, output) of CLEANUP_MODEL, for cost reporting
+CLEANUP_MODEL_PRICE = (0.15, 0.60)
+
+CLEANUP_SYSTEM_PROMPT = (
+    "You are an expert Data Cleaner for AI RAG Systems. Your goal is to reformat raw extract "
+    "into clean, structured Markdown for a Vector Database to index.\n"
+    "CRITICAL INSTRUCTIONS:\n"
+    "1. **PRESERVE ALL DATA**: Do NOT summarize, abbreviate, or omit any details. Keep every single fact, number, sentence, and paragraph.\n"
+    "2. **Fix Scanned/PDF Text**: If the input has broken line breaks (typical in PDFs/Slides), merge them into coherent paragraphs. Fix disjointed sentences.\n"
+    "3. **Structure It**: \n"
+    "   - Use **Markdown Headers** (#, ##) for logical sections.\n"
+    "   - Use **Bullet Points** for lists.\n"
+    "   - Use **Markdown Tables** for any tabular data (preserve rows/cols accurately).\n"
+    "   - Use **Code Blocks** for any code snippets.\n"
+    "4. **Clean Layout**: Remove technical artifacts (like 'Page 1 of 10', 'Footer', 'Copyright', 'Menu', 'Nav'). Keep the BODY content 100% intact.\n"
+    "5. **No Meta-Talk**: Do not add intros like 'Here is the cleaned data'. Output ONLY the cleaned content."
+)
+
+
+@dataclass
+class CleanupResult:
+    text: str
+    quality: float = 1.0            # text_cleaner.quality_score of the deterministic cleanup
+    llm_segments: int = 0           # LLM calls made (0 when the deterministic cleanup was kept)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    seconds: float = 0.0
+
+    @property
+    def cost_usd(self) -> float:
+        return (self.prompt_tokens * CLEANUP_MODEL_PRICE[0] + self.completion_tokens * CLEANUP_MODEL_PRICE[1]) / 1_000_000
+
+
+def _llm_clean(content: str, image_bytes: Optional[bytes] = None, part: str = ""):
     """
-    Cleans and structures raw content (PDF, DOCX, HTML, PPT, etc.) for Vector DB Ingestion.
-    Preserves 100% of information while fixing layout issues.
+    One cleanup call. Returns (text, prompt_tokens, completion_tokens);
+    on error the input is returned unchanged rather than an error message.
     """
     try:
-        system_prompt = (
-            "You are an expert Data Cleaner for AI RAG Systems. Your goal is to reformat raw extract "
-            "into clean, structured Markdown for a Vector Database to index.\n"
-            "CRITICAL INSTRUCTIONS:\n"
-            "1. **PRESERVE ALL DATA**: Do NOT summarize, abbreviate, or omit any details. Keep every single fact, number, sentence, and paragraph.\n"
-            "2. **Fix Scanned/PDF Text**: If the input has broken line breaks (typical in PDFs/Slides), merge them into coherent paragraphs. Fix disjointed sentences.\n"
-            "3. **Structure It**: \n"
-            "   - Use **Markdown Headers** (#, ##) for logical sections.\n"
-            "   - Use **Bullet Points** for lists.\n"
-            "   - Use **Markdown Tables** for any tabular data (preserve rows/cols accurately).\n"
-            "   - Use **Code Blocks** for any code snippets.\n"
-            "4. **Clean Layout**: Remove technical artifacts (like 'Page 1 of 10', 'Footer', 'Copyright', 'Menu', 'Nav'). Keep the BODY content 100% intact.\n"
-            "5. **No Meta-Talk**: Do not add intros like 'Here is the cleaned data'. Output ONLY the cleaned content."
-        )
-         
         start_message = {
             "role": "user",
-            "content": f"Here is the raw content:\n\n{content[:50000]}\n\nPlease reformat it cleanly while keeping ALL information."
+            "content": f"Here is the raw content{part}:\n\n{content}\n\nPlease reformat it cleanly while keeping ALL information."
         }
         
         if image_bytes:
@@ -55,18 +87,54 @@ def generate_chatbot_training_instruction(content: str, image_bytes: Optional[by
             ]
 
         response = client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=CLEANUP_MODEL,
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": CLEANUP_SYSTEM_PROMPT},
                 start_message
             ],
             temperature=0.3
         )
-        
-        return response.choices[0].message.content
+        usage = response.usage
+        return response.choices[0].message.content, getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0)
     except Exception as e:
         logging.error(f"Error generating training instruction: {e}")
-        return "Error generating summary."
+        return content, 0, 0
+
+def clean_training_content(content: str, image_bytes: Optional[bytes] = None, mode: str = None) -> CleanupResult:
+    """
+    Cleans raw content (PDF, DOCX, HTML, PPT, etc.) for Vector DB Ingestion without dropping any of it:
+    deterministic cleanup first, then the LLM where INGEST_LLM_CLEANUP says so.
+    """
+    start = time.perf_counter()
+    mode = mode or INGEST_LLM_CLEANUP
+    result = CleanupResult(text="")
+
+    if image_bytes:
+        result.text, result.prompt_tokens, result.completion_tokens = _llm_clean("", image_bytes)
+        result.llm_segments = 1
+    else:
+        cleaned = clean_text(content)
+        result.text = cleaned
+        result.quality = quality_score(cleaned)
+        if cleaned and (mode == "always" or (mode == "auto" and result.quality < INGEST_LLM_MIN_QUALITY)):
+            segments = split_segments(cleaned, INGEST_LLM_SEGMENT_CHARS)
+            parts = [f" (part {i + 1} of {len(segments)})" if len(segments) > 1 else "" for i in range(len(segments))]
+            with ThreadPoolExecutor(max_workers=max(1, INGEST_LLM_CONCURRENCY)) as executor:
+                outputs = list(executor.map(_llm_clean, segments, [None] * len(segments), parts))
+            result.text = "\n\n".join(text for text, _, _ in outputs if text)
+            result.llm_segments = len(segments)
+            result.prompt_tokens = sum(p for _, p, _ in outputs)
+            result.completion_tokens = sum(c for _, _, c in outputs)
+
+    result.seconds = time.perf_counter() - start
+    return result
+
+def generate_chatbot_training_instruction(content: str, image_bytes: Optional[bytes] = None) -> str:
+    """
+    Cleans and structures raw content (PDF, DOCX, HTML, PPT, etc.) for Vector DB Ingestion.
+    Preserves 100% of information while fixing layout issues.
+    """
+    return clean_training_content(content, image_bytes).text
 
 def get_sitemap_urls(base_url: str) -> list[str]:
     sitemaps = ["/sitemap.xml", "/sitemap_index.xml"]
@@ -96,99 +164,119 @@ def get_sitemap_urls(base_url: str) -> list[str]:
     return []
 
 
-def get_url_data(url):
-    try:
-        # Fetch data from the URL
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        # Remove script and style elements
-        for script_or_style in soup(['script', 'style', 'nav', 'footer']):
-            script_or_style.decompose()
+# (connect, read) timeout for every download made while building training data
+REQUEST_TIMEOUT = (5, 30)
+
+def extract_html_text(html: str) -> str:
+    soup = BeautifulSoup(html, 'html.parser')
+    # Remove script and style elements
+    for script_or_style in soup(['script', 'style', 'nav', 'footer']):
+        script_or_style.decompose()
 
-        # Get text
-        text = soup.get_text(separator='\n')
+    # Get text
+    text = soup.get_text(separator='\n')
 
-        # Break into lines and remove leading and trailing space on each
-        lines = (line.strip() for line in text.splitlines())
-        # Break multi-headlines into a line each
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        # Drop blank lines
-        url_data = '\n'.join(chunk for chunk in chunks if chunk)
+    # Break into lines and remove leading and trailing space on each
+    lines = (line.strip() for line in text.splitlines())
+    # Break multi-headlines into a line each
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    # Drop blank lines
+    return '\n'.join(chunk for chunk in chunks if chunk)
 
-        summary = generate_chatbot_training_instruction(url_data)
-        print(summary)
-        return summary
+def conditional_get(url, etag: str = None, last_modified: str = None, stream: bool = False):
+    """
+    GET with If-None-Match / If-Modified-Since from a previous download.
+    Returns the response; status 304 means the resource is unchanged.
+    stream=True leaves the body unread (documents are streamed to a temp file).
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=stream)
+    if response.status_code != 304:
+        response.raise_for_status()
+    return response
 
+def fetch_url_text(url) -> str:
+    """
+    Downloads a web page and returns its visible text (no LLM cleanup).
+    Returns "" on network errors.
+    """
+    try:
+        return extract_html_text(conditional_get(url).text)
     except requests.exceptions.RequestException as e:
+        logging.warning(f"Could not fetch {url}: {e}")
+        return ""
+
+def extract_file_text(file_url: str, ext: str):
+    """
+    Downloads a training file and extracts its raw text (no LLM cleanup).
+    Returns: Tuple(text, image_bytes) - image_bytes is set for images, which are transcribed by the cleaner.
+    """
+    return extract_response_text(conditional_get(file_url, stream=ext in DOCUMENT_TYPES), ext)
+
+def extract_response_text(response, ext: str):
+    """
+    Extracts raw text from a downloaded page or file by extension ('.html' for web pages).
+    Returns: Tuple(text, image_bytes)
+    """
+    if ext == '.html':
+        return extract_html_text(response.text), None
+
+    if ext in ['.jpeg', '.jpg', '.png']:
+        return "", response.content
+
+    if ext in DOCUMENT_TYPES:
+        # PDF / Word / PowerPoint are parsed in worker processes (services/document_extraction.py)
+        return extract_document_text_sync(response, ext), None
+
+    if ext == '.txt':
+        return response.text, None
+
+    return "", None
+
+def get_url_data(url):
+    url_data = fetch_url_text(url)
+    if not url_data:
         return ""
 
+    summary = generate_chatbot_training_instruction(url_data)
+    print(summary)
+    return summary
+
 
 # Fetch the image from the URL
 def image_data(url):
-    response_image = requests.get(url)
-    if response_image.status_code == 200:
-        # img = PIL.Image.open(BytesIO(response_image.content)) # Not needed for OpenAI logic here
-        summary = generate_chatbot_training_instruction("", image_bytes=response_image.content)
-        return summary
-    else:
-        print("Failed to retrieve the image. Status code:", response_image.status_code)
+    try:
+        _, image_bytes = extract_file_text(url, '.jpg')
+    except requests.exceptions.RequestException as e:
+        print("Failed to retrieve the image:", e)
+        return None
+    # img = PIL.Image.open(BytesIO(response_image.content)) # Not needed for OpenAI logic here
+    return generate_chatbot_training_instruction("", image_bytes=image_bytes)
 
 def pdf_data(pdf_url):
-    response = requests.get(pdf_url)
-    response.raise_for_status()
-    
-    if response.status_code == 200:
-        file = BytesIO(response.content)
-        reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page_num in range(len(reader.pages)):
-            page = reader.pages[page_num]
-            text += page.extract_text()
-        
-        summary = generate_chatbot_training_instruction(text)
-        print(summary)
-        return summary
-        
-        
+    text, _ = extract_file_text(pdf_url, '.pdf')
+    summary = generate_chatbot_training_instruction(text)
+    print(summary)
+    return summary
+
 def doc_data(docx_url):
-    response = requests.get(docx_url)
-    response.raise_for_status()
-    
-    if response.status_code == 200:
-        file = BytesIO(response.content)
-        doc = docx.Document(file)
-        text = "\n".join([para.text for para in doc.paragraphs])
-        
-        summary = generate_chatbot_training_instruction(text)
-        print(summary)
-        return summary
-        
+    text, _ = extract_file_text(docx_url, '.docx')
+    summary = generate_chatbot_training_instruction(text)
+    print(summary)
+    return summary
+
 def txt_data(txt_url):
-    response = requests.get(txt_url)
-    response.raise_for_status()
-    
-    if response.status_code == 200:
-        text = response.text
-        
-        summary = generate_chatbot_training_instruction(text)
-        print(summary)
-        return summary
+    text, _ = extract_file_text(txt_url, '.txt')
+    summary = generate_chatbot_training_instruction(text)
+    print(summary)
+    return summary
 
 def ppt_data(pptx_url):
-    response = requests.get(pptx_url)
-    response.raise_for_status()
-
-    if response.status_code == 200:
-        file = BytesIO(response.content)
-        presentation = Presentation(file)
-        text = ""
-
-        for slide in presentation.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text += shape.text + "\n"
-
-        summary = generate_chatbot_training_instruction(text)
-        print(summary)
-        return summary
\ No newline at end of file
+    text, _ = extract_file_text(pptx_url, '.pptx')
+    summary = generate_chatbot_training_instruction(text)
+    print(summary)
+    return summary
@@ -0,0 +1,147 @@
+"""
+Rolling summaries of long conversations.
+
+Chat turns used to send up to CHAT_HISTORY_LIMIT raw messages to the model
+and /realtime/session pasted the last 20 into its instructions, so prompt
+size grew with the conversation. Once the messages after the stored summary
+exceed CHAT_SUMMARY_TRIGGER_TOKENS, maybe_compact() schedules a background
+job that folds all but the last CHAT_SUMMARY_KEEP_MESSAGES of them into the
+summary (bot_conversation_summaries). Prompts then carry the summary
+(summary_instruction) plus the messages after it, which stays around
+trigger + one turn regardless of conversation length.
+
+The job runs after the reply has been sent. A failed or slow job only
+means the next turns send more verbatim history (still capped by
+CHAT_HISTORY_LIMIT).
+"""
+
+import os
+import time
+import asyncio
+import logging
+
+from DB.conversation_store import get_unsummarized_messages, save_summary
+from DB.postgresDB import get_db_connection
+from services.openai_services import client
+from utils import metrics
+from utils.tokenizer import count_tokens
+
+CHAT_SUMMARY_ENABLED = os.getenv("CHAT_SUMMARY_ENABLED", "true").lower() == "true"
+CHAT_SUMMARY_TRIGGER_TOKENS = int(os.getenv("CHAT_SUMMARY_TRIGGER_TOKENS", "2000"))
+CHAT_SUMMARY_KEEP_MESSAGES = int(os.getenv("CHAT_SUMMARY_KEEP_MESSAGES", "8"))
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "400"))
+CHAT_SUMMARY_INPUT_TOKENS = int(os.getenv("CHAT_SUMMARY_INPUT_TOKENS", "6000"))
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain the memory of a customer support chat between a user and an AI assistant. "
+    "Update the existing summary with the new messages. Keep every fact the assistant may need later: "
+    "the user's name, email, phone, company, needs, questions asked, answers and prices given, "
+    "commitments, handoffs and open issues. Drop greetings and small talk. "
+    f"Write plain prose in the third person, at most {CHAT_SUMMARY_MAX_TOKENS * 3 // 4} words."
+)
+
+# conversation_id -> task; one compaction per conversation at a time (and a strong reference to the task)
+_running = {}
+
+
+def history_tokens(messages: list) -> int:
+    """Tokens of raw history entries ({role, text}) as sent to the model."""
+    return sum(count_tokens(m.get("text", "")) + 4 for m in messages if isinstance(m, dict))
+
+
+def summary_instruction(summary: str) -> str:
+    """System prompt section carrying the summary of earlier messages."""
+    if not summary:
+        return ""
+    return (
+        "\n\n[EARLIER CONVERSATION SUMMARY]\n"
+        "The messages below continue a longer conversation. Summary of what was said before them:\n"
+        f"{summary}\n"
+    )
+
+
+def maybe_compact(conversation_id: str, history: list) -> bool:
+    """
+    Schedules a compaction when the history after the summary is over budget.
+    Call from the event loop with the history that was sent to the model.
+    """
+    if not CHAT_SUMMARY_ENABLED or not conversation_id or conversation_id in _running:
+        return False
+    if len(history) <= CHAT_SUMMARY_KEEP_MESSAGES or history_tokens(history) <= CHAT_SUMMARY_TRIGGER_TOKENS:
+        return False
+
+    task = asyncio.get_running_loop().create_task(asyncio.to_thread(compact_conversation, conversation_id))
+    _running[conversation_id] = task
+    task.add_done_callback(lambda t: _running.pop(conversation_id, None))
+    return True
+
+
+def _format(messages) -> str:
+    lines = []
+    for msg in messages:
+        role = "Assistant" if msg.get("role") == "bot" else "User"
+        lines.append(f"{role}: {msg.get('text', '')}")
+    return "\n".join(lines)
+
+
+def _summarize(summary: str, messages: list) -> str:
+    content = (
+        f"Existing summary:\n{summary or '(none)'}\n\n"
+        f"New messages:\n{_format(messages)}"
+    )
+    response = client.chat.completions.create(
+        model=CHAT_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": content},
+        ],
+        max_tokens=CHAT_SUMMARY_MAX_TOKENS,
+        temperature=0.2,
+    )
+    return response.choices[0].message.content.strip()
+
+
+def _windows(rows, max_tokens):
+    """Splits (seq, message) rows into consecutive windows of about max_tokens."""
+    window, tokens = [], 0
+    for seq, msg in rows:
+        size = count_tokens(msg.get("text", "")) + 4
+        if window and tokens + size > max_tokens:
+            yield window
+            window, tokens = [], 0
+        window.append((seq, msg))
+        tokens += size
+    if window:
+        yield window
+
+
+def compact_conversation(conversation_id: str) -> bool:
+    """
+    Folds all but the last CHAT_SUMMARY_KEEP_MESSAGES unsummarized messages into the summary.
+    Long backlogs (e.g. migrated conversations) are summarized window by window.
+    """
+    try:
+        with get_db_connection() as conn:
+            summary, message_count, rows = get_unsummarized_messages(conn, conversation_id)
+        rows = [(seq, msg) for seq, msg in rows if isinstance(msg, dict)]
+        to_fold = rows[:-CHAT_SUMMARY_KEEP_MESSAGES] if CHAT_SUMMARY_KEEP_MESSAGES else rows
+        if not to_fold:
+            return False
+
+        start = time.perf_counter()
+        for window in _windows(to_fold, CHAT_SUMMARY_INPUT_TOKENS):
+            summary = _summarize(summary, [msg for _, msg in window])
+            message_count += len(window)
+            # Saved per window so a failure part-way keeps the progress made
+            with get_db_connection() as conn:
+                save_summary(conn, conversation_id, summary, window[-1][0], message_count, count_tokens(summary))
+
+        metrics.observe("conversation_summary.compact_seconds", time.perf_counter() - start)
+        metrics.increment("conversation_summary.compactions")
+        logging.info(f"Compacted {len(to_fold)} messages of {conversation_id} into its summary")
+        return True
+    except Exception as e:
+        metrics.increment("conversation_summary.errors")
+        logging.error(f"Error compacting conversation {conversation_id}: {e}")
+        return False
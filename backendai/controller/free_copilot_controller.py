@@ -3,6 +3,7 @@ import json
 import uuid
 import logging
 import os
+import threading
 import requests
 from datetime import datetime
 from typing import Dict, Any, List
@@ -13,7 +14,10 @@ from fastapi.responses import StreamingResponse
 import google.generativeai as genai
 from openai import OpenAI
 
-from DB.postgresDB import postgres_connection, run_query
+from DB.postgresDB import get_db_connection, run_query
+from DB.async_pool import fetch_all
+from utils.tokenizer import count_tokens
+from utils.sse import DISCONNECTED, record_abandoned
 
 
 # Initialize router
@@ -29,16 +33,15 @@ client = OpenAI(api_key=OPENAI_API_KEY)
 
 # ----------------- TOKEN HELPER -----------------
 def estimate_tokens(text: str) -> int:
-    """Very basic token estimation (replace with a tokenizer if needed)."""
-    return len(text.split())
+    """Token count with the shared tokenizer (utils/tokenizer.py)."""
+    return count_tokens(text)
 
 
 # ----------------- OPENAI ASSISTANT HELPERS -----------------
 async def get_assistant(chatbot_id):
-    conn = postgres_connection()
     query = "SELECT assistant_id FROM bot_assistants WHERE chatbot_id = %s;"
-    result = run_query(conn, query, (chatbot_id,))
-    conn.close()
+    with get_db_connection() as conn:
+        result = run_query(conn, query, (chatbot_id,))
     if result:
         return result[0][0]
     return None
@@ -85,12 +88,12 @@ class FreePlanCopilotController:
         if chatbot_id in self.api_key_cache:
             return self.api_key_cache[chatbot_id]
 
-        connection = await asyncio.to_thread(postgres_connection)
-        if not connection:
-            raise HTTPException(status_code=500, detail="Database connection failed")
-
         query = "SELECT api_key FROM chatbots WHERE chatbot_id = %s;"
-        result = await asyncio.to_thread(run_query, connection, query, (chatbot_id,))
+        try:
+            result = await fetch_all(query, (chatbot_id,))
+        except Exception as e:
+            logging.error(f"Error fetching API key: {e}")
+            raise HTTPException(status_code=500, detail="Database connection failed")
 
         api_key = None
         if isinstance(result, list) and len(result) > 0:
@@ -174,14 +177,19 @@ class FreePlanCopilotController:
                 yield f"[ERROR]: {str(e)}"
 
         # Convert sync generator to async stream
-        async for token in self._async_yield_from_thread(sync_stream):
-            if token.startswith("[ERROR]:"):
-                yield f"data: {json.dumps({'error': token, 'done': True})}\n\n"
-                return
-
-            full_response += token
-            yield f"data: {json.dumps({'token': token, 'event': 'stream'})}\n\n"
-            await asyncio.sleep(0)
+        try:
+            async for token in self._async_yield_from_thread(sync_stream):
+                if token.startswith("[ERROR]:"):
+                    yield f"data: {json.dumps({'error': token, 'done': True})}\n\n"
+                    return
+
+                full_response += token
+                yield f"data: {json.dumps({'token': token, 'event': 'stream'})}\n\n"
+        except DISCONNECTED:
+            record_abandoned("free_copilot", full_response)
+            session["history"].append({"role": "user", "message": prompt, "timestamp": datetime.utcnow()})
+            session["history"].append({"role": "assistant", "message": full_response, "timestamp": datetime.utcnow(), "interrupted": True})
+            raise
 
         # Optional: store local session memory
         session["history"].append({"role": "user", "message": prompt, "timestamp": datetime.utcnow()})
@@ -191,14 +199,35 @@ class FreePlanCopilotController:
         yield f"data: {json.dumps({'event': 'complete', 'conversation_id': session_id})}\n\n"
 
     async def _async_yield_from_thread(self, generator_func):
-        """Helper: converts blocking Gemini generator into async iterator."""
-        loop = asyncio.get_event_loop()
-
-        def to_list():
-            return list(generator_func())
-
-        for item in await loop.run_in_executor(None, to_list):
-            yield item
+        """
+        Helper: converts blocking Gemini generator into async iterator.
+        Items are yielded as the thread produces them; the thread stops reading
+        the Gemini stream once this iterator is closed (client disconnect).
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for item in generator_func():
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = loop.run_in_executor(None, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                yield item
+            await producer
+        finally:
+            stop.set()
 
     def _prepare_prompt_with_context(self, prompt: str, context_data: Dict[str, Any] = None) -> str:
         """Optionally add structured data (tickets, history, etc.) to the prompt."""
@@ -22,6 +22,7 @@ import json
 import os
 import time
 import uuid
+from contextlib import aclosing
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any, List
 
@@ -29,22 +30,25 @@ import google.generativeai as genai
 from google.generativeai.types import FunctionDeclaration, Tool
 
 from services.embedding_service import embedding_service  # Reuse OpenAI embeddings
-from services.gcs_services import gcs_services
+from services.gcs_services import gcs_services, GEMINI_CHAT_MODEL
 from DB.postgresDB import (
-    postgres_connection,
     run_query,
-    run_write_query,
     search_vectors,
     get_db_connection,
-    get_pre_chat_form,
     get_customer_by_email,
     move_customer_to_pipeline,
     save_customer,
-    get_conversation_metadata,
     update_conversation_email,
     create_notification
 )
+from DB.chatbot_context import load_chatbot_context_async
+from DB.transcript_buffer import save_messages_nowait
+from controller.conversation_summary import maybe_compact, summary_instruction
+from DB.config_cache import get_chatbot_config
 from resources.industry_prompts import INDUSTRY_PROMPTS
+from utils import metrics
+from utils.prompt_budget import KNOWLEDGE_PLACEHOLDER, assemble_prompt
+from utils.sse import DISCONNECTED, record_abandoned
 
 # MODULE LOAD CONFIRMATION
 logging.info("=" * 80)
@@ -73,26 +77,11 @@ class GCSStandardRAGController:
     @staticmethod
     def get_organization_type(chatbot_id: str) -> str:
         """
-        Fetches the organization type for a given chatbot.
+        Fetches the organization type for a given chatbot (cached, see DB/config_cache.py).
         SAME AS standard_rag_controller.py
         """
-        try:
-            with get_db_connection() as conn:
-                query = """
-                    SELECT o.organization_type 
-                    FROM organizations o
-                    JOIN chatbots c ON o.id = c.organization_id
-                    WHERE c.chatbot_id = %s
-                """
-                with conn.cursor() as cur:
-                    cur.execute(query, (chatbot_id,))
-                    result = cur.fetchone()
-                    if result:
-                        return result[0] or "Default"
-            return "Default"
-        except Exception as e:
-            logging.error(f"Error fetching organization type: {e}")
-            return "Default"
+        config = get_chatbot_config(chatbot_id)
+        return config.organization_type if config else "Default"
     
     @staticmethod
     def _validate_email_arg(email_arg: str):
@@ -199,7 +188,8 @@ class GCSStandardRAGController:
         chatbot_id: str,
         user_id: str,
         user_email: str,
-        conversation_id: str
+        conversation_id: str,
+        context=None
     ) -> Dict:
         """
         Handle Gemini function calls.
@@ -223,11 +213,13 @@ class GCSStandardRAGController:
                 
                 email_to_save = email_arg
                 
-                # Get chatbot organization_id
-                conn = postgres_connection()
-                org_query = "SELECT organization_id FROM chatbots WHERE chatbot_id = %s"
-                org_result = run_query(conn, org_query, (chatbot_id,))
-                conn.close()
+                # Get chatbot organization_id (from the request context when available)
+                if context is not None:
+                    org_result = [(context.organization_id,)] if context.organization_id else []
+                else:
+                    org_query = "SELECT organization_id FROM chatbots WHERE chatbot_id = %s"
+                    with get_db_connection() as conn:
+                        org_result = run_query(conn, org_query, (chatbot_id,))
                 
                 if org_result and org_result[0]:
                     custom_data = {
@@ -237,7 +229,7 @@ class GCSStandardRAGController:
                         "chatbot_id": chatbot_id
                     }
                     
-                    success = save_customer(chatbot_id, email_to_save, custom_data)
+                    success = save_customer(chatbot_id, email_to_save, custom_data, context=context)
                     
                     if success:
                         if conversation_id and email_to_save:
@@ -275,7 +267,7 @@ class GCSStandardRAGController:
                             "source": "chatbot",
                             "chatbot_id": chatbot_id
                         }
-                        save_customer(chatbot_id, email_arg, c_data)
+                        save_customer(chatbot_id, email_arg, c_data, context=context)
                     
                     # 2. Handle Urgency
                     if urgency_arg == 'immediate':
@@ -292,8 +284,7 @@ class GCSStandardRAGController:
                         tool_result = {"status": "success", "message": "Immediate callback requested. Team notified!"}
                     else:
                         # 3. Move to Pipeline (Schedule/Later)
-                        with get_db_connection() as conn:
-                            success = move_customer_to_pipeline(chatbot_id, email_arg, conn)
+                        success = move_customer_to_pipeline(chatbot_id, email_arg, context=context)
                         
                         if success:
                             create_notification(
@@ -340,46 +331,45 @@ class GCSStandardRAGController:
         logging.info(f"🔥 [GCS START] chat_stream called - chatbot={chatbot_id}, user={user_id}, email={user_email}")
         controller = GCSStandardRAGController()
         
-        # Validation: Check if chatbot exists
+        start_time = time.time()
+        
+        # Validation + per-request context (chatbot, org type, form, conversation, customer) in one query,
+        # loaded while the prompt is embedded (Uses OpenAI embeddings - SHARED)
+        t0 = time.time()
+        context_task = asyncio.create_task(load_chatbot_context_async(chatbot_id, conversation_id, user_email))
+        query_vector = await embedding_service.embed_query_async(prompt)
+        t1 = time.time()
+        print(f"DEBUG [GCS]: Embedding Time: {t1 - t0:.4f}s")
+        
         try:
-            with get_db_connection() as conn:
-                check_query = "SELECT 1 FROM chatbots WHERE chatbot_id = %s"
-                res = run_query(conn, check_query, (chatbot_id,))
-                if not res:
-                    yield f"data: {json.dumps({'error': 'Invalid Chatbot ID'})}\n\n"
-                    return
+            ctx = await context_task
         except Exception as e:
             logging.error(f"Error validating chatbot_id: {e}")
             yield f"data: {json.dumps({'error': 'Database connection error during validation'})}\n\n"
             return
-        
-        start_time = time.time()
-        
-        # 1. Embed Prompt & Retrieve Context (Uses OpenAI embeddings - SHARED)
-        t0 = time.time()
-        query_vector = embedding_service.embed_text(prompt)
+        if not ctx:
+            yield f"data: {json.dumps({'error': 'Invalid Chatbot ID'})}\n\n"
+            return
+        metrics.observe("chat_stream.context_load", time.time() - t0)
         t1 = time.time()
-        print(f"DEBUG [GCS]: Embedding Time: {t1 - t0:.4f}s")
         
-        context_results = await asyncio.to_thread(search_vectors, chatbot_id, query_vector, limit=1)
+        context_results = await asyncio.to_thread(search_vectors, chatbot_id, query_vector, limit=1, query_text=prompt)
         t2 = time.time()
         print(f"DEBUG [GCS]: Vector Search Time: {t2 - t1:.4f}s")
         
-        if context_results:
-            context_text = "\n\n".join([f"[CHUNK]: {r['content']}" for r in context_results])
-        else:
-            context_text = "No knowledge base available."
+        # Retrieved chunks, best first (the prompt assembler formats and budgets them)
+        context_chunks = [r['content'] for r in context_results] if context_results else []
         
-        print(f"RAG Context [GCS] (Vector Search): {context_text[:100]}...")
+        print(f"RAG Context [GCS] (Vector Search): {context_chunks[0][:100] if context_chunks else 'none'}...")
         
         # 2. Construct System Instruction (Base) - SAME AS OpenAI
-        org_type = controller.get_organization_type(chatbot_id)
+        org_type = ctx.organization_type
         industry_instruction = INDUSTRY_PROMPTS.get(org_type, INDUSTRY_PROMPTS.get("Default", ""))
         
         system_instruction = (
             f"Persona/Industry Context: {industry_instruction}\n\n"
             "Source Knowledge (Vector DB Context):\n"
-            f"{context_text}\n\n"
+            f"{KNOWLEDGE_PLACEHOLDER}\n\n"
             "Instruction: Answer the user's question using the Source Knowledge provided above.\n"
             "IMPORTANT EXCEPTION: If the user asks about PRICING, COST, BUYING, or SUPPORT, do NOT answer from the context. Instead, start Lead Capture immediately.\n"
             "STYLE: Be helpful but concise. Keep answers to 2-4 sentences.\n"
@@ -387,7 +377,7 @@ class GCSStandardRAGController:
         )
         
         # 2.5. Check for Pre-Chat Form (Function Calling)
-        form_config = get_pre_chat_form(chatbot_id)
+        form_config = ctx.pre_chat_form
         logging.info(f"📋 [FORM_CONFIG] Retrieved: {len(form_config) if form_config else 0} fields")
         
         logging.info("🔧 [CALLING] _build_tools...")
@@ -420,138 +410,170 @@ class GCSStandardRAGController:
         form_system_instruction = ""
         
         try:
-            with get_db_connection() as conn:
-                # 3a. Resolve User Identity if missing
-                if conversation_id and not user_email:
-                    meta = get_conversation_metadata(conversation_id, conn)
-                    if meta and meta.get("user_email"):
-                        user_email = meta.get("user_email")
-                        print(f"✅ [GCS] Resolved User Email from Conversation: {user_email}")
-                
-                if not conversation_id or conversation_id == "NEW_CHAT":
-                    conversation_id = str(uuid.uuid4())
-                    is_new_thread = True
-                    yield f"data: {json.dumps({'event': 'thread_created', 'thread_id': conversation_id})}\n\n"
-                else:
-                    # Fetch History
-                    try:
-                        hist_query = "SELECT history FROM bot_conversations WHERE conversation_id = %s"
-                        rows = run_query(conn, hist_query, (conversation_id,))
-                        if rows and rows[0][0]:
-                            raw_history = rows[0][0]
+            # 3a. Resolve User Identity if missing
+            if conversation_id and not user_email:
+                if ctx.conversation_email:
+                    user_email = ctx.conversation_email
+                    print(f"✅ [GCS] Resolved User Email from Conversation: {user_email}")
+            
+            if not conversation_id or conversation_id == "NEW_CHAT":
+                conversation_id = str(uuid.uuid4())
+                is_new_thread = True
+                yield f"data: {json.dumps({'event': 'thread_created', 'thread_id': conversation_id})}\n\n"
+            else:
+                # History (loaded with the chatbot context)
+                try:
+                    if ctx.history:
+                        raw_history = ctx.history
+                        
+                        if isinstance(raw_history, list):
+                            recent_history = raw_history[-100:] if len(raw_history) > 100 else raw_history
                             
-                            if isinstance(raw_history, str):
-                                try:
-                                    raw_history = json.loads(raw_history)
-                                except:
-                                    raw_history = []
+                            for msg in recent_history:
+                                if isinstance(msg, dict):
+                                    role = "assistant" if msg.get("role") == "bot" else "user"
+                                    content = msg.get("text", "")
+                                    if content:
+                                        history_messages.append({"role": role, "content": content})
                             
-                            if isinstance(raw_history, list):
-                                recent_history = raw_history[-100:] if len(raw_history) > 100 else raw_history
-                                
-                                for msg in recent_history:
-                                    if isinstance(msg, dict):
-                                        role = "assistant" if msg.get("role") == "bot" else "user"
-                                        content = msg.get("text", "")
-                                        if content:
-                                            history_messages.append({"role": role, "content": content})
-                                
-                                logging.info(f"[GCS] Loaded {len(history_messages)} history messages for {conversation_id}")
-                    except Exception as e:
-                        logging.error(f"[GCS] Error fetching history: {e}")
-                
-                # 4. Detect Returning User and Build Form Instruction
-                # 4a. Returning User Check (Has Email)  
-                if user_email and user_email != "" and "guest" not in user_email.lower():
-                    # Fetch customer data
-                    customer_context_str = ""
-                    try:
-                        cust = get_customer_by_email(chatbot_id, user_email, conn)
-                        if cust:
-                            customer_data = cust
-                            c_name = cust.get("name")
-                            c_phone = cust.get("phone")
+                            logging.info(f"[GCS] Loaded {len(history_messages)} history messages for {conversation_id}")
+                except Exception as e:
+                    logging.error(f"[GCS] Error fetching history: {e}")
+            
+            # 4. Detect Returning User and Build Form Instruction
+            # 4a. Returning User Check (Has Email)  
+            if user_email and user_email != "" and "guest" not in user_email.lower():
+                # Fetch customer data
+                customer_context_str = ""
+                try:
+                    cust = get_customer_by_email(chatbot_id, user_email, context=ctx)
+                    if cust:
+                        customer_data = cust
+                        c_name = cust.get("name")
+                        c_phone = cust.get("phone")
+                        
+                        # Check if we have ALL details - then returning user
+                        if c_name and c_phone:
+                            is_returning_user = True
+                            customer_context_str += f"Name: {c_name}\n"
+                            customer_context_str += f"IMPORTANT: Address the user by their name ({c_name}) occasionally to be friendly.\n"
+                            customer_context_str += f"Phone: {c_phone}\n"
                             
-                            # Check if we have ALL details - then returning user
-                            if c_name and c_phone:
-                                is_returning_user = True
+                            form_system_instruction = (
+                                f"\n\n[USER CONTEXT]\n"
+                                f"You are speaking with a RETURNING USER: {user_email}\n"
+                                f"{customer_context_str}"
+                                f"You have their details, so do NOT ask for Name/Email/Phone.\n"
+                            )
+                            # Remove submit_pre_chat_form for returning users
+                            if tools:
+                                tools = [t for t in tools if t['function']['name'] != 'submit_pre_chat_form']
+                        else:
+                            # Has email but missing name or phone
+                            if c_name:
                                 customer_context_str += f"Name: {c_name}\n"
-                                customer_context_str += f"IMPORTANT: Address the user by their name ({c_name}) occasionally to be friendly.\n"
+                            if c_phone:
                                 customer_context_str += f"Phone: {c_phone}\n"
                                 
-                                form_system_instruction = (
-                                    f"\n\n[USER CONTEXT]\n"
-                                    f"You are speaking with a RETURNING USER: {user_email}\n"
-                                    f"{customer_context_str}"
-                                    f"You have their details, so do NOT ask for Name/Email/Phone.\n"
-                                )
-                                # Remove submit_pre_chat_form for returning users
-                                if tools:
-                                    tools = [t for t in tools if t['function']['name'] != 'submit_pre_chat_form']
-                            else:
-                                # Has email but missing name or phone
-                                if c_name:
-                                    customer_context_str += f"Name: {c_name}\n"
-                                if c_phone:
-                                    customer_context_str += f"Phone: {c_phone}\n"
-                                    
-                                form_system_instruction = (
-                                    f"\n\n[USER CONTEXT]\n"
-                                    f"You are speaking with a user whose email is: {user_email}.\n"
-                                    f"{customer_context_str}"
-                                    f"Since you already have their email, do NOT ask for it again.\n"
-                                    f"However, if you do not have their Name or Phone in the context above, please ask for those politely after 3 turns.\n"
-                                )
-                    except Exception as e:
-                        logging.error(f"Error fetching customer context: {e}")
-                else:
-                    # No email - new user - EXACT STANDARD RAG LOGIC
-                    form_system_instruction = (
-                        f"\n\n[PROGRESSIVE FORM COLLECTION]\n"
-                        f"First, engage naturally with the user. Answer their questions helpfully for 3 conversation turns.\n"
-                        f"After 3 turns, you must collect: Name, Email, and Phone Number.\n"
-                        f"CRITICAL: Ask for these details ONE BY ONE. Do NOT ask for all three at once.\n"
-                        f"1. Ask for the Name. Wait for answer.\n"
-                        f"2. Ask for the Email. Wait for answer.\n"
-                        f"3. Ask for the Phone Number. Wait for answer.\n"
-                        f"Once you have all three values (name, email, phone), call the 'submit_pre_chat_form' function immediately.\n"
-                        f"After calling the function, do NOT tell the user 'I have saved your details'. Just say 'Thanks!' or 'Got it!' and continue.\n"
-                    )
-                
-                # Add support handoff instruction - EXACT STANDARD RAG VERSION
-                form_system_instruction += (
-                    f"\n[SUPPORT HANDOFF (CRITICAL)]\n"
-                    f"You must proactively capture the user's details (Name, Email, Phone) and move them to the pipeline if they show HIGH INTEREST.\n"
-                    f"Triggers for HIGH INTEREST include:\n"
-                    f"1. Asking about PRICING or cost.\n"
-                    f"2. Asking for comparisons with COMPETITORS (e.g., Freshworks, Intercom).\n"
-                    f"3. Asking deep/detailed questions about COMPANY FEATURES or technical specs.\n"
-                    f"4. Explicitly asking to speak to a human or support.\n"
-                    f"ACTION IF TRIGGERED:\n"
-                    f"1. Check if you have Name, Email, Phone. If missing, ASK for them politely one by one.\n"
-                    f"2. Once you have the details, call 'handoff_to_support' with urgency='later' to save them to the pipeline first.\n"
-                    f"3. AFTER saving, ASK the user: 'I have added you to our priority queue. would you like to connect with a support agent immediately?'\n"
-                    f"4. IF USER SAYS YES: Call 'handoff_to_support' AGAIN with urgency='immediate'.\n"
-                    f"5. IF USER SAYS NO: Say 'Great! Our team will reach out to you shortly.'\n"
+                            form_system_instruction = (
+                                f"\n\n[USER CONTEXT]\n"
+                                f"You are speaking with a user whose email is: {user_email}.\n"
+                                f"{customer_context_str}"
+                                f"Since you already have their email, do NOT ask for it again.\n"
+                                f"However, if you do not have their Name or Phone in the context above, please ask for those politely after 3 turns.\n"
+                            )
+                except Exception as e:
+                    logging.error(f"Error fetching customer context: {e}")
+            else:
+                # No email - new user - EXACT STANDARD RAG LOGIC
+                form_system_instruction = (
+                    f"\n\n[PROGRESSIVE FORM COLLECTION]\n"
+                    f"First, engage naturally with the user. Answer their questions helpfully for 3 conversation turns.\n"
+                    f"After 3 turns, you must collect: Name, Email, and Phone Number.\n"
+                    f"CRITICAL: Ask for these details ONE BY ONE. Do NOT ask for all three at once.\n"
+                    f"1. Ask for the Name. Wait for answer.\n"
+                    f"2. Ask for the Email. Wait for answer.\n"
+                    f"3. Ask for the Phone Number. Wait for answer.\n"
+                    f"Once you have all three values (name, email, phone), call the 'submit_pre_chat_form' function immediately.\n"
+                    f"After calling the function, do NOT tell the user 'I have saved your details'. Just say 'Thanks!' or 'Got it!' and continue.\n"
                 )
-                    
+            
+            # Add support handoff instruction - EXACT STANDARD RAG VERSION
+            form_system_instruction += (
+                f"\n[SUPPORT HANDOFF (CRITICAL)]\n"
+                f"You must proactively capture the user's details (Name, Email, Phone) and move them to the pipeline if they show HIGH INTEREST.\n"
+                f"Triggers for HIGH INTEREST include:\n"
+                f"1. Asking about PRICING or cost.\n"
+                f"2. Asking for comparisons with COMPETITORS (e.g., Freshworks, Intercom).\n"
+                f"3. Asking deep/detailed questions about COMPANY FEATURES or technical specs.\n"
+                f"4. Explicitly asking to speak to a human or support.\n"
+                f"ACTION IF TRIGGERED:\n"
+                f"1. Check if you have Name, Email, Phone. If missing, ASK for them politely one by one.\n"
+                f"2. Once you have the details, call 'handoff_to_support' with urgency='later' to save them to the pipeline first.\n"
+                f"3. AFTER saving, ASK the user: 'I have added you to our priority queue. would you like to connect with a support agent immediately?'\n"
+                f"4. IF USER SAYS YES: Call 'handoff_to_support' AGAIN with urgency='immediate'.\n"
+                f"5. IF USER SAYS NO: Say 'Great! Our team will reach out to you shortly.'\n"
+            )
+                
         except Exception as e:
             logging.error(f"[GCS] Error in chat setup: {e}")
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
             return
         
+        # 6. Save to DB (History), after the reply or when the client disconnects
+        def save_turn(response_text: str, title: str = None, interrupted: bool = False):
+            try:
+                current_time = datetime.now(timezone.utc)
+                new_msgs = [
+                    {"role": "user", "text": prompt, "timestamp": current_time.isoformat()},
+                    {"role": "bot", "text": response_text, "timestamp": current_time.isoformat()}
+                ]
+                if interrupted:
+                    # Partial answer of a stream the client disconnected from
+                    new_msgs[1]["interrupted"] = True
+
+                create = None
+                if is_new_thread:
+                    # The conversation row is inserted (if missing) by the write-behind buffer
+                    # together with the first messages, so nothing here touches the database
+                    safe_user_id = user_id or "guest"
+                    create = {
+                        "user_id": safe_user_id,
+                        "user_email": user_email or (safe_user_id if '@' in safe_user_id else 'guest@example.com'),
+                        "user_plan": user_plan or "free",
+                        "chatbot_id": chatbot_id,
+                        "title": title or (prompt[:50] + "..." if len(prompt) > 50 else prompt),
+                        "created_at": current_time,
+                    }
+                save_messages_nowait(conversation_id, new_msgs, current_time, create)
+                if not is_new_thread:
+                    # Fold older turns into the summary once the verbatim history is over budget
+                    maybe_compact(conversation_id, ctx.history + new_msgs)
+
+            except Exception as e:
+                logging.error(f"[GCS] Error saving history: {e}")
+
         # 5. Call Gemini (Chat Completion)
         full_response = ""
+        reply_done = False
         function_call_detected = None
         
         try:
-            # Construct full system prompt
-            full_system_prompt = f"{system_instruction}{form_system_instruction}"
+            # Construct full system prompt and history within the model's token budget
+            # (persona > retrieved chunks > form state > summary and recent history)
+            assembled = assemble_prompt(
+                GEMINI_CHAT_MODEL, system_instruction, prompt,
+                chunks=context_chunks,
+                form_state=[form_system_instruction],
+                history=history_messages,
+                summary=summary_instruction(ctx.summary),
+                tools=tools,
+            )
+            metrics.observe("chat_stream.prompt_tokens", assembled.tokens)
+            full_system_prompt = assembled.system_prompt
             
             # Build messages for Gemini
-            messages = []
-            for msg in history_messages:
-                messages.append(msg)
+            messages = list(assembled.history)
             messages.append({"role": "user", "content": prompt})
             
             t_llm_start = time.time()
@@ -563,26 +585,30 @@ class GCSStandardRAGController:
             else:
                 logging.warning("[GCS CRITICAL] NO TOOLS! Tools list is None or empty!")
             
-            # Stream response from Gemini
+            # Stream response from Gemini; aclosing ends the Gemini request as soon as
+            # this generator is closed (client disconnect), not when it is garbage collected
             response = gcs_services.chat_stream(
                 messages=messages,
                 system_instruction=full_system_prompt,
                 tools=tools
             )
             
-            async for chunk in response:
-                # Handle function calls and text content
-                if hasattr(chunk, 'candidates') and chunk.candidates:
-                    candidate = chunk.candidates[0]
-                    if hasattr(candidate, 'content') and candidate.content and candidate.content.parts:
-                        for part in candidate.content.parts:
-                            # Check for function call
-                            if hasattr(part, 'function_call') and part.function_call:
-                                function_call_detected = part.function_call
-                            # Check for text
-                            elif hasattr(part, 'text') and part.text:
-                                full_response += part.text
-                                yield f"data: {json.dumps({'token': part.text})}\n\n"
+            async with aclosing(response):
+                async for chunk in response:
+                    # Handle function calls and text content
+                    if hasattr(chunk, 'candidates') and chunk.candidates:
+                        candidate = chunk.candidates[0]
+                        if hasattr(candidate, 'content') and candidate.content and candidate.content.parts:
+                            for part in candidate.content.parts:
+                                # Check for function call
+                                if hasattr(part, 'function_call') and part.function_call:
+                                    function_call_detected = part.function_call
+                                # Check for text
+                                elif hasattr(part, 'text') and part.text:
+                                    if not full_response:
+                                        metrics.observe("chat_stream.ttft", time.time() - start_time)
+                                    full_response += part.text
+                                    yield f"data: {json.dumps({'token': part.text})}\n\n"
             
             t_llm_end = time.time()
             print(f"DEBUG [GCS]: LLM Generation Time: {t_llm_end - t_llm_start:.4f}s")
@@ -597,7 +623,7 @@ class GCSStandardRAGController:
                 
                 # Execute the tool
                 tool_result = await controller._handle_function_call(
-                    func_name, func_args, chatbot_id, user_id, user_email, conversation_id
+                    func_name, func_args, chatbot_id, user_id, user_email, conversation_id, ctx
                 )
                 
                 print(f"DEBUG [GCS]: Tool Result: {tool_result}")
@@ -619,17 +645,26 @@ class GCSStandardRAGController:
                     tools=None
                 )
                 
-                async for chunk in continuation:
-                    if hasattr(chunk, 'candidates') and chunk.candidates:
-                        candidate = chunk.candidates[0]
-                        if hasattr(candidate, 'content') and candidate.content and candidate.content.parts:
-                            for part in candidate.content.parts:
-                                if hasattr(part, 'text') and part.text:
-                                    full_response += part.text
-                                    yield f"data: {json.dumps({'token': part.text})}\n\n"
+                async with aclosing(continuation):
+                    async for chunk in continuation:
+                        if hasattr(chunk, 'candidates') and chunk.candidates:
+                            candidate = chunk.candidates[0]
+                            if hasattr(candidate, 'content') and candidate.content and candidate.content.parts:
+                                for part in candidate.content.parts:
+                                    if hasattr(part, 'text') and part.text:
+                                        full_response += part.text
+                                        yield f"data: {json.dumps({'token': part.text})}\n\n"
             
+            reply_done = True
             yield f"data: {json.dumps({'event': 'end'})}\n\n"
             
+        except DISCONNECTED:
+            # Client went away: the Gemini streams are closed by aclosing; keep what was generated so far
+            # (widgets may also close the connection right after the end event)
+            if not reply_done:
+                record_abandoned("gcs_chat_stream", full_response)
+            save_turn(full_response, interrupted=not reply_done)
+            raise
         except Exception as e:
             logging.error(f"[GCS] Gemini Error: {e}")
             import traceback
@@ -639,40 +674,12 @@ class GCSStandardRAGController:
         
         # 6. Save to DB (History) - SAME AS OpenAI
         try:
-            current_time = datetime.now(timezone.utc)
-            new_msgs = [
-                {"role": "user", "text": prompt, "timestamp": current_time.isoformat()},
-                {"role": "bot", "text": full_response, "timestamp": current_time.isoformat()}
-            ]
-            
-            with get_db_connection() as conn:
-                if is_new_thread:
-                    # Generate title with Gemini
-                    title = await gcs_services.generate_title(prompt)
-                    
-                    insert_query = """
-                        INSERT INTO bot_conversations (user_id, user_email, user_plan, chatbot_id, conversation_id, title, history, created_at, updated_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s)
-                    """
-                    safe_user_id = user_id or "guest"
-                    safe_email = user_email or (safe_user_id if '@' in safe_user_id else 'guest@example.com')
-                    safe_plan = user_plan or "free"
-                    
-                    run_write_query(conn, insert_query, (
-                        safe_user_id, safe_email, safe_plan, chatbot_id,
-                        conversation_id, title, json.dumps(new_msgs), current_time, current_time
-                    ))
-                else:
-                    update_query = """
-                        UPDATE bot_conversations 
-                        SET history = COALESCE(history, '[]'::jsonb) || %s::jsonb, updated_at = %s
-                        WHERE conversation_id = %s
-                    """
-                    run_write_query(conn, update_query, (json.dumps(new_msgs), current_time, conversation_id))
-                    
-        except Exception as e:
-            logging.error(f"[GCS] Error saving history: {e}")
-
+            # Generate title with Gemini
+            title = await gcs_services.generate_title(prompt) if is_new_thread else None
+        except DISCONNECTED:
+            save_turn(full_response)
+            raise
+        save_turn(full_response, title)
 
 # Singleton instance
 gcs_standard_rag_controller = GCSStandardRAGController()
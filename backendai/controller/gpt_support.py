@@ -7,8 +7,11 @@ import logging
 from dotenv import load_dotenv
 # from openai import OpenAI
 import redis
-from services.openai_services import client
+from services.openai_services import client, async_client
 from DB.postgresDB import postgres_connection, run_query, run_write_query, get_db_connection
+from DB.conversation_store import get_recent_messages
+from DB.transcript_buffer import save_messages_nowait, with_pending
+from utils.sse import DISCONNECTED, record_abandoned
 
 
 
@@ -178,63 +181,76 @@ async def chat_support(
             return
 
         # Send the message to OpenAI Thread
-        client.beta.threads.messages.create(
+        await async_client.beta.threads.messages.create(
             thread_id=conversation_id,
             role="user",
             content=f"{user_input}\n\nRespond clearly and concisely.",
         )
 
         assistant_response = ""
+        run_id = None
+        reply_done = False
 
-        # OpenAI stream (real-time token stream)
-        def openai_stream():
-            with client.beta.threads.runs.stream(
-                thread_id=conversation_id,
-                assistant_id=assistant_id,
-            ) as stream:
-                for event in stream:
-                    yield event
-
-        # Process the streaming events
-        for event in openai_stream():
-            event_class = event.__class__.__name__
-            if event_class == "ThreadMessageDelta":
-                delta_data = getattr(event, "data", None)
-                if delta_data and hasattr(delta_data, "delta") and hasattr(delta_data.delta, "content"):
-                    for content_piece in delta_data.delta.content:
-                        if getattr(content_piece, "type", None) == "text":
-                            token_piece = getattr(content_piece.text, "value", "")
-                            assistant_response += token_piece
-                            yield f"data: {json.dumps({'token': token_piece})}\n\n"
-                            await asyncio.sleep(0)
-            elif event_class == "ThreadMessageCompleted":
-                break
-            elif event_class == "Error":
-                yield f"data: {json.dumps({'error': str(event)})}\n\n"
-                return
-
-        if final_response_holder is not None:
-            final_response_holder["response_text"] = assistant_response
+        # Save chat messages in PostgreSQL
+        def save_turn(interrupted: bool = False):
+            current_time = datetime.now(timezone.utc)
 
-        yield f"data: {json.dumps({'event': 'end'})}\n\n"
+            # Append history messages (JSONB)
+            messages = [
+                {"role": "user", "text": user_input, "timestamp": current_time.isoformat()},
+                {"role": "bot", "text": assistant_response, "timestamp": current_time.isoformat()},
+            ]
+            if interrupted:
+                # Partial answer of a stream the client disconnected from
+                messages[1]["interrupted"] = True
 
-        # Save chat messages in PostgreSQL
-        current_time = datetime.now(timezone.utc)
+            save_messages_nowait(conversation_id, messages, current_time)
 
-        # Append history messages (JSONB)
-        messages = [
-            {"role": "user", "text": user_input, "timestamp": current_time.isoformat()},
-            {"role": "bot", "text": assistant_response, "timestamp": current_time.isoformat()},
-        ]
+        try:
+            # OpenAI stream (real-time token stream), read without blocking the event loop
+            async with async_client.beta.threads.runs.stream(
+                thread_id=conversation_id,
+                assistant_id=assistant_id,
+            ) as stream:
+                # Process the streaming events
+                async for event in stream:
+                    event_class = event.__class__.__name__
+                    if event_class == "ThreadRunCreated":
+                        run_id = event.data.id
+                    elif event_class == "ThreadMessageDelta":
+                        delta_data = getattr(event, "data", None)
+                        if delta_data and hasattr(delta_data, "delta") and hasattr(delta_data.delta, "content"):
+                            for content_piece in delta_data.delta.content:
+                                if getattr(content_piece, "type", None) == "text":
+                                    token_piece = getattr(content_piece.text, "value", "")
+                                    assistant_response += token_piece
+                                    yield f"data: {json.dumps({'token': token_piece})}\n\n"
+                    elif event_class == "ThreadMessageCompleted":
+                        break
+                    elif event_class == "Error":
+                        yield f"data: {json.dumps({'error': str(event)})}\n\n"
+                        return
+
+            if final_response_holder is not None:
+                final_response_holder["response_text"] = assistant_response
+
+            reply_done = True
+            yield f"data: {json.dumps({'event': 'end'})}\n\n"
+        except DISCONNECTED:
+            if not reply_done:
+                record_abandoned("chat_support", assistant_response)
+                # Closing the stream does not stop the run: cancel it so OpenAI stops
+                # generating and the thread accepts the next message
+                if run_id:
+                    asyncio.get_running_loop().run_in_executor(None, cancel_run, conversation_id, run_id)
+                if final_response_holder is not None:
+                    final_response_holder["response_text"] = assistant_response
+            save_turn(interrupted=not reply_done)
+            raise
+
+        save_turn()
 
         with get_db_connection() as conn:
-            update_query = """
-                UPDATE bot_conversations
-                SET history = COALESCE(history, '[]'::jsonb) || %s::jsonb,
-                    updated_at = %s
-                WHERE conversation_id = %s;
-            """
-            run_write_query(conn, update_query, (json.dumps(messages), current_time, conversation_id))
 
             # Check if title is still "Untitled Conversation"
             title_query = "SELECT title FROM bot_conversations WHERE conversation_id = %s;"
@@ -280,20 +296,28 @@ async def chat_support(
         yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
 
+def cancel_run(thread_id: str, run_id: str):
+    """Cancels an Assistants run whose client disconnected."""
+    try:
+        client.beta.threads.runs.cancel(run_id=run_id, thread_id=thread_id)
+    except Exception as e:
+        logging.error(f"Error cancelling run {run_id}: {e}")
+
+
 def get_chat_history(user_id, chatbot_id, conversation_id):
     with get_db_connection() as conn:
         query = """
-            SELECT history, post_chat_review
+            SELECT post_chat_review
             FROM bot_conversations
             WHERE user_id = %s AND chatbot_id = %s AND conversation_id = %s;
         """
         result = run_query(conn, query, (user_id, chatbot_id, conversation_id))
+        history = get_recent_messages(conversation_id, None, conn) if result else None
 
     if result:
-        # result[0] = (history_json, post_chat_review_json)
         return {
-            "history": result[0][0],
-            "post_chat_review": result[0][1]
+            "history": with_pending(conversation_id, history),
+            "post_chat_review": result[0][0]
         }
 
     raise ValueError("Conversation not found")
@@ -302,20 +326,26 @@ def get_chat_history(user_id, chatbot_id, conversation_id):
 
 def get_conversation_by_user_id(user_id, chatbot_id):
     with get_db_connection() as conn:
+        # Last message timestamp from the message table, else from a not yet migrated history array
         query = """
-            SELECT conversation_id, title, history, updated_at
-            FROM bot_conversations
-            WHERE user_id = %s AND chatbot_id = %s
-            ORDER BY updated_at DESC;
+            SELECT c.conversation_id, c.title, c.updated_at,
+                   COALESCE(m.data->>'timestamp', CASE WHEN m.seq IS NULL THEN c.history->-1->>'timestamp' END)
+            FROM bot_conversations c
+            LEFT JOIN LATERAL (
+                SELECT seq, data FROM bot_conversation_messages
+                WHERE conversation_id = c.conversation_id
+                ORDER BY seq DESC
+                LIMIT 1
+            ) m ON TRUE
+            WHERE c.user_id = %s AND c.chatbot_id = %s
+            ORDER BY c.updated_at DESC;
         """
         results = run_query(conn, query, (user_id, chatbot_id))
 
     conversation_list = []
     for row in results:
-        conversation_id, title, history, updated_at = row
-        last_chat_time = updated_at
-        if history and isinstance(history, list) and len(history) > 0:
-            last_chat_time = history[-1].get('timestamp', updated_at)
+        conversation_id, title, updated_at, last_timestamp = row
+        last_chat_time = last_timestamp or updated_at
         conversation_list.append({
             'conversation_id': conversation_id,
             'title': title,
@@ -0,0 +1,507 @@
+# Streaming ingestion pipeline for chatbot training data
+#
+#   sources -> fetch/extract -> clean (deterministic, LLM when needed) -> chunk + embed -> insert
+#
+# Each stage runs its own pool of workers and hands items to the next stage
+# through a bounded asyncio.Queue, so a slow stage applies backpressure
+# upstream instead of letting documents pile up in memory. Documents are
+# written to training_chunks as soon as they are embedded; only a handful
+# are in flight at any time regardless of sitemap size.
+#
+# Retraining is incremental: pages are re-downloaded with their stored
+# ETag / Last-Modified and skipped on 304 or an unchanged body hash, and
+# chunks whose content hash already exists for the chatbot reuse the stored
+# embedding instead of calling the embeddings API.
+#
+# Progress is checkpointed per page: every page written (or found unchanged)
+# by a training job records the job id in training_pages.checkpoint, and a
+# source is marked trained (on_source_done) as soon as its last page is done.
+# A retried job passes the same checkpoint, so it skips the sources and pages
+# the failed attempt already finished and only redoes the remainder.
+# A page that fails (fetch, embedding or write error) is not checkpointed and
+# keeps its source untrained; run() raises at the end so the job is retried.
+# A page that is gone (404 / 410) or has no text left is removed from the
+# index instead, so it is not answered from its old chunks.
+#
+# The chatbot's training generation (DB/training_generation.py), which keys
+# the retrieval caches and in-process vector indexes, is bumped once per
+# source after its pages are written and once at the end of the run, not per
+# page, so chat traffic during a long training keeps its caches.
+#
+# Time and LLM cleanup cost are logged per document (ingestion.document,
+# ingestion.llm_cost_usd metrics) and totalled in the run's result.
+
+import os
+import asyncio
+import hashlib
+import logging
+import time
+
+import requests
+
+from DB.postgresDB import (
+    get_page_states, save_page_state, checkpoint_page, get_embeddings_by_hash, replace_page_chunks, delete_stale_pages,
+    delete_page,
+)
+from DB.training_generation import bump_generation
+from services.embedding_service import embedding_service
+from services.document_extraction import DOCUMENT_TYPES, PAGE_BREAK, extract_document_text
+from controller.chatbot_config import get_sitemap_urls, conditional_get, extract_response_text, clean_training_content
+from utils import metrics
+
+FETCH_CONCURRENCY = int(os.getenv("INGEST_FETCH_CONCURRENCY", "8"))
+CLEAN_CONCURRENCY = int(os.getenv("INGEST_CLEAN_CONCURRENCY", "4"))
+EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "2"))
+QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "16"))
+
+# Legacy binary .doc / .ppt are not supported (see services/document_extraction.py)
+SUPPORTED_FILE_TYPES = ['.pdf', '.docx', '.txt', '.pptx', '.jpeg', '.jpg', '.png']
+
+_DONE = object()
+
+
+def content_hash(data) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class IngestionPipeline:
+    """
+    Trains one chatbot from its automations rows.
+
+    chunker: callable(text) -> iterable of {'content': str, 'heading_path': list[str]}
+    on_progress: optional async callable(done, total) awaited as documents finish.
+    checkpoint: id of the training job, stable across its retries; pages it already finished are skipped.
+    on_source_done: optional async callable(items) awaited with {'urls' | 'files' | 'articles': [key]}
+                    once every page of a source is done.
+    """
+
+    def __init__(self, chatbot_id: str, chunker, on_progress=None, checkpoint: str = None, on_source_done=None):
+        self.chatbot_id = chatbot_id
+        self.chunker = chunker
+        self.on_progress = on_progress
+        self.checkpoint = checkpoint
+        self.on_source_done = on_source_done
+
+        self.processed_items = {'urls': [], 'files': [], 'articles': []}
+        self.total_documents = 0
+        self.done_documents = 0
+        self.written_documents = 0
+        self.unchanged_documents = 0
+        self.resumed_documents = 0
+        self.failed_documents = 0
+        self.written_chunks = 0
+        self.reused_embeddings = 0
+        self.llm_documents = 0
+        self.llm_segments = 0
+        self.llm_cost_usd = 0.0
+        self.document_seconds = 0.0
+        self._sitemap_pages = {}  # source -> page urls seen this run
+        self._pending_pages = {}  # (processed_items key, source key) -> pages still in flight
+        self._failed_sources = set()  # item keys with at least one failed page
+        self._written_sources = set()  # item keys with pages written since the last generation bump
+        self._source_lock = asyncio.Lock()
+
+    async def run(self, training_rows) -> dict:
+        """
+        training_rows: [(training_url, training_pdf, training_article)] from automations.
+        Returns: {'documents': int, 'unchanged': int, 'resumed': int, 'chunks': int, 'reused_embeddings': int,
+                  'llm_documents': int, 'llm_segments': int, 'llm_cost_usd': float, 'seconds_per_document': float,
+                  'processed_items': dict}
+        Raises RuntimeError after the run when any page failed; the pages that
+        succeeded are written and checkpointed, their sources marked trained.
+        """
+        start = time.perf_counter()
+        fetch_q = asyncio.Queue(QUEUE_SIZE)
+        clean_q = asyncio.Queue(QUEUE_SIZE)
+        embed_q = asyncio.Queue(QUEUE_SIZE)
+        write_q = asyncio.Queue(QUEUE_SIZE)
+
+        stages = [
+            self._stage(self._fetch, fetch_q, clean_q, FETCH_CONCURRENCY, CLEAN_CONCURRENCY),
+            self._stage(self._clean, clean_q, embed_q, CLEAN_CONCURRENCY, EMBED_CONCURRENCY),
+            self._stage(self._chunk_and_embed, embed_q, write_q, EMBED_CONCURRENCY, 1),
+        ]
+        tasks = [asyncio.create_task(self._produce(training_rows, fetch_q)), asyncio.create_task(self._write(write_q))]
+        tasks += [asyncio.create_task(stage) for stage in stages]
+
+        try:
+            await asyncio.gather(*tasks)
+            # Pages that disappeared from a sitemap since the last run
+            for source, pages in self._sitemap_pages.items():
+                await asyncio.to_thread(delete_stale_pages, self.chatbot_id, source, pages)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            if self._written_sources or self._sitemap_pages:
+                self._written_sources.clear()
+                await asyncio.to_thread(bump_generation, self.chatbot_id)
+
+        # Sources with failed pages stay untrained (also for the callers' final mark_items_as_trained)
+        for bucket, key in self._failed_sources:
+            if key in self.processed_items[bucket]:
+                self.processed_items[bucket].remove(key)
+
+        metrics.observe("ingestion.run", time.perf_counter() - start)
+        logging.info(
+            f"Ingestion for {self.chatbot_id}: {self.written_documents}/{self.total_documents} documents written, "
+            f"{self.unchanged_documents} unchanged, {self.resumed_documents} resumed, {self.failed_documents} failed, "
+            f"{self.written_chunks} chunks "
+            f"({self.reused_embeddings} reused embeddings) in {time.perf_counter() - start:.1f}s; "
+            f"LLM cleanup for {self.llm_documents} documents ({self.llm_segments} calls, ${self.llm_cost_usd:.4f})"
+        )
+        if self.failed_documents:
+            raise RuntimeError(
+                f"{self.failed_documents} of {self.total_documents} documents failed to ingest "
+                f"({len(self._failed_sources)} sources left untrained)"
+            )
+        processed = max(self.done_documents - self.resumed_documents, 1)
+        return {
+            'documents': self.written_documents,
+            'unchanged': self.unchanged_documents,
+            'resumed': self.resumed_documents,
+            'chunks': self.written_chunks,
+            'reused_embeddings': self.reused_embeddings,
+            'llm_documents': self.llm_documents,
+            'llm_segments': self.llm_segments,
+            'llm_cost_usd': round(self.llm_cost_usd, 6),
+            'seconds_per_document': round(self.document_seconds / processed, 3),
+            'processed_items': self.processed_items,
+        }
+
+    # ---- stages -------------------------------------------------------
+
+    async def _produce(self, training_rows, out_q):
+        """Expands automations rows into one work item per page/file/article."""
+        base_url = os.getenv("S3_BASE_URL", "")
+        folder_name = os.getenv("S3_FOLDER_NAME", "")
+
+        for url_data, file_data, article_data in training_rows:
+            for url_item in url_data or []:
+                if url_item.get('is_trained', False) == True:
+                    logging.info(f"⏭️  Skipping already trained URL: {url_item.get('url')}")
+                    continue
+
+                source = url_item["url"]
+                states = await asyncio.to_thread(get_page_states, self.chatbot_id, source)
+                if url_item.get("sitemap"):
+                    page_urls = await asyncio.to_thread(get_sitemap_urls, source)
+                    if not page_urls:
+                        # Unreachable or missing sitemap: nothing to train, try again next time
+                        logging.warning(f"No pages found in the sitemap of {source}, leaving it untrained")
+                        continue
+                    self._sitemap_pages[source] = page_urls
+                else:
+                    page_urls = [source]
+
+                # Chunks of every sitemap page are tagged with the main URL so deleting it removes them all
+                self.processed_items['urls'].append(source)
+                pages = [page_url for page_url in page_urls if not self._resumed(states.get(page_url))]
+                await self._start_source(('urls', source), len(pages))
+                for page_url in pages:
+                    await self._emit(out_q, {
+                        "kind": "url", "source": source, "label": page_url, "item_key": ('urls', source),
+                        "url": page_url, "page_url": page_url, "state": states.get(page_url),
+                    })
+
+            for file_item in file_data or []:
+                if file_item.get('is_trained', False) == True:
+                    logging.info(f"⏭️  Skipping already trained file: {file_item.get('s3Name')}")
+                    continue
+
+                s3_name = file_item.get('s3Name')
+                if s3_name:
+                    states = await asyncio.to_thread(get_page_states, self.chatbot_id, s3_name)
+                    if self._resumed(states.get(s3_name)):
+                        self.processed_items['files'].append(s3_name)
+                        await self._start_source(('files', s3_name), 0)
+                        continue
+                    await self._start_source(('files', s3_name), 1)
+                    await self._emit(out_q, {
+                        "kind": "file", "source": s3_name, "label": s3_name, "item_key": ('files', s3_name),
+                        "url": f"{base_url}/{folder_name}/{s3_name}", "page_url": s3_name, "state": states.get(s3_name),
+                    })
+
+            for article in article_data or []:
+                if article.get('is_trained', False) == True:
+                    logging.info(f"⏭️  Skipping already trained article: {article.get('id')}")
+                    continue
+
+                content = article.get('content', '')
+                if content:
+                    # Articles are already clean text: no fetch, no LLM cleanup
+                    source = str(article.get('id'))
+                    page_url = f"article:{source}"
+                    states = await asyncio.to_thread(get_page_states, self.chatbot_id, source)
+                    item_key = ('articles', article.get('id'))
+                    self.processed_items['articles'].append(article.get('id'))
+                    if self._resumed(states.get(page_url)):
+                        await self._start_source(item_key, 0)
+                        continue
+                    await self._start_source(item_key, 1)
+                    await self._emit(out_q, {
+                        "kind": "article", "source": source, "label": "Article", "text": content, "item_key": item_key,
+                        "cleaned": True, "page_url": page_url, "state": states.get(page_url),
+                    })
+
+        for _ in range(FETCH_CONCURRENCY):
+            await out_q.put(_DONE)
+
+    async def _fetch(self, item):
+        state = item.get("state") or {}
+
+        if item["kind"] == "article":
+            item["page_state"] = {"body_hash": content_hash(item["text"])}
+            return await self._unchanged(item) if state.get("body_hash") == item["page_state"]["body_hash"] else item
+
+        if item["kind"] == "url":
+            ext = ".html"
+        else:
+            _, ext = os.path.splitext(item["url"].lower())
+            if ext not in SUPPORTED_FILE_TYPES:
+                logging.warning(f"Unsupported file type {ext or '(none)'} for {item['source']}, skipping it")
+                metrics.increment("ingestion.unsupported_files")
+                self.processed_items['files'].append(item["source"])
+                return None
+
+        try:
+            response = await asyncio.to_thread(
+                conditional_get, item["url"], state.get("etag"), state.get("last_modified"), ext in DOCUMENT_TYPES
+            )
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code not in (404, 410):
+                raise  # the page fails and its source stays untrained
+            logging.warning(f"{item['url']} is gone ({e.response.status_code}), removing it from the index")
+            return await self._remove_page(item)
+        if item["kind"] == "file":
+            self.processed_items['files'].append(item["source"])
+        if response.status_code == 304:
+            return await self._unchanged(item)
+
+        if ext in DOCUMENT_TYPES:
+            # Parsed page by page in the extraction process pool, off the event loop and the GIL
+            text, image_bytes = await extract_document_text(response, ext), None
+        else:
+            text, image_bytes = await asyncio.to_thread(extract_response_text, response, ext)
+        if not text and not image_bytes:
+            return await self._remove_page(item)
+
+        item["page_state"] = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            # Hashed without page breaks: pages used to be joined with "", keep stored hashes valid
+            "body_hash": content_hash(image_bytes or text.replace(PAGE_BREAK, "")),
+        }
+        if state.get("body_hash") == item["page_state"]["body_hash"]:
+            # Same content behind new validators: remember them so the next run gets a 304
+            await asyncio.to_thread(
+                save_page_state, self.chatbot_id, item["source"], item["page_url"],
+                item["page_state"]["etag"], item["page_state"]["last_modified"], item["page_state"]["body_hash"],
+                self.checkpoint,
+            )
+            return await self._unchanged(item, checkpointed=True)
+
+        item["text"] = text
+        item["image_bytes"] = image_bytes
+        return item
+
+    async def _clean(self, item):
+        if not item.get("cleaned"):
+            result = await asyncio.to_thread(clean_training_content, item["text"], item.pop("image_bytes", None))
+            item["text"] = result.text
+            item["llm_cost_usd"] = result.cost_usd
+            if result.llm_segments:
+                self.llm_documents += 1
+                self.llm_segments += result.llm_segments
+                self.llm_cost_usd += result.cost_usd
+                metrics.increment("ingestion.llm_segments", result.llm_segments)
+                metrics.increment("ingestion.llm_cost_usd", result.cost_usd)
+            else:
+                metrics.increment("ingestion.llm_skipped")
+            logging.debug(f"Cleaned {item['label']}: quality {result.quality}, {result.llm_segments} LLM calls in {result.seconds:.1f}s")
+        if not item["text"]:
+            return await self._remove_page(item)
+        return item
+
+    def _chunk(self, text: str, label: str) -> list:
+        chunks = []
+        for chunk in self.chunker(text):
+            text = chunk["content"]
+            if not chunks:
+                # Source marker on the first chunk only, as before, so identical chunks elsewhere still dedupe
+                text = f"--- Source: {label} ---\n{text}"
+            chunks.append({"content": text, "heading_path": " > ".join(chunk["heading_path"]), "content_hash": content_hash(text)})
+        return chunks
+
+    async def _chunk_and_embed(self, item):
+        # Tokenizing a long document takes seconds; off the loop so the other stages keep going
+        chunks = await asyncio.to_thread(self._chunk, item.pop("text"), item["label"])
+
+        # Identical chunks (within this page or anywhere in the chatbot) share one embedding
+        hashes = {c["content_hash"] for c in chunks}
+        embeddings = await asyncio.to_thread(get_embeddings_by_hash, self.chatbot_id, hashes)
+        reused = sum(1 for c in chunks if c["content_hash"] in embeddings)
+
+        missing = {}
+        for c in chunks:
+            if c["content_hash"] not in embeddings:
+                missing.setdefault(c["content_hash"], c["content"])
+        if missing:
+            vectors = await asyncio.to_thread(embedding_service.embed_batch, list(missing.values()))
+            for chunk_hash, vector in zip(missing, vectors):
+                if vector:
+                    embeddings[chunk_hash] = vector
+
+        self.reused_embeddings += reused
+        metrics.increment("ingestion.embeddings_reused", reused)
+        metrics.increment("ingestion.embeddings_requested", len(missing))
+
+        # A page written without some of its chunks would store the new body hash and be
+        # skipped as unchanged by the next run, so the missing chunks would never come back
+        failed = sum(1 for c in chunks if c["content_hash"] not in embeddings)
+        if failed:
+            metrics.increment("ingestion.embedding_failures", failed)
+            raise RuntimeError(f"{failed} of {len(chunks)} chunks could not be embedded")
+
+        item["chunks"] = [
+            {
+                "index": i, "content": c["content"], "embedding": embeddings[c["content_hash"]],
+                "source": item["source"], "page_url": item["page_url"], "content_hash": c["content_hash"],
+                "heading_path": c["heading_path"],
+            }
+            for i, c in enumerate(chunks)
+        ]
+        return item if item["chunks"] else None
+
+    async def _write(self, in_q):
+        """Single writer: swaps each page's chunks and page state in one transaction."""
+        while True:
+            item = await in_q.get()
+            if item is _DONE:
+                break
+
+            item["page_state"]["checkpoint"] = self.checkpoint
+            success = await asyncio.to_thread(
+                replace_page_chunks, self.chatbot_id, item["source"], item["page_url"], item["chunks"], item["page_state"]
+            )
+            if success:
+                self._written_sources.add(item["item_key"])
+                self.written_documents += 1
+                self.written_chunks += len(item["chunks"])
+                metrics.increment("ingestion.chunks", len(item["chunks"]))
+                await self._finish_document(item)
+            else:
+                await self._fail_document(item, "could not write chunks")
+
+    # ---- plumbing -----------------------------------------------------
+
+    async def _emit(self, out_q, item):
+        self.total_documents += 1
+        item["started"] = time.perf_counter()
+        await out_q.put(item)
+
+    async def _stage(self, fn, in_q, out_q, workers, next_workers):
+        """Runs `workers` copies of fn over in_q; signals the next stage's workers once all of them have drained."""
+        name = fn.__name__.strip("_")
+
+        async def worker():
+            while True:
+                item = await in_q.get()
+                if item is _DONE:
+                    return
+                start = time.perf_counter()
+                try:
+                    result = await fn(item)
+                except Exception as e:
+                    metrics.observe(f"ingestion.{name}", time.perf_counter() - start)
+                    await self._fail_document(item, f"{name}: {e}")
+                    continue
+                metrics.observe(f"ingestion.{name}", time.perf_counter() - start)
+
+                # None: nothing to index (unchanged, empty or unsupported), the page is done
+                if result is None:
+                    await self._finish_document(item)
+                else:
+                    await out_q.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        for _ in range(next_workers):
+            await out_q.put(_DONE)
+
+    def _resumed(self, state) -> bool:
+        """True for a page this job already finished in an earlier attempt; counted as done."""
+        if not self.checkpoint or not state or state.get("checkpoint") != self.checkpoint:
+            return False
+        self.resumed_documents += 1
+        self.total_documents += 1
+        self.done_documents += 1
+        metrics.increment("ingestion.resumed")
+        return True
+
+    async def _unchanged(self, item, checkpointed: bool = False):
+        self.unchanged_documents += 1
+        metrics.increment("ingestion.unchanged")
+        if self.checkpoint and not checkpointed:
+            await asyncio.to_thread(checkpoint_page, self.chatbot_id, item["page_url"], self.checkpoint)
+        return None
+
+    async def _remove_page(self, item):
+        """Drops the chunks and state of a page with nothing to index; raises if that fails."""
+        if not item.get("state"):
+            return None  # never indexed
+        if not await asyncio.to_thread(delete_page, self.chatbot_id, item["source"], item["page_url"]):
+            raise RuntimeError("could not remove the page's old chunks")
+        self._written_sources.add(item["item_key"])
+        metrics.increment("ingestion.removed_pages")
+        return None
+
+    async def _start_source(self, item_key, pages: int):
+        # Set before the first page is emitted: pages can finish while later ones are still being queued
+        self._pending_pages[item_key] = pages
+        if not pages:
+            await self._source_done(item_key)
+
+    async def _source_done(self, item_key):
+        bucket, key = item_key
+        # Sources with a failed page stay untrained; their other pages are checkpointed
+        if not self.on_source_done or key not in self.processed_items[bucket] or item_key in self._failed_sources:
+            return
+        try:
+            # One automations read-modify-write at a time
+            async with self._source_lock:
+                await self.on_source_done({bucket: [key]})
+        except Exception as e:
+            logging.warning(f"Could not mark {key} as trained: {e}")
+
+    async def _fail_document(self, item, error: str):
+        logging.error(f"Ingestion failed for {item.get('label')}: {error}")
+        self.failed_documents += 1
+        metrics.increment("ingestion.failed")
+        if item.get("item_key"):
+            self._failed_sources.add(item["item_key"])
+        await self._finish_document(item)
+
+    async def _finish_document(self, item=None):
+        self.done_documents += 1
+        if item and "started" in item:
+            seconds = time.perf_counter() - item["started"]
+            self.document_seconds += seconds
+            metrics.observe("ingestion.document", seconds)
+            logging.info(f"Ingested {item['label']} in {seconds:.1f}s (LLM cleanup ${item.get('llm_cost_usd', 0):.4f})")
+        item_key = item.get("item_key") if item else None
+        if item_key in self._pending_pages:
+            self._pending_pages[item_key] -= 1
+            if self._pending_pages[item_key] == 0:
+                if item_key in self._written_sources:
+                    self._written_sources.discard(item_key)
+                    await asyncio.to_thread(bump_generation, self.chatbot_id)
+                await self._source_done(item_key)
+        if self.on_progress:
+            try:
+                await self.on_progress(self.done_documents, self.total_documents)
+            except Exception as e:
+                logging.warning(f"Ingestion progress callback failed: {e}")
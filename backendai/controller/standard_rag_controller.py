@@ -10,240 +10,94 @@ from datetime import datetime, timezone
 from typing import Optional, Dict, Any
 
 from fastapi import HTTPException
-from services.openai_services import client
+from services.openai_services import stream_chat_completion
 from services.embedding_service import embedding_service
 from DB.postgresDB import (
-    postgres_connection, 
     run_query, 
-    run_write_query, 
     search_vectors, 
     get_db_connection, 
-    delete_chunks, 
-    insert_chunk_batch,
-    save_bot_message,
-    init_vector_db, 
-    get_pre_chat_form,
     get_customer_by_email,
     move_customer_to_pipeline,
     save_customer, 
-    get_conversation_metadata, 
     update_conversation_email,
     create_notification
 )
-from controller.chatbot_config import get_sitemap_urls, get_url_data, pdf_data, doc_data, txt_data, ppt_data, image_data
+from DB.chatbot_context import load_chatbot_context_async
+from DB.transcript_buffer import save_messages_nowait
+from DB.config_cache import get_chatbot_config
+from controller.conversation_summary import maybe_compact, summary_instruction
+from controller.ingestion_pipeline import IngestionPipeline
+from utils.markdown_chunker import iter_markdown_chunks
+from utils.prompt_budget import KNOWLEDGE_PLACEHOLDER, assemble_prompt
+from utils.sse import DISCONNECTED, record_abandoned
 from resources.industry_prompts import INDUSTRY_PROMPTS
+from utils import metrics
 
 # Use the environment variable for S3 Base URL
 S3_BASE_URL = os.getenv("S3_BASE_URL", "")
 S3_FOLDER_NAME = os.getenv("S3_FOLDER_NAME", "")
 
+# Chunk size for training data, in embedding-model tokens
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "350"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+
+CHAT_MODEL = "gpt-4o-mini"
+
 class StandardRAGController:
     @staticmethod
-    async def fetch_and_prepare_data(chatbot_id: str):
+    async def fetch_training_rows(chatbot_id: str):
         """
-        Fetches data from 'automations' table and extracts clean text.
-        Returns: Tuple(combined_text, processed_items_dict)
+        Fetches the chatbot's training sources from the 'automations' table.
+        Returns: [(training_url, training_pdf, training_article)]
         """
-        try:
-            def fetch_data_sync(cid):
-                with get_db_connection() as conn:
-                    data_query = """
-                        SELECT a.training_url, a.training_pdf, a.training_article
-                        FROM automations a
-                        JOIN chatbots c ON a.organization_id = c.organization_id
-                        WHERE c.chatbot_id = %s;
-                    """
-                    return run_query(conn, data_query, (cid,))
-
-            result = await asyncio.to_thread(fetch_data_sync, chatbot_id)
-            
-            # Debug Logging for S3 Config
-            import os
-            base_url = os.getenv("S3_BASE_URL", "")
-            folder_name = os.getenv("S3_FOLDER_NAME", "")
-            logging.info(f"DEBUG S3 Config: BASE={base_url}, FOLDER={folder_name}")
-
-            if not result:
-                return "", {'urls': [], 'files': [], 'articles': []}
-
-            # Reformatted to return list of documents (source, content)
-            documents = []
-            processed_items = {'urls': [], 'files': [], 'articles': []}
-            
-            for url_data, file_data, article_data in result:
-                 # URL data
-                if url_data:
-                    for url_item in url_data:
-                        # Skip if already trained
-                        if url_item.get('is_trained', False) == True:
-                            logging.info(f"⏭️  Skipping already trained URL: {url_item.get('url')}")
-                            continue
-                            
-                        try:
-                            if url_item.get("sitemap"):
-                                # Sitemap-based scraping
-                                sitemap_urls = get_sitemap_urls(url_item["url"])
-
-                                for page_url in sitemap_urls:
-                                    try:
-                                        content = get_url_data(page_url)
-                                        if content:
-                                            documents.append({
-                                                "source": url_item["url"], # Use main URL as source identifier for group deletion? Or specific page? 
-                                                # If we use specific page, deleting main URL needs to delete all child pages.
-                                                # For now, let's use the main URL as source, or we loop to delete later.
-                                                # Let's use the unique URL.
-                                                # Actually, for deletion, user deletes the MAIN url. So we should probably tag chunks with MAIN url.
-                                                "content": f"\n\n--- Source: {page_url} ---\n{content}"
-                                            })
-                                    except Exception as e:
-                                        logging.error(f"Error scraping {page_url}: {e}")
-
-                            else:
-                                # Single-page scraping
-                                try:
-                                    content = get_url_data(url_item["url"])
-                                    if content:
-                                        documents.append({
-                                            "source": url_item["url"],
-                                            "content": f"\n\n--- Source: {url_item['url']} ---\n{content}"
-                                        })
-                                except Exception as e:
-                                    logging.error(f"Error fetching URL {url_item['url']}: {e}")
-                            
-                            processed_items['urls'].append(url_item['url'])
+        def fetch_data_sync(cid):
+            with get_db_connection() as conn:
+                data_query = """
+                    SELECT a.training_url, a.training_pdf, a.training_article
+                    FROM automations a
+                    JOIN chatbots c ON a.organization_id = c.organization_id
+                    WHERE c.chatbot_id = %s;
+                """
+                return run_query(conn, data_query, (cid,))
 
-                        except Exception as e:
-                            logging.error(f"Error fetching URL {url_item.get('url')}: {e}")
-
-                # File data
-                if file_data:
-                    for file_item in file_data:
-                        # Skip if already trained
-                        if file_item.get('is_trained', False) == True:
-                            logging.info(f"⏭️  Skipping already trained file: {file_item.get('s3Name')}")
-                            continue
-                            
-                        s3_name = file_item.get('s3Name')
-                        if s3_name:
-                            file_url = f"{base_url}/{folder_name}/{s3_name}"
-                            _, ext = os.path.splitext(file_url.lower())
-                            try:
-                                content = ""
-                                if ext == '.pdf':
-                                    content = pdf_data(file_url)
-                                elif ext in ['.doc', '.docx']:
-                                    content = doc_data(file_url)
-                                elif ext == '.txt':
-                                    content = txt_data(file_url)
-                                elif ext in ['.ppt', '.pptx']:
-                                    content = ppt_data(file_url)
-                                elif ext in ['.jpeg', '.jpg', '.png']:
-                                    content = image_data(file_url)
-                                
-                                if content:
-                                    documents.append({
-                                        "source": s3_name,
-                                        "content": f"\n\n--- Source: {s3_name} ---\n{content}"
-                                    })
-                                
-                                processed_items['files'].append(s3_name)
-                            except Exception as e:
-                                logging.error(f"Error processing file {file_url}: {e}")
-
-                # Article data
-                if article_data:
-                    for article in article_data:
-                        # Skip if already trained
-                        if article.get('is_trained', False) == True:
-                            logging.info(f"⏭️  Skipping already trained article: {article.get('id')}")
-                            continue
-                            
-                        content = article.get('content', '')
-                        if content:
-                            documents.append({
-                                "source": article.get('id'), # Use ID as source for articles
-                                "content": f"\n\n--- Source: Article ---\n{content}"
-                            })
-                            processed_items['articles'].append(article.get('id'))
-
-            return documents, processed_items
+        try:
+            return await asyncio.to_thread(fetch_data_sync, chatbot_id) or []
         except Exception as e:
-            logging.error(f"Fetch Prep Data Error: {e}")
-            return [], {'urls': [], 'files': [], 'articles': []}
+            logging.error(f"Fetch Training Rows Error: {e}")
+            return []
 
     @staticmethod
     async def ingest_to_vector_db(chatbot_id: str):
         """
-        1. Fetches Text (Documents list).
-        2. Chunks Each Document.
-        3. Embeds Chunks (Batch).
-        4. Replaces old chunks for specific source.
-        5. Marks items as trained in rtserver.
+        Streams untrained sources through the ingestion pipeline
+        (fetch -> clean -> chunk -> embed -> replace chunks per source),
+        then marks items as trained in rtserver.
         """
-        logging.info(f"🔄 Step 1/5: Fetching training data for chatbot {chatbot_id}")
-        documents, processed_items = await StandardRAGController.fetch_and_prepare_data(chatbot_id)
-        
-        if not documents:
+        logging.info(f"🔄 Step 1/2: Ingesting training data for chatbot {chatbot_id}")
+        training_rows = await StandardRAGController.fetch_training_rows(chatbot_id)
+
+        async def on_source_done(items):
+            await StandardRAGController.mark_items_as_trained(chatbot_id, items)
+
+        # Sources are marked trained as they finish, so a failed run is not redone from scratch
+        pipeline = IngestionPipeline(chatbot_id, StandardRAGController.chunk_text, on_source_done=on_source_done)
+        result = await pipeline.run(training_rows)
+
+        if not result['documents'] and not result['unchanged']:
             logging.info(f"ℹ️  No untrained data found for chatbot {chatbot_id}. All items are already trained or no data exists.")
             return {"status": "success", "message": "No new data to train. All items are already trained."}
-        
-        logging.info(f"✅ Fetched {len(documents)} new documents for training")
-        
-        all_chunks_data = []
-        
-        # Process each document
-        for doc in documents:
-            source = doc['source']
-            content = doc['content']
-            
-            # Chunking
-            chunks_text = StandardRAGController.chunk_text(content)
-            
-            # Embedding
-            for i, chunk in enumerate(chunks_text):
-                vector = embedding_service.embed_text(chunk) 
-                if vector:
-                    all_chunks_data.append({
-                        "index": i,
-                        "content": chunk,
-                        "embedding": vector,
-                        "source": source
-                    })
 
-        logging.info(f"✅ Generated embeddings for {len(all_chunks_data)} chunks total")
-        
-        # DB Operations
-        logging.info(f"🔄 Step 4/5: Saving embeddings to database...")
-        
-        # For each source in the new batch, clear old chunks (just in case of re-training same source without full wipe)
-        # Note: processed_items has the sources.
-        
-        sources_to_clear = set()
-        for doc in documents:
-            sources_to_clear.add(doc['source'])
-            
-        # We can implement a batch delete or loop. Loop is fine for typical counts.
-        for source in sources_to_clear:
-             await asyncio.to_thread(delete_specific_chunks, chatbot_id, source)
-        
-        # Note: We REMOVED the global 'delete_chunks(chatbot_id)' call. 
-        # This enables INCREMENTAL training.
-        
-        if all_chunks_data:
-            await asyncio.to_thread(insert_chunk_batch, chatbot_id, all_chunks_data)
-        
-        logging.info(f"✅ Successfully saved {len(all_chunks_data)} chunks to database for chatbot {chatbot_id}")
-        
-        # 4. Mark items as trained in rtserver
-        logging.info(f"🔄 Step 5/5: Marking items as trained in rtserver...")
+        logging.info(f"✅ Successfully saved {result['chunks']} chunks from {result['documents']} documents for chatbot {chatbot_id} ({result['unchanged']} unchanged, {result['reused_embeddings']} embeddings reused)")
+
+        # Mark items as trained in rtserver
+        logging.info(f"🔄 Step 2/2: Marking items as trained in rtserver...")
         try:
-            await StandardRAGController.mark_items_as_trained(chatbot_id, processed_items)
+            await StandardRAGController.mark_items_as_trained(chatbot_id, result['processed_items'])
             logging.info(f"✅ Marked processed items as trained for chatbot {chatbot_id}")
         except Exception as e:
             logging.warning(f"⚠️  Failed to mark items as trained: {e}")
             # Don't fail the entire ingestion if marking fails
-        
+
         return True
 
     @staticmethod
@@ -261,6 +115,7 @@ class StandardRAGController:
                         FROM chatbots c
                         JOIN automations a ON c.organization_id = a.organization_id
                         WHERE c.chatbot_id = %s
+                        FOR UPDATE OF a
                     """
                     with conn.cursor() as cur:
                         cur.execute(query, (cid,))
@@ -336,25 +191,10 @@ class StandardRAGController:
     @staticmethod
     def get_organization_type(chatbot_id: str) -> str:
         """
-        Fetches the organization type for a given chatbot.
+        Fetches the organization type for a given chatbot (cached, see DB/config_cache.py).
         """
-        try:
-            with get_db_connection() as conn:
-                query = """
-                    SELECT o.organization_type 
-                    FROM organizations o
-                    JOIN chatbots c ON o.id = c.organization_id
-                    WHERE c.chatbot_id = %s
-                """
-                with conn.cursor() as cur:
-                   cur.execute(query, (chatbot_id,))
-                   result = cur.fetchone()
-                   if result:
-                       return result[0] or "Default"
-            return "Default"
-        except Exception as e:
-            logging.error(f"Error fetching organization type: {e}")
-            return "Default"
+        config = get_chatbot_config(chatbot_id)
+        return config.organization_type if config else "Default"
 
     @staticmethod
     async def chat_stream(chatbot_id: str, user_id: str, prompt: str, conversation_id: str = None, user_email: str = None, user_plan: str = None):
@@ -362,61 +202,58 @@ class StandardRAGController:
         Manages the chat using Custom RAG (Direct Context + History -> Chat Completion).
         Optimized for Speed: No prompt embedding, uses gpt-4o-mini.
         """
-        # Validation: Check if chatbot exists
+        start_time = time.time()
+
+        # Validation + per-request context (chatbot, org type, form, conversation, customer) in one query,
+        # loaded while the prompt is embedded
+        t0 = time.time()
+        context_task = asyncio.create_task(load_chatbot_context_async(chatbot_id, conversation_id, user_email))
+        query_vector = await embedding_service.embed_query_async(prompt)
+        t1 = time.time()
+        print(f"DEBUG: Embedding Time: {t1 - t0:.4f}s")
+
         try:
-            with get_db_connection() as conn:
-                check_query = "SELECT 1 FROM chatbots WHERE chatbot_id = %s"
-                res = run_query(conn, check_query, (chatbot_id,))
-                if not res:
-                    yield f"data: {json.dumps({'error': 'Invalid Chatbot ID'})}\n\n"
-                    return
+            ctx = await context_task
         except Exception as e:
             logging.error(f"Error validating chatbot_id: {e}")
             yield f"data: {json.dumps({'error': 'Database connection error during validation'})}\n\n"
             return
-
-
-        
-        start_time = time.time()
-        
-        # 1. Embed Prompt & Retrieve Context (Vector Search)
-        t0 = time.time()
-        query_vector = embedding_service.embed_text(prompt)
+        if not ctx:
+            yield f"data: {json.dumps({'error': 'Invalid Chatbot ID'})}\n\n"
+            return
+        metrics.observe("chat_stream.context_load", time.time() - t0)
         t1 = time.time()
-        print(f"DEBUG: Embedding Time: {t1 - t0:.4f}s")
         
-        context_results = await asyncio.to_thread(search_vectors, chatbot_id, query_vector, limit=1)
+        context_results = await asyncio.to_thread(search_vectors, chatbot_id, query_vector, limit=1, query_text=prompt)
         t2 = time.time()
         print(f"DEBUG: Vector Search Time: {t2 - t1:.4f}s")
         
-        if context_results:
-             # Concatenate retrieved chunks with visual separators
-             context_text = "\n\n".join([f"[CHUNK]: {r['content']}" for r in context_results])
-        else:
-             context_text = "No knowledge base available."
+        # Retrieved chunks, best first (the prompt assembler formats and budgets them)
+        context_chunks = [r['content'] for r in context_results] if context_results else []
 
-        print(f"RAG Context (Vector Search): {context_text[:100]}...")
+        print(f"RAG Context (Vector Search): {context_chunks[0][:100] if context_chunks else 'none'}...")
 
         # 2. Construct System Instruction (Base)
         
         # Determine Organization Type and get Industry Instruction
-        org_type = StandardRAGController.get_organization_type(chatbot_id)
+        org_type = ctx.organization_type
         industry_instruction = INDUSTRY_PROMPTS.get(org_type, INDUSTRY_PROMPTS.get("Default", ""))
         
         system_instruction = (
             f"Persona/Industry Context: {industry_instruction}\n\n"
             "Source Knowledge (Vector DB Context):\n"
-            f"{context_text}\n\n"
+            f"{KNOWLEDGE_PLACEHOLDER}\n\n"
             "Instruction: Answer the user's question using the Source Knowledge provided above. "
             "If the information is not found in the context, politely state that you do not have that information "
             "while maintaining your persona. Do not invent facts outside of the provided context."
         )
 
         # 2.5. Check for Pre-Chat Form (Function Calling)
-        form_config = get_pre_chat_form(chatbot_id)
+        form_config = ctx.pre_chat_form
         
         tools = None
         tool_choice = None
+        form_instruction = ""
         
         if form_config:
             # Generate Tool Definition from Form Config
@@ -489,20 +326,19 @@ class StandardRAGController:
                      # 2a. Fetch Customer Details if available
                      customer_context_str = ""
                      try:
-                         with get_db_connection() as conn:
-                             cust = get_customer_by_email(chatbot_id, user_email, conn)
-                             if cust:
-                                 c_name = cust.get("name")
-                                 c_phone = cust.get("phone")
-                                 if c_name: 
-                                     customer_context_str += f"Name: {c_name}\n"
-                                     customer_context_str += f"IMPORTANT: Address the user by their name ({c_name}) occasionally to be friendly.\n"
-                                 if c_phone: customer_context_str += f"Phone: {c_phone}\n"
+                         cust = get_customer_by_email(chatbot_id, user_email, context=ctx)
+                         if cust:
+                             c_name = cust.get("name")
+                             c_phone = cust.get("phone")
+                             if c_name: 
+                                 customer_context_str += f"Name: {c_name}\n"
+                                 customer_context_str += f"IMPORTANT: Address the user by their name ({c_name}) occasionally to be friendly.\n"
+                             if c_phone: customer_context_str += f"Phone: {c_phone}\n"
                      except Exception as e:
                          print(f"Error fetching customer context: {e}")
 
                      # If we already know the email (returning user or context), just ask for missing info or confirm.
-                     system_instruction += (
+                     form_instruction += (
                         f"\n\n[USER CONTEXT]\n"
                         f"You are speaking with a user whose email is: {user_email}.\n"
                         f"{customer_context_str}"
@@ -510,7 +346,7 @@ class StandardRAGController:
                         f"However, if you do not have their Name or Phone in the context above, please ask for those politely after 3 turns.\n"
                      )
                 else:
-                     system_instruction += (
+                     form_instruction += (
                         f"\n\n[PROGRESSIVE FORM COLLECTION]\n"
                         f"First, engage naturally with the user. Answer their questions helpfully for 3 conversation turns.\n"
                         f"After 3 turns, you must collect: Name, Email, and Phone Number.\n"
@@ -522,7 +358,7 @@ class StandardRAGController:
                         f"After calling the function, do NOT tell the user 'I have saved your details'. Just say 'Thanks!' or 'Got it!' and continue.\n"
                      )
 
-                system_instruction += (
+                form_instruction += (
                     f"\n[SUPPORT HANDOFF (CRITICAL)]\n"
                     f"You must proactively capture the user's details (Name, Email, Phone) and move them to the pipeline if they show HIGH INTEREST.\n"
                     f"Triggers for HIGH INTEREST include:\n"
@@ -547,151 +383,183 @@ class StandardRAGController:
         is_new_thread = False
         
         try:
-            with get_db_connection() as conn:
-                # 3a. Resolve User Identity if missing
-                if conversation_id and not is_new_thread and not user_email:
-                    meta = get_conversation_metadata(conversation_id, conn)
-                    if meta and meta.get("user_email"):
-                        user_email = meta.get("user_email")
-                        print(f"✅ Resolved User Email from Conversation: {user_email}")
-
-                if not conversation_id or conversation_id == "NEW_CHAT":
-                     conversation_id = str(uuid.uuid4())
-                     is_new_thread = True
-                     yield f"data: {json.dumps({'event': 'thread_created', 'thread_id': conversation_id})}\n\n"
-                else:
-                     # Fetch History
-                     try:
-                         hist_query = "SELECT history FROM bot_conversations WHERE conversation_id = %s"
-                         rows = run_query(conn, hist_query, (conversation_id,))
-                         if rows and rows[0][0]:
-                             raw_history = rows[0][0]
-                             
-                             if isinstance(raw_history, str):
-                                 try:
-                                     raw_history = json.loads(raw_history)
-                                 except:
-                                     raw_history = []
-                                     
-                             if isinstance(raw_history, list):
-                                 # Safety limit 100
-                                 recent_history = raw_history[-100:] if len(raw_history) > 100 else raw_history
+            # 3a. Resolve User Identity if missing
+            if conversation_id and not is_new_thread and not user_email:
+                if ctx.conversation_email:
+                    user_email = ctx.conversation_email
+                    print(f"✅ Resolved User Email from Conversation: {user_email}")
+
+            if not conversation_id or conversation_id == "NEW_CHAT":
+                 conversation_id = str(uuid.uuid4())
+                 is_new_thread = True
+                 yield f"data: {json.dumps({'event': 'thread_created', 'thread_id': conversation_id})}\n\n"
+            else:
+                 # History (loaded with the chatbot context)
+                 try:
+                     if ctx.history:
+                         raw_history = ctx.history
                                  
-                                 for msg in recent_history:
-                                     if isinstance(msg, dict):
-                                         role = "assistant" if msg.get("role") == "bot" else "user"
-                                         content = msg.get("text", "")
-                                         if content:
-                                             history_messages.append({"role": role, "content": content})
+                         if isinstance(raw_history, list):
+                             # Safety limit 100
+                             recent_history = raw_history[-100:] if len(raw_history) > 100 else raw_history
                              
-                             logging.info(f"Loaded {len(history_messages)} history messages for {conversation_id}")
-                     except Exception as e:
-                         logging.error(f"Error fetching history: {e}")
-
-                # 4. Detect Returning User
-                is_returning_user = False
-                customer_data = None
-                
-                # We need user_email for detection. Currently it might be in history or passed context?
-                # Standard chat usually doesn't pass email in body unless we update the endpoint signature.
-                # However, we have user_email in the session or context. 
-                # Let's check where 'user_email' comes from. It's passed to generate_realtime_session but here it is chat_stream?
-                # Ah, standard chat uses /standard/chat which has body. 
-                # Assuming the controller method receives it or we need to look it up from conversation_id if stored?
-                # We save email in bot_conversations on creation.
-                
-                # Let's try to get email from conversation record if available
-                if conversation_id:
-                     u_email_query = "SELECT user_email FROM bot_conversations WHERE conversation_id = %s"
-                     email_res = run_query(conn, u_email_query, (conversation_id,))
-                     if email_res and email_res[0][0]:
-                           user_email = email_res[0][0]
-                           if user_email and "guest" not in user_email and "@" in user_email:
-                                customer_data = get_customer_by_email(chatbot_id, user_email, conn)
-                                if customer_data: is_returning_user = True
-
-                # Separate Form Instruction to inject it closer to User Prompt for stronger adherence
-                form_system_instruction = ""
-                
-                if is_returning_user:
-                     c_name = customer_data.get("name", "")
-                     c_phone = customer_data.get("phone", "")
-                     
-                     form_system_instruction = (
-                        f"\n\n[RETURNING CUSTOMER DETECTED]\n"
-                        f"You are speaking with a valued returning customer.\n"
+                             for msg in recent_history:
+                                 if isinstance(msg, dict):
+                                     role = "assistant" if msg.get("role") == "bot" else "user"
+                                     content = msg.get("text", "")
+                                     if content:
+                                         history_messages.append({"role": role, "content": content})
+                         
+                         logging.info(f"Loaded {len(history_messages)} history messages for {conversation_id}")
+                 except Exception as e:
+                     logging.error(f"Error fetching history: {e}")
+
+            # 4. Detect Returning User
+            is_returning_user = False
+            customer_data = None
+            
+            # We need user_email for detection. Currently it might be in history or passed context?
+            # Standard chat usually doesn't pass email in body unless we update the endpoint signature.
+            # However, we have user_email in the session or context. 
+            # Let's check where 'user_email' comes from. It's passed to generate_realtime_session but here it is chat_stream?
+            # Ah, standard chat uses /standard/chat which has body. 
+            # Assuming the controller method receives it or we need to look it up from conversation_id if stored?
+            # We save email in bot_conversations on creation.
+            
+            # Let's try to get email from conversation record if available
+            if ctx.conversation_email:
+                   user_email = ctx.conversation_email
+                   if user_email and "guest" not in user_email and "@" in user_email:
+                        customer_data = get_customer_by_email(chatbot_id, user_email, context=ctx)
+                        if customer_data: is_returning_user = True
+
+            # Separate Form Instruction to inject it closer to User Prompt for stronger adherence
+            form_system_instruction = ""
+            
+            if is_returning_user:
+                 c_name = customer_data.get("name", "")
+                 c_phone = customer_data.get("phone", "")
+                 
+                 form_system_instruction = (
+                    f"\n\n[RETURNING CUSTOMER DETECTED]\n"
+                    f"You are speaking with a valued returning customer.\n"
+                 )
+                 
+                 if c_name:
+                     form_system_instruction += (
+                         f"Their name is: {c_name}.\n"
+                         f"IMPORTANT: Greet them by name (e.g., 'Hello {c_name}') at the start.\n"
+                         f"Address them by name occasionally throughout the conversation.\n"
                      )
-                     
-                     if c_name:
-                         form_system_instruction += (
-                             f"Their name is: {c_name}.\n"
-                             f"IMPORTANT: Greet them by name (e.g., 'Hello {c_name}') at the start.\n"
-                             f"Address them by name occasionally throughout the conversation.\n"
-                         )
-                     
-                     form_system_instruction += "You have their details, so do NOT ask for Name/Email/Phone."
-                     # Clear tools if we want to prevent form tool usage for returning users?
-                     # Ideally yes, or keep it just in case they want to update? 
-                     # Plan said "No tools needed for returning users" regarding form.
-                     # Let's remove submit_pre_chat_form from tools if present
-                     tools = [t for t in tools if t['function']['name'] != 'submit_pre_chat_form']
-
-                elif form_config and fields_str:
-                     conversation_turn_count = len(history_messages) // 2  # Count user-bot exchanges
-                     if conversation_turn_count >= 3:
-                          # After 3 turns, start asking for details
-                          form_system_instruction = (
-                             f"\n\n[SYSTEM INTERVENTION - DETECT & COLLECT USER DETAILS]"
-                             f"\nYou have had {conversation_turn_count} conversation turns with the user."
-                             f"\nNow is the time to collect: Name, Email, and Phone Number."
-                             f"\nLOGIC FLOW:"
-                             f"\n1. REVIEW what you have already collected from previous messages."
-                             f"\n2. IF you have AT LEAST ONE NEW PIECE of info (e.g. Name), call 'submit_pre_chat_form' IMMEDIATELY."
-                             f"\n3. IF YOU ARE MISSING ANY, ASK FOR ONE MISSING ITEM ONLY."
-                             f"\n   - If missing Name: 'May I know your name?'"
-                             f"\n   - If missing Email: 'Thanks! What is your email address?'"
-                             f"\n   - If missing Phone: 'And your phone number?'"
-                             f"\n4. Do NOT ask for all three at once."
-                             f"\n5. Do NOT say 'I will save this' or 'details saved'."
-                          )
-                     else:
-                          # Before 4 turns, just answer naturally
-                          form_system_instruction = (
-                             f"\n\n[SYSTEM INTERVENTION - EARLY CONVERSATION]"
-                             f"\nYou are in turn {conversation_turn_count + 1} of the conversation."
-                             f"\nFocus on answering the user's questions helpfully."
-                             f"\nDo NOT ask for name, email, or phone number yet UNLESS the user expresses 'High Interest' or 'Heavy Intent'."
-                             f"\n\n[HEAVY INTENT TRIGGERS]"
-                             f"\nIf the user says any of the following, you match 'Heavy Intent':"
-                             f"\n1. 'I want to speak to support' or similar."
-                             f"\n2. Asks about PRICING."
-                             f"\n3. Asking for comparisons with COMPETITORS."
-                             f"\n4. Asking specifically 'how to buy' or 'sign up'."
-                             f"\n\n[ACTION ON HEAVY INTENT]"
-                             f"\n- If 'Heavy Intent' is detected, IGNORE the 'wait 3 turns' rule."
-                             f"\n- Immediately say: 'I'd be happy to help with that! First, may I know your name?'"
-                             f"\n- Collect Name, Email, Phone ONE BY ONE."
-                             f"\n- Then call 'submit_pre_chat_form'."
-                             f"\n- Then continue the conversation/answer the question."
-                          )
-                
+                 
+                 form_system_instruction += "You have their details, so do NOT ask for Name/Email/Phone."
+                 # Clear tools if we want to prevent form tool usage for returning users?
+                 # Ideally yes, or keep it just in case they want to update? 
+                 # Plan said "No tools needed for returning users" regarding form.
+                 # Let's remove submit_pre_chat_form from tools if present
+                 tools = [t for t in tools if t['function']['name'] != 'submit_pre_chat_form']
+
+            elif form_config and fields_str:
+                 conversation_turn_count = (ctx.summarized_count + len(history_messages)) // 2  # Count user-bot exchanges (summarized ones too)
+                 if conversation_turn_count >= 3:
+                      # After 3 turns, start asking for details
+                      form_system_instruction = (
+                         f"\n\n[SYSTEM INTERVENTION - DETECT & COLLECT USER DETAILS]"
+                         f"\nYou have had {conversation_turn_count} conversation turns with the user."
+                         f"\nNow is the time to collect: Name, Email, and Phone Number."
+                         f"\nLOGIC FLOW:"
+                         f"\n1. REVIEW what you have already collected from previous messages."
+                         f"\n2. IF you have AT LEAST ONE NEW PIECE of info (e.g. Name), call 'submit_pre_chat_form' IMMEDIATELY."
+                         f"\n3. IF YOU ARE MISSING ANY, ASK FOR ONE MISSING ITEM ONLY."
+                         f"\n   - If missing Name: 'May I know your name?'"
+                         f"\n   - If missing Email: 'Thanks! What is your email address?'"
+                         f"\n   - If missing Phone: 'And your phone number?'"
+                         f"\n4. Do NOT ask for all three at once."
+                         f"\n5. Do NOT say 'I will save this' or 'details saved'."
+                      )
+                 else:
+                      # Before 4 turns, just answer naturally
+                      form_system_instruction = (
+                         f"\n\n[SYSTEM INTERVENTION - EARLY CONVERSATION]"
+                         f"\nYou are in turn {conversation_turn_count + 1} of the conversation."
+                         f"\nFocus on answering the user's questions helpfully."
+                         f"\nDo NOT ask for name, email, or phone number yet UNLESS the user expresses 'High Interest' or 'Heavy Intent'."
+                         f"\n\n[HEAVY INTENT TRIGGERS]"
+                         f"\nIf the user says any of the following, you match 'Heavy Intent':"
+                         f"\n1. 'I want to speak to support' or similar."
+                         f"\n2. Asks about PRICING."
+                         f"\n3. Asking for comparisons with COMPETITORS."
+                         f"\n4. Asking specifically 'how to buy' or 'sign up'."
+                         f"\n\n[ACTION ON HEAVY INTENT]"
+                         f"\n- If 'Heavy Intent' is detected, IGNORE the 'wait 3 turns' rule."
+                         f"\n- Immediately say: 'I'd be happy to help with that! First, may I know your name?'"
+                         f"\n- Collect Name, Email, Phone ONE BY ONE."
+                         f"\n- Then call 'submit_pre_chat_form'."
+                         f"\n- Then continue the conversation/answer the question."
+                      )
+            
         except Exception as e:
              logging.error(f"Error in chat setup: {e}")
              yield f"data: {json.dumps({'error': str(e)})}\n\n"
              return
 
+        # 6. Save to DB (History), after the reply or when the client disconnects
+        def save_turn(response_text: str, interrupted: bool = False):
+            try:
+                current_time = datetime.now(timezone.utc)
+                new_msgs = [
+                    {"role": "user", "text": prompt, "timestamp": current_time.isoformat()},
+                    {"role": "bot", "text": response_text, "timestamp": current_time.isoformat()}
+                ]
+                if interrupted:
+                    # Partial answer of a stream the client disconnected from
+                    new_msgs[1]["interrupted"] = True
+            
+                create = None
+                if is_new_thread:
+                    # The conversation row is inserted (if missing) by the write-behind buffer
+                    # together with the first messages, so nothing here touches the database
+                    safe_user_id = user_id or "guest"
+                    create = {
+                        "user_id": safe_user_id,
+                        "user_email": user_email or (safe_user_id if '@' in safe_user_id else 'guest@example.com'),
+                        "user_plan": user_plan or "free",
+                        "chatbot_id": chatbot_id,
+                        # Title from the first prompt (max 50 chars)
+                        "title": prompt[:50] + "..." if len(prompt) > 50 else prompt,
+                        "created_at": current_time,
+                    }
+                save_messages_nowait(conversation_id, new_msgs, current_time, create)
+                if not is_new_thread:
+                    # Fold older turns into the summary once the verbatim history is over budget
+                    maybe_compact(conversation_id, ctx.history + new_msgs)
+                     
+            except Exception as e:
+                logging.error(f"Error saving history: {e}")
+
         # 5. Call OpenAI (Chat Completion) - Connection RELEASED here
         full_response = ""
+        reply_done = False
         tool_call_buffer = [] 
         
         try:
-            # Construct Messages for LLM
+            # Construct Messages for LLM within the model's token budget
+            # (persona > retrieved chunks > form state > summary and recent history)
+            assembled = assemble_prompt(
+                CHAT_MODEL, system_instruction, prompt,
+                chunks=context_chunks,
+                form_state=[form_instruction, form_system_instruction],
+                history=history_messages,
+                summary=summary_instruction(ctx.summary),
+                tools=tools,
+            )
+            metrics.observe("chat_stream.prompt_tokens", assembled.tokens)
+
             # 1. System
-            full_system_prompt = f"{system_instruction}{form_system_instruction}"
-            messages = [{"role": "system", "content": full_system_prompt}]
+            messages = [{"role": "system", "content": assembled.system_prompt}]
             
             # 2. History
-            messages.extend(history_messages)
+            messages.extend(assembled.history)
             
             # 3. Current User Message
             messages.append({"role": "user", "content": prompt})
@@ -700,31 +568,38 @@ class StandardRAGController:
             
             # Prepare args
             api_args = {
-                "model": "gpt-4o-mini",
+                "model": CHAT_MODEL,
                 "messages": messages,
-                "stream": True,
                 "temperature": 0.7
             }
             if tools:
                 api_args["tools"] = tools
                 api_args["tool_choice"] = tool_choice
             
-            stream = client.chat.completions.create(**api_args)
-            
-            for chunk in stream:
-                # Handle Tool Calls
-                if chunk.choices[0].delta.tool_calls:
-                    for tc in chunk.choices[0].delta.tool_calls:
-                        if len(tool_call_buffer) <= tc.index:
-                            tool_call_buffer.append({"id": tc.id, "name": tc.function.name, "arguments": ""})
-                        if tc.function.arguments:
-                            tool_call_buffer[tc.index]["arguments"] += tc.function.arguments
-                
-                # Handle Text Content
-                elif chunk.choices[0].delta.content:
-                    token = chunk.choices[0].delta.content
-                    full_response += token
-                    yield f"data: {json.dumps({'token': token})}\n\n"
+            # Async stream: reading tokens no longer blocks the event loop (and other SSE
+            # responses on this worker). The upstream response is closed when the block
+            # exits, also when this generator is closed or cancelled on disconnect.
+            token_count = 0
+            async with stream_chat_completion(**api_args) as stream:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    # Handle Tool Calls
+                    if chunk.choices[0].delta.tool_calls:
+                        for tc in chunk.choices[0].delta.tool_calls:
+                            if len(tool_call_buffer) <= tc.index:
+                                tool_call_buffer.append({"id": tc.id, "name": tc.function.name, "arguments": ""})
+                            if tc.function.arguments:
+                                tool_call_buffer[tc.index]["arguments"] += tc.function.arguments
+                    
+                    # Handle Text Content
+                    elif chunk.choices[0].delta.content:
+                        token = chunk.choices[0].delta.content
+                        if not full_response:
+                            metrics.observe("chat_stream.ttft", time.time() - start_time)
+                        full_response += token
+                        token_count += 1
+                        yield f"data: {json.dumps({'token': token})}\n\n"
             
             t_llm_end = time.time()
             print(f"DEBUG: LLM Generation Time: {t_llm_end - t_llm_start:.4f}s")
@@ -775,7 +650,7 @@ class StandardRAGController:
                                         "source": "chatbot",
                                         "chatbot_id": chatbot_id
                                     }
-                                    save_customer(chatbot_id, email_arg, c_data)
+                                    save_customer(chatbot_id, email_arg, c_data, context=ctx)
 
                                 # 2. Handle Urgency
                                 if urgency_arg == 'immediate':
@@ -800,8 +675,7 @@ class StandardRAGController:
                                 
                                 else:
                                     # 3. Move to Pipeline (Schedule/Later)
-                                    with get_db_connection() as conn:
-                                         success = move_customer_to_pipeline(chatbot_id, email_arg, conn)
+                                    success = move_customer_to_pipeline(chatbot_id, email_arg, context=ctx)
                                     
                                     if success:
                                          create_notification(
@@ -827,13 +701,8 @@ class StandardRAGController:
                             form_data = json.loads(tc['arguments'])
                             rtserver_url = os.getenv("RT_SERVER_URL", "http://localhost:3000")
                             
-                            # Get chatbot organization_id
-                            conn = postgres_connection()
-                            org_query = "SELECT organization_id FROM chatbots WHERE chatbot_id = %s"
-                            org_result = run_query(conn, org_query, (chatbot_id,))
-                            conn.close()
-                            
-                            if org_result and org_result[0]:
+                            # Chatbot organization_id (from the request context)
+                            if ctx.organization_id:
                                 # Construct Save Data
                                 custom_data = {
                                     "name": form_data.get("name", ""),
@@ -844,7 +713,7 @@ class StandardRAGController:
                                 email_to_save = form_data.get("email", "")
                                 
                                 # Use new DB helper (handles connection internally)
-                                success = save_customer(chatbot_id, email_to_save, custom_data)
+                                success = save_customer(chatbot_id, email_to_save, custom_data, context=ctx)
                                 
                                 if success:
                                     # Also update conversation if ID exists
@@ -881,65 +750,43 @@ class StandardRAGController:
                 
                 print("DEBUG: Recursive Call to Answer Question...")
                 api_args["messages"] = messages
-                stream_2 = client.chat.completions.create(**api_args)
-                
-                for chunk in stream_2:
-                    if chunk.choices[0].delta.content:
-                        token = chunk.choices[0].delta.content
-                        full_response += token
-                        yield f"data: {json.dumps({'token': token})}\n\n"
-
+                async with stream_chat_completion(**api_args) as stream_2:
+                    async for chunk in stream_2:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            token = chunk.choices[0].delta.content
+                            full_response += token
+                            token_count += 1
+                            yield f"data: {json.dumps({'token': token})}\n\n"
+
+            llm_seconds = time.time() - t_llm_start
+            if token_count and llm_seconds > 0:
+                metrics.observe("chat_stream.tokens_per_second", token_count / llm_seconds)
+            reply_done = True
             yield f"data: {json.dumps({'event': 'end'})}\n\n"
             
+        except DISCONNECTED:
+            # Client went away: the upstream stream is closed by its `async with`;
+            # keep what was generated so far
+            # (widgets may also close the connection right after the end event)
+            if not reply_done:
+                record_abandoned("chat_stream", full_response)
+            save_turn(full_response, interrupted=not reply_done)
+            raise
         except Exception as e:
             logging.error(f"OpenAI Error: {e}")
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
             return
-            
+
         # 6. Save to DB (History) - Get connection AGAIN
-        try:
-            current_time = datetime.now(timezone.utc)
-            new_msgs = [
-                {"role": "user", "text": prompt, "timestamp": current_time.isoformat()},
-                {"role": "bot", "text": full_response, "timestamp": current_time.isoformat()}
-            ]
-            
-            with get_db_connection() as conn:
-                if is_new_thread:
-                     # Generate title from first prompt (max 50 chars)
-                     title = prompt[:50] + "..." if len(prompt) > 50 else prompt
-                     
-                     insert_query = """
-                        INSERT INTO bot_conversations (user_id, user_email, user_plan, chatbot_id, conversation_id, title, history, created_at, updated_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s)
-                     """
-                     safe_user_id = user_id or "guest"
-                     safe_email = user_email or (safe_user_id if '@' in safe_user_id else 'guest@example.com')
-                     safe_plan = user_plan or "free"
-                     
-                     run_write_query(conn, insert_query, (safe_user_id, safe_email, safe_plan, chatbot_id, conversation_id, title, json.dumps(new_msgs), current_time, current_time))
-                else:
-                     update_query = """
-                        UPDATE bot_conversations 
-                        SET history = COALESCE(history, '[]'::jsonb) || %s::jsonb, updated_at = %s
-                        WHERE conversation_id = %s
-                     """
-                     run_write_query(conn, update_query, (json.dumps(new_msgs), current_time, conversation_id))
-                     
-        except Exception as e:
-            logging.error(f"Error saving history: {e}")
+        save_turn(full_response)
+
     @staticmethod
-    def chunk_text(text: str, chunk_size=1000, overlap=100) -> list:
+    def chunk_text(text: str, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
         """
-        Splits text into chunks of specified size and overlap.
+        Streams Markdown-aware chunks sized in tokens (see utils/markdown_chunker.py).
+        Yields: {'content': str, 'heading_path': list[str], 'tokens': int}
         """
         if not text:
-            return []
-            
-        chunks = []
-        for i in range(0, len(text), chunk_size - overlap):
-            chunk = text[i:i + chunk_size]
-            chunks.append(chunk)
-            
-        return chunks
+            return iter(())
+        return iter_markdown_chunks(text, max_tokens, overlap_tokens)
 standard_rag_controller = StandardRAGController()
@@ -0,0 +1,171 @@
+"""
+Coalesced, rate-limited training progress reports.
+
+send_webhook used to POST every progress update with a blocking
+requests.post (5 s timeout) awaited by the ingestion pipeline, so a slow
+rtserver slowed training down. Updates are now handed to a ProgressReporter
+and the caller moves on:
+
+- Only the latest update per organization is kept; a background task sends
+  them at most once per TRAINING_PROGRESS_INTERVAL seconds over a pooled
+  httpx.AsyncClient. A failed progress POST is dropped (the next one
+  supersedes it).
+- Terminal updates ('completed', 'failed') replace anything pending and are
+  delivered right away, retried up to TRAINING_WEBHOOK_RETRIES times.
+  Updates are numbered, and a progress update older than the organization's
+  last terminal one is dropped, even if it was already taken by the sender.
+- Every update that is sent is also written to automations
+  (training_status / training_progress / training_message), so progress is
+  visible even when the webhook is down or not configured.
+- stop_progress_reporter() (API lifespan, training worker shutdown) sends
+  what is still pending and closes the client.
+
+Metrics: training_progress.sent, training_progress.coalesced, training_progress.superseded,
+training_progress.errors.
+"""
+
+import os
+import asyncio
+import logging
+
+import httpx
+
+from DB.async_pool import execute
+from utils import metrics
+
+TRAINING_PROGRESS_INTERVAL = float(os.getenv("TRAINING_PROGRESS_INTERVAL", "2"))
+TRAINING_WEBHOOK_TIMEOUT = float(os.getenv("TRAINING_WEBHOOK_TIMEOUT", "5"))
+TRAINING_WEBHOOK_RETRIES = int(os.getenv("TRAINING_WEBHOOK_RETRIES", "3"))
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+UPDATE_AUTOMATIONS_SQL = """
+    UPDATE automations SET training_status = %s, training_progress = %s, training_message = %s
+    WHERE organization_id = %s
+"""
+
+
+class ProgressReporter:
+    """
+    Latest-update-wins progress queue with a sender task on the running event loop.
+    """
+
+    def __init__(self, interval: float = TRAINING_PROGRESS_INTERVAL):
+        self.interval = interval
+        self._pending = {}      # organization_id -> update dict
+        self._locks = {}        # organization_id -> lock; keeps updates of an organization in order
+        self._seq = 0           # numbers updates in the order they were queued
+        self._terminal_seq = {} # organization_id -> seq of its last terminal update
+        self._client = None
+        self._task = None
+        self._loop = None
+        self._wake = None
+        self._closing = False
+
+    # -- producers ---------------------------------------------------------
+
+    def report(self, webhook_url: str, organization_id: int, status: str, progress: int,
+               message: str, error: str = None):
+        """Queues a progress update without waiting for it to be sent."""
+        self._ensure_started()
+        if organization_id in self._pending:
+            metrics.increment("training_progress.coalesced")
+        self._pending[organization_id] = {
+            "webhook_url": webhook_url, "organization_id": organization_id, "status": status,
+            "progress": progress, "message": message, "error": error, "seq": self._next_seq(),
+        }
+        self._wake.set()
+
+    async def deliver(self, webhook_url: str, organization_id: int, status: str, progress: int,
+                      message: str, error: str = None) -> bool:
+        """Sends an update now (terminal states), dropping any older pending one. Retried on failure."""
+        self._ensure_started()
+        self._pending.pop(organization_id, None)
+        update = {
+            "webhook_url": webhook_url, "organization_id": organization_id, "status": status,
+            "progress": progress, "message": message, "error": error, "seq": self._next_seq(),
+        }
+        # Progress updates already taken by flush() may still be waiting on the lock
+        self._terminal_seq[organization_id] = update["seq"]
+        return await self._send(update, retries=TRAINING_WEBHOOK_RETRIES)
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    # -- sender ------------------------------------------------------------
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+        # First use on this loop (the API and the worker each have one; scripts may use asyncio.run)
+        self._loop = loop
+        self._closing = False
+        self._wake = asyncio.Event()
+        self._locks = {}
+        self._client = httpx.AsyncClient(
+            timeout=TRAINING_WEBHOOK_TIMEOUT,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+        )
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            await self.flush()
+            if self._closing:
+                return
+            await asyncio.sleep(self.interval)
+
+    async def flush(self):
+        """Sends every pending update once."""
+        pending, self._pending = self._pending, {}
+        if pending:
+            await asyncio.gather(*(self._send(update) for update in pending.values()))
+
+    async def _send(self, update: dict, retries: int = 0) -> bool:
+        organization_id = update["organization_id"]
+        async with self._locks.setdefault(organization_id, asyncio.Lock()):
+            if update["status"] not in TERMINAL_STATUSES and update["seq"] < self._terminal_seq.get(organization_id, 0):
+                metrics.increment("training_progress.superseded")
+                return True
+            await execute(UPDATE_AUTOMATIONS_SQL, (
+                update["status"], update["progress"], update["message"], organization_id
+            ))
+            logging.info(f"Training {organization_id}: {update['status']} - {update['progress']}% - {update['message']}")
+            if not update["webhook_url"]:
+                return True
+
+            payload = {k: update[k] for k in ("organization_id", "status", "progress", "message", "error")}
+            for attempt in range(retries + 1):
+                try:
+                    response = await self._client.post(update["webhook_url"], json=payload)
+                    response.raise_for_status()
+                    metrics.increment("training_progress.sent")
+                    return True
+                except Exception as e:
+                    metrics.increment("training_progress.errors")
+                    logging.error(f"Webhook failed (attempt {attempt + 1}/{retries + 1}): {e}")
+                    if attempt < retries:
+                        await asyncio.sleep(2 ** attempt)
+            return False
+
+    async def close(self):
+        if self._task is None or self._loop is not asyncio.get_running_loop():
+            return
+        # The sender sends what is pending and exits instead of being cancelled mid-request
+        self._closing = True
+        self._wake.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self._client.aclose()
+        self._task = self._client = self._loop = None
+
+
+progress_reporter = ProgressReporter()
+
+
+async def stop_progress_reporter():
+    """Sends pending updates and closes the HTTP client; call before closing the DB pools."""
+    await progress_reporter.close()
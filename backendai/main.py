@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routes import copilot_routes
 import uvicorn
+import asyncio
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 
@@ -15,30 +16,44 @@ from routes.image_generation_routes import router as image_generation_route
 from routes.ollama_routes import router as ollama_route
 
 # from DB.mongodb import client as mongo_client
-from DB.postgresDB import postgres_connection
-
-pg_conn = None 
+from DB.postgresDB import postgres_connection, release_connection
+from DB.async_pool import open_async_pool, close_async_pool
+from DB.config_cache import start_config_listener, stop_config_listener
+from DB.transcript_buffer import start_transcript_buffer, stop_transcript_buffer
+from services.openai_services import close_async_client
+from controller.training_progress import stop_progress_reporter
+from services.document_extraction import shutdown_extraction_pool
 
 # Lifespan event: handles startup and shutdown
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global pg_conn
-
-    # Connect to PostgreSQL
+    # Warm up the PostgreSQL pools
     try:
         pg_conn = postgres_connection()
         if pg_conn:
+            release_connection(pg_conn)
             print("PostgreSQL connection successful")
         else:
             print("Failed to connect to PostgreSQL - will retry on demand")
     except Exception as e:
         print(f"PostgreSQL connection error: {e} - will retry on demand")
 
+    await open_async_pool()
+    start_config_listener()
+    start_transcript_buffer()
+
     yield 
 
-    if pg_conn:
-        pg_conn.close()
-        print("PostgreSQL connection closed")
+    stop_config_listener()
+    # Drain queued chat messages while the pools are still open
+    await asyncio.to_thread(stop_transcript_buffer)
+    await stop_progress_reporter()
+    await close_async_pool()
+    await close_async_client()
+    shutdown_extraction_pool()
+    from DB.postgresDB import close_db_pools
+    close_db_pools()
+    print("PostgreSQL connection pools closed")
 
 # Create FastAPI app with lifespan
 app = FastAPI(lifespan=lifespan)
@@ -89,6 +104,14 @@ def health_check():
     
     return health_status
 
+@app.get("/metrics")
+def metrics_snapshot():
+    """
+    In-process counters, timings and gauges (cache hit rates, pool usage, ...)
+    """
+    from utils import metrics
+    return metrics.snapshot()
+
 # Include your routers
 app.include_router(rhinon_ai_router, prefix="/api", tags=["Assistant for WebApp"])
 app.include_router(gpt_support_route,tags=["gpt for Chatbot"])
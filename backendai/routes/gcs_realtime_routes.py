@@ -20,15 +20,11 @@ from pydantic import BaseModel
 from typing import Optional, List
 import os
 import logging
-import json
 import uuid
 from datetime import datetime, timezone
 import asyncio
 
 from DB.postgresDB import (
-    get_db_connection,
-    run_query,
-    run_write_query,
     get_pre_chat_form,
     get_customer_by_email,
     search_vectors,
@@ -36,6 +32,11 @@ from DB.postgresDB import (
     save_customer,
     create_notification
 )
+from DB.async_pool import execute
+from DB.conversation_store import fetch_prompt_history
+from DB.transcript_buffer import save_messages, with_pending
+from controller.conversation_summary import maybe_compact, summary_instruction
+from DB.config_cache import get_chatbot_config_async
 from services.embedding_service import embedding_service
 from services.gcs_services import gcs_services
 from resources.industry_prompts import INDUSTRY_PROMPTS
@@ -127,55 +128,46 @@ async def gcs_generate_realtime_session(request: RealtimeSessionRequest):
         system_instruction = ""
         history_text = ""
         
-        with get_db_connection() as conn:
-            # A. Manage Conversation ID & Persistence - SAME AS OpenAI
-            is_new = False
-            if not conversation_id or conversation_id == "NEW_CHAT":
-                conversation_id = str(uuid.uuid4())
+        # A. Manage Conversation ID & Persistence - SAME AS OpenAI
+        is_new = False
+        if not conversation_id or conversation_id == "NEW_CHAT":
+            conversation_id = str(uuid.uuid4())
+            is_new = True
+            recent, summary = None, None
+        else:
+            # Existence check, summary and the last 20 messages after it (audio context) in one round-trip
+            prompt_history = await fetch_prompt_history(conversation_id, 20)
+            if prompt_history is None:
                 is_new = True
+                recent, summary = None, None
             else:
-                res = run_query(conn, "SELECT 1 FROM bot_conversations WHERE conversation_id = %s", (conversation_id,))
-                if not res:
-                    is_new = True
-            
-            current_time = datetime.now(timezone.utc)
-            if is_new:
-                insert_query = """
-                    INSERT INTO bot_conversations (user_id, user_email, user_plan, chatbot_id, conversation_id, title, history, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s)
-                """
-                run_write_query(conn, insert_query, (user_id, user_email, user_plan, chatbot_id, conversation_id, "GCS Realtime Session", '[]', current_time, current_time))
-            else:
-                # B. Fetch History
-                hist_query = "SELECT history FROM bot_conversations WHERE conversation_id = %s"
-                rows = run_query(conn, hist_query, (conversation_id,))
-                if rows and rows[0][0]:
-                    raw = rows[0][0]
-                    history_list = raw if isinstance(raw, list) else json.loads(raw)
-                    recent = history_list[-20:] if len(history_list) > 20 else history_list
-                    
-                    history_text = "\n\nPrevious Conversation History:\n"
-                    for msg in recent:
-                        role = msg.get("role", "user")
-                        text = msg.get("text", "")
-                        history_text += f"{role.title()}: {text}\n"
-        
-        # C. Get Organization Type & Industry Prompt
-        org_type = "Default"
+                summary, _, recent = prompt_history
+                recent = with_pending(conversation_id, recent, 20)
+                maybe_compact(conversation_id, recent)
+
+        current_time = datetime.now(timezone.utc)
+        if is_new:
+            insert_query = """
+                INSERT INTO bot_conversations (user_id, user_email, user_plan, chatbot_id, conversation_id, title, history, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s)
+            """
+            await execute(insert_query, (user_id, user_email, user_plan, chatbot_id, conversation_id, "GCS Realtime Session", '[]', current_time, current_time))
+        elif recent or summary:
+            # B. Fetch History (summary of older turns + recent messages)
+            history_text = summary_instruction(summary) + "\n\nPrevious Conversation History:\n"
+            for msg in recent:
+                role = msg.get("role", "user")
+                text = msg.get("text", "")
+                history_text += f"{role.title()}: {text}\n"
+
+        # C. Get Organization Type & Industry Prompt (cached chatbot config)
+        config = None
         try:
-            with get_db_connection() as type_conn:
-                type_query = """
-                    SELECT o.organization_type 
-                    FROM organizations o
-                    JOIN chatbots c ON o.id = c.organization_id
-                    WHERE c.chatbot_id = %s
-                """
-                type_res = run_query(type_conn, type_query, (chatbot_id,))
-                if type_res and type_res[0]:
-                    org_type = type_res[0][0] or "Default"
+            config = await get_chatbot_config_async(chatbot_id)
         except Exception as e:
             logging.error(f"[GCS] Error fetching org type: {e}")
         
+        org_type = config.organization_type if config else "Default"
         industry_instruction = INDUSTRY_PROMPTS.get(org_type, INDUSTRY_PROMPTS["Default"])
         
         # Base System Instruction - SAME AS OpenAI
@@ -203,11 +195,10 @@ async def gcs_generate_realtime_session(request: RealtimeSessionRequest):
         customer_data = None
         is_returning_user = False
         
-        with get_db_connection() as conn:
-            if user_email and user_email != "guest@example.com" and "guest@" not in user_email:
-                customer_data = get_customer_by_email(chatbot_id, user_email, conn)
-                if customer_data:
-                    is_returning_user = True
+        if user_email and user_email != "guest@example.com" and "guest@" not in user_email:
+            customer_data = get_customer_by_email(chatbot_id, user_email, context=config)
+            if customer_data:
+                is_returning_user = True
         
         # D.2 Build Instructions & Tools Based on Status
         tools = []
@@ -289,8 +280,7 @@ async def gcs_generate_realtime_session(request: RealtimeSessionRequest):
             
         else:
             # NEW USER Logic -> Add Form Collection
-            with get_db_connection() as conn:
-                form_config = get_pre_chat_form(chatbot_id, conn)
+            form_config = config.pre_chat_form if config else get_pre_chat_form(chatbot_id)
             
             # Default Tool: Search
             tools = [
@@ -462,24 +452,14 @@ async def gcs_save_realtime_conversation(request: RealtimeSaveRequest):
                 "timestamp": current_time.isoformat()
             })
         
-        with get_db_connection() as conn:
-            res = run_query(conn, "SELECT 1 FROM bot_conversations WHERE conversation_id = %s", (conversation_id,))
-            
-            if not res:
-                insert_query = """
-                    INSERT INTO bot_conversations (user_id, user_email, user_plan, chatbot_id, conversation_id, title, history, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s)
-                """
-                title = "GCS Realtime Session (Saved)"
-                run_write_query(conn, insert_query, (user_id, user_email, user_plan, chatbot_id, conversation_id, title, json.dumps(formatted_msgs), current_time, current_time))
-            else:
-                update_query = """
-                    UPDATE bot_conversations 
-                    SET history = COALESCE(history, '[]'::jsonb) || %s::jsonb, updated_at = %s
-                    WHERE conversation_id = %s
-                """
-                run_write_query(conn, update_query, (json.dumps(formatted_msgs), current_time, conversation_id))
-        
+        # Queued for the write-behind flusher; the conversation is created if /session did not (edge case)
+        create = {
+            "user_id": user_id, "user_email": user_email, "user_plan": user_plan,
+            "chatbot_id": chatbot_id, "title": "GCS Realtime Session (Saved)", "created_at": current_time,
+        }
+        if not save_messages(conversation_id, formatted_msgs, current_time, create=create):
+            raise Exception("Failed to save conversation messages")
+
         return {"message": "Conversation saved successfully"}
         
     except Exception as e:
@@ -510,7 +490,8 @@ async def gcs_submit_realtime_lead(request: RealtimeLeadRequest):
         if not email:
             return {"status": "partial", "message": "Details received. Please ask for Email to complete the record."}
         
-        success = save_customer(chatbot_id, email, custom_data)
+        config = await get_chatbot_config_async(chatbot_id)
+        success = save_customer(chatbot_id, email, custom_data, context=config)
         
         if success:
             return {"status": "success", "message": "Lead saved/updated"}
@@ -531,9 +512,9 @@ async def gcs_search_knowledge_base_endpoint(request: RealtimeSearchRequest):
     """
     try:
         # Embed query using OpenAI embeddings (shared)
-        query_vector = embedding_service.embed_text(request.query)
+        query_vector = await embedding_service.embed_query_async(request.query)
         
-        results = await asyncio.to_thread(search_vectors, request.chatbot_id, query_vector, limit=5)
+        results = await asyncio.to_thread(search_vectors, request.chatbot_id, query_vector, limit=5, query_text=request.query)
         
         if results:
             content = "\n\n".join([f"[CHUNK]: {r['content']}" for r in results])
@@ -562,6 +543,8 @@ async def gcs_handoff_support_endpoint(request: RealtimeHandoffRequest):
         if not email:
             return {"result": "Email required for handoff."}
         
+        config = await get_chatbot_config_async(chatbot_id)
+
         # 1. Update/Save Customer
         if name or phone:
             c_data = {
@@ -570,7 +553,7 @@ async def gcs_handoff_support_endpoint(request: RealtimeHandoffRequest):
                 "source": "gcs_voice_chatbot",
                 "chatbot_id": chatbot_id
             }
-            save_customer(chatbot_id, email, c_data)
+            save_customer(chatbot_id, email, c_data, context=config)
         
         # 2. Check Urgency
         if urgency == 'immediate':
@@ -587,8 +570,7 @@ async def gcs_handoff_support_endpoint(request: RealtimeHandoffRequest):
             return {"result": "Immediate callback requested. Our team has been notified!"}
         
         # 3. Move to Pipeline
-        with get_db_connection() as conn:
-            success = move_customer_to_pipeline(chatbot_id, email, conn)
+        success = move_customer_to_pipeline(chatbot_id, email, context=config)
         
         if success:
             return {"result": "Customer moved to priority support pipeline."}
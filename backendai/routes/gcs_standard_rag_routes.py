@@ -12,7 +12,7 @@ the OpenAI-based /standard/chat endpoint.
 """
 
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from utils.sse import EventStreamResponse
 from pydantic import BaseModel
 from typing import Optional
 import logging
@@ -66,7 +66,8 @@ async def gcs_chat_standard(request: ChatRequest):
     
     logging.info(f"[GCS] Chat request for chatbot: {request.chatbot_id}")
     
-    return StreamingResponse(
+    # Closes the generator on client disconnect (stops the Gemini stream, saves the partial answer)
+    return EventStreamResponse(
         gcs_standard_rag_controller.chat_stream(
             request.chatbot_id,
             request.user_id,
@@ -75,12 +76,6 @@ async def gcs_chat_standard(request: ChatRequest):
             request.user_email,
             request.user_plan
         ),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        }
     )
 
 
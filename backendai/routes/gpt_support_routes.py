@@ -8,10 +8,12 @@ from controller.gpt_support import (
     get_chat_history, get_conversation_by_user_id
 )
 from services.voice_service import generate_openai_ephemeral_session
-from fastapi.responses import StreamingResponse
+from utils.sse import EventStreamResponse
 
 import asyncio, uuid, json, logging
+from contextlib import aclosing
 from controller.free_copilot_controller import FreePlanCopilotController
+from utils.tokenizer import count_tokens
 # assuming your original imports are already here
 
 router = APIRouter()
@@ -66,8 +68,8 @@ async def start_chat(request: ChatRequest):
         raise HTTPException(status_code=400, detail="User ID and/or User Plan not provided")
 
 def estimate_tokens(text: str) -> int:
-    # Rough approximation: 1 token ≈ 0.75 words
-    return round(len(text.split()) / 0.75)
+    # Shared tokenizer (utils/tokenizer.py)
+    return count_tokens(text)
 
 @router.post("/chat")
 async def chat_assistant(request: ChatRequest):
@@ -90,39 +92,37 @@ async def chat_assistant(request: ChatRequest):
         # FREE PLAN CHATBOT HANDLING
         if isFreePlan:
             async def generate():
+                # aclosing: on client disconnect the Gemini stream is closed right away
+                stream = free_copilot.generate_streaming_response(
+                    session_id=session_id,
+                    chatbot_id=chatbot_id,
+                    prompt=prompt
+                )
                 try:
-                    async for chunk in free_copilot.generate_streaming_response(
-                        session_id=session_id,
-                        chatbot_id=chatbot_id,
-                        prompt=prompt
-                    ):
-                        data_str = chunk.replace("data: ", "").strip()
-                        try:
-                            data = json.loads(data_str)
-                            token = data.get("token")
-                            if token:
-                                final_response_holder["response_text"] += token
-                        except:
-                            pass
-
-                        if '"event": "end"' in chunk:
-                            response_ready.set()
-
-                        yield chunk
-                        await asyncio.sleep(0)
+                    async with aclosing(stream):
+                        async for chunk in stream:
+                            data_str = chunk.replace("data: ", "").strip()
+                            try:
+                                data = json.loads(data_str)
+                                token = data.get("token")
+                                if token:
+                                    final_response_holder["response_text"] += token
+                            except:
+                                pass
+
+                            if '"event": "end"' in chunk:
+                                response_ready.set()
+
+                            yield chunk
                 except Exception as e:
                     yield f"data: {json.dumps({'error': str(e), 'done': True})}\n\n"
                     response_ready.set()
 
-            response = StreamingResponse(
+            response = EventStreamResponse(
                 generate(),
-                media_type="text/event-stream",
                 headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
                     "Access-Control-Allow-Origin": "*",
                     "Access-Control-Allow-Headers": "*",
-                    "X-Accel-Buffering": "no",
                 },
             )
 
@@ -159,7 +159,9 @@ async def chat_assistant(request: ChatRequest):
                 limit_exceed = chat_count >= chat_limit or token_count >= token_limit
 
             async def event_generator():
-                async for chunk in chat_support(
+                # aclosing: on client disconnect chat_support is closed right away
+                # (cancels the run, saves the partial answer)
+                stream = chat_support(
                     user_input=prompt,
                     user_id=user_id,
                     user_email=user_email,
@@ -168,21 +170,18 @@ async def chat_assistant(request: ChatRequest):
                     limit_exceed=limit_exceed,
                     final_response_holder=final_response_holder,
                     user_plan=currentPlan,
-                ):
-                    if '"event": "complete"' in chunk:
-                        response_ready.set()
-                    yield chunk
-                    await asyncio.sleep(0)
-
-            response = StreamingResponse(
-                event_generator(),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "X-Accel-Buffering": "no",
-                },
-            )
+                )
+                try:
+                    async with aclosing(stream):
+                        async for chunk in stream:
+                            if '"event": "complete"' in chunk:
+                                response_ready.set()
+                            yield chunk
+                finally:
+                    # Abandoned streams are counted too (finalize_counts would wait forever otherwise)
+                    response_ready.set()
+
+            response = EventStreamResponse(event_generator())
 
 
             # UPDATE CHAT/TOKEN COUNTS IN POSTGRES
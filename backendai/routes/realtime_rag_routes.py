@@ -8,9 +8,12 @@ import logging
 import uuid
 from datetime import datetime, timezone
 import asyncio
-from DB.postgresDB import get_db_connection, run_query, run_write_query, get_pre_chat_form, get_customer_by_email, search_vectors, move_customer_to_pipeline, save_customer
-from services.openai_services import client
-from controller.standard_rag_controller import standard_rag_controller
+from DB.postgresDB import get_db_connection, get_pre_chat_form, get_customer_by_email, search_vectors, move_customer_to_pipeline, save_customer
+from DB.async_pool import execute
+from DB.conversation_store import fetch_prompt_history
+from DB.transcript_buffer import save_messages, with_pending
+from controller.conversation_summary import maybe_compact, summary_instruction
+from DB.config_cache import get_chatbot_config_async
 from services.embedding_service import embedding_service
 from resources.industry_prompts import INDUSTRY_PROMPTS
 
@@ -47,64 +50,46 @@ async def generate_realtime_session(request: RealtimeSessionRequest):
         system_instruction = ""
         history_text = ""
         
-        with get_db_connection() as conn:
-            # A. Manage Conversation ID & Persistence
-            is_new = False
-            if not conversation_id or conversation_id == "NEW_CHAT":
-                conversation_id = str(uuid.uuid4())
+        # A. Manage Conversation ID & Persistence
+        is_new = False
+        if not conversation_id or conversation_id == "NEW_CHAT":
+            conversation_id = str(uuid.uuid4())
+            is_new = True
+            recent, summary = None, None
+        else:
+            # Existence check, summary and the last 20 messages after it (audio context) in one round-trip
+            prompt_history = await fetch_prompt_history(conversation_id, 20)
+            if prompt_history is None:
                 is_new = True
+                recent, summary = None, None
             else:
-                 # Check if exists
-                 res = run_query(conn, "SELECT 1 FROM bot_conversations WHERE conversation_id = %s", (conversation_id,))
-                 if not res:
-                     is_new = True
-            
-            current_time = datetime.now(timezone.utc)
-            if is_new:
-                 insert_query = """
-                    INSERT INTO bot_conversations (user_id, user_email, user_plan, chatbot_id, conversation_id, title, history, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s)
-                 """
-                 run_write_query(conn, insert_query, (user_id, user_email, user_plan, chatbot_id, conversation_id, "Realtime Session", '[]', current_time, current_time))
-            else:
-                 # B. Fetch History
-                 hist_query = "SELECT history FROM bot_conversations WHERE conversation_id = %s"
-                 rows = run_query(conn, hist_query, (conversation_id,))
-                 if rows and rows[0][0]:
-                     import json
-                     raw = rows[0][0]
-                     history_list = raw if isinstance(raw, list) else json.loads(raw)
-                     # Limit to last 20 messages for audio context
-                     recent = history_list[-20:] if len(history_list) > 20 else history_list
-                     
-                     history_text = "\n\nPrevious Conversation History:\n"
-                     for msg in recent:
-                         role = msg.get("role", "user")
-                         text = msg.get("text", "")
-                         history_text += f"{role.title()}: {text}\n"
-
-        # C. Get Knowledge Base Content - REMOVED for Optimization
-        # stored_knowledge = await standard_rag_controller.get_stored_knowledge(chatbot_id) 
-        
-        # C.2 Get Organization Type & Industry Prompt (Parity with Standard RAG)
-        org_type = "Default"
+                summary, _, recent = prompt_history
+                recent = with_pending(conversation_id, recent, 20)
+                maybe_compact(conversation_id, recent)
+
+        current_time = datetime.now(timezone.utc)
+        if is_new:
+            insert_query = """
+                INSERT INTO bot_conversations (user_id, user_email, user_plan, chatbot_id, conversation_id, title, history, created_at, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s)
+            """
+            await execute(insert_query, (user_id, user_email, user_plan, chatbot_id, conversation_id, "Realtime Session", '[]', current_time, current_time))
+        elif recent or summary:
+            # B. Fetch History (summary of older turns + recent messages)
+            history_text = summary_instruction(summary) + "\n\nPrevious Conversation History:\n"
+            for msg in recent:
+                role = msg.get("role", "user")
+                text = msg.get("text", "")
+                history_text += f"{role.title()}: {text}\n"
+
+        # C. Get Organization Type & Industry Prompt (cached chatbot config)
+        config = None
         try:
-             # Use existing connection or new one? We have 'conn' from depends if we want, or make new.
-             # controller/standard_rag_controller.py uses a static method query on 'chatbots'.
-             # Let's do a quick query here.
-             with get_db_connection() as type_conn:
-                 type_query = """
-                    SELECT o.organization_type 
-                    FROM organizations o
-                    JOIN chatbots c ON o.id = c.organization_id
-                    WHERE c.chatbot_id = %s
-                 """
-                 type_res = run_query(type_conn, type_query, (chatbot_id,))
-                 if type_res and type_res[0]:
-                     org_type = type_res[0][0] or "Default"
+            config = await get_chatbot_config_async(chatbot_id)
         except Exception as e:
-             logging.error(f"Error fetching org type: {e}")
-             
+            logging.error(f"Error fetching org type: {e}")
+        
+        org_type = config.organization_type if config else "Default"
         industry_instruction = INDUSTRY_PROMPTS.get(org_type, INDUSTRY_PROMPTS["Default"])
 
         # Base System Instruction
@@ -127,7 +112,7 @@ async def generate_realtime_session(request: RealtimeSessionRequest):
         is_returning_user = False
         
         if user_email and user_email != "guest@example.com" and "guest@" not in user_email:
-            customer_data = get_customer_by_email(chatbot_id, user_email, conn)
+            customer_data = get_customer_by_email(chatbot_id, user_email, context=config)
             if customer_data:
                  is_returning_user = True
         
@@ -205,7 +190,7 @@ async def generate_realtime_session(request: RealtimeSessionRequest):
             
         else:
              # NEW USER Logic -> Add Form Collection
-             form_config = get_pre_chat_form(chatbot_id, conn)
+             form_config = config.pre_chat_form if config else get_pre_chat_form(chatbot_id)
         
              # Default Tool: Search
              tools = [{
@@ -403,7 +388,6 @@ async def save_realtime_conversation(request: RealtimeSaveRequest):
          return {"message": "No data to save"}
 
     try:
-        import json
         
         current_time = datetime.now(timezone.utc)
         
@@ -416,27 +400,14 @@ async def save_realtime_conversation(request: RealtimeSaveRequest):
                 "timestamp": current_time.isoformat()
             })
 
-        with get_db_connection() as conn:
-             # Check if conversation exists (it should, from /session)
-             res = run_query(conn, "SELECT 1 FROM bot_conversations WHERE conversation_id = %s", (conversation_id,))
-             
-             if not res:
-                  # If missing (edge case), create it
-                  insert_query = """
-                    INSERT INTO bot_conversations (user_id, user_email, user_plan, chatbot_id, conversation_id, title, history, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s)
-                 """
-                  title = "Realtime Session (Saved)"
-                  run_write_query(conn, insert_query, (user_id, user_email, user_plan, chatbot_id, conversation_id, title, json.dumps(formatted_msgs), current_time, current_time))
-             else:
-                  # Update History
-                  update_query = """
-                    UPDATE bot_conversations 
-                    SET history = COALESCE(history, '[]'::jsonb) || %s::jsonb, updated_at = %s
-                    WHERE conversation_id = %s
-                  """
-                  run_write_query(conn, update_query, (json.dumps(formatted_msgs), current_time, conversation_id))
-                  
+        # Queued for the write-behind flusher; the conversation is created if /session did not (edge case)
+        create = {
+            "user_id": user_id, "user_email": user_email, "user_plan": user_plan,
+            "chatbot_id": chatbot_id, "title": "Realtime Session (Saved)", "created_at": current_time,
+        }
+        if not save_messages(conversation_id, formatted_msgs, current_time, create=create):
+            raise Exception("Failed to save conversation messages")
+
         return {"message": "Conversation saved successfully"}
 
     except Exception as e:
@@ -456,7 +427,6 @@ async def submit_realtime_lead(request: RealtimeLeadRequest):
     Saves the lead details to the customers table.
     """
     try:
-        import json
         
         chatbot_id = request.chatbot_id
         email = request.email
@@ -478,7 +448,8 @@ async def submit_realtime_lead(request: RealtimeLeadRequest):
              return {"status": "partial", "message": "Details received. Please ask for Email to complete the record."}
 
         # Use shared helper
-        success = save_customer(chatbot_id, email, custom_data)
+        config = await get_chatbot_config_async(chatbot_id)
+        success = save_customer(chatbot_id, email, custom_data, context=config)
         
         if success:
              return {"status": "success", "message": "Lead saved/updated"}
@@ -503,10 +474,10 @@ async def search_knowledge_base_endpoint(request: RealtimeSearchRequest):
     try:
         # Search
         # Embed query first
-        query_vector = embedding_service.embed_text(request.query)
+        query_vector = await embedding_service.embed_query_async(request.query)
         
         # Run in thread since DB ops are blocking if not async specific
-        results = await asyncio.to_thread(search_vectors, request.chatbot_id, query_vector, limit=5)
+        results = await asyncio.to_thread(search_vectors, request.chatbot_id, query_vector, limit=5, query_text=request.query)
         
         if results:
             # Format for the AI
@@ -545,6 +516,8 @@ async def handoff_support_endpoint(request: RealtimeHandoffRequest):
         if not email:
              return {"result": "Email required for handoff."}
              
+        config = await get_chatbot_config_async(chatbot_id)
+
         # 1. Update/Save Customer
         if name or phone:
             c_data = {
@@ -554,7 +527,7 @@ async def handoff_support_endpoint(request: RealtimeHandoffRequest):
                 "chatbot_id": chatbot_id
             }
             # Use save_customer imported helper
-            save_customer(chatbot_id, email, c_data)
+            save_customer(chatbot_id, email, c_data, context=config)
 
         # 2. Check Urgency
         if urgency == 'immediate':
@@ -571,8 +544,7 @@ async def handoff_support_endpoint(request: RealtimeHandoffRequest):
              return {"result": "Immediate callback requested. Our team has been notified!"}
 
         # 3. Move to Pipeline
-        with get_db_connection() as conn:
-             success = move_customer_to_pipeline(chatbot_id, email, conn)
+        success = move_customer_to_pipeline(chatbot_id, email, context=config)
              
         if success:
              return {"result": "Customer moved to priority support pipeline."}
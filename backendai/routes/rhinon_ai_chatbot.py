@@ -1,16 +1,14 @@
-import asyncio
-from datetime import datetime, timezone
 import json
 import logging
 import os
 import time
 
-from fastapi import APIRouter, FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, FastAPI, HTTPException
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from DB.postgresDB import postgres_connection, run_query, run_write_query
+from DB.postgresDB import get_db_connection, run_query
+from DB.async_pool import fetch_all, execute
 from controller.chatbot_config import pdf_data, doc_data, txt_data, ppt_data, image_data,get_url_data
 from services.openai_services import client
  
@@ -30,15 +28,14 @@ org_thread_map = {}
 # Load existing assistants from database on startup
 def load_existing_assistants():
     try:
-        conn = postgres_connection()
-        if conn:
-            result = run_query(conn, "SELECT chatbot_id, assistant_id FROM bot_assistants", ())
-            if result:
-                for row in result:
-                    chatbot_id, assistant_id = row
-                    org_assistant_map[chatbot_id] = assistant_id
-                logging.info(f"Loaded {len(result)} assistants from database")
-            conn.close()
+        with get_db_connection() as conn:
+            if conn:
+                result = run_query(conn, "SELECT chatbot_id, assistant_id FROM bot_assistants", ())
+                if result:
+                    for row in result:
+                        chatbot_id, assistant_id = row
+                        org_assistant_map[chatbot_id] = assistant_id
+                    logging.info(f"Loaded {len(result)} assistants from database")
     except Exception as e:
         logging.error(f"Error loading assistants: {e}")
 
@@ -132,11 +129,6 @@ async def set_assistant(payload: AssistantRequest):
     try:
         chatbot_id = payload.chatbot_id
 
-        # Connect to Postgres
-        connection = await asyncio.to_thread(postgres_connection)
-        if not connection:
-            raise HTTPException(status_code=500, detail="Database connection failed")
-
         # Fetch chatbot’s training data
         query = """
         SELECT a.training_url, a.training_pdf, a.training_article
@@ -144,7 +136,7 @@ async def set_assistant(payload: AssistantRequest):
         JOIN chatbots c ON a.organization_id = c.organization_id
         WHERE c.chatbot_id = %s;
         """
-        result = await asyncio.to_thread(run_query, connection, query, (chatbot_id,))
+        result = await fetch_all(query, (chatbot_id,))
         if not result:
             raise HTTPException(status_code=404, detail="No chatbot data found")
 
@@ -173,14 +165,11 @@ async def set_assistant(payload: AssistantRequest):
         """
 
 
-        conn = postgres_connection()
-        success = run_write_query( conn, upsert_query, (chatbot_id, assistant_id))
+        success = await execute(upsert_query, (chatbot_id, assistant_id))
 
         if not success:
             raise HTTPException(status_code=500, detail="Failed to write assistant to database")
 
-        connection.close()
-
         return {
             "message": "Assistant created/updated successfully",
             "assistant_id": assistant_id,
@@ -1,9 +1,8 @@
-from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException
+from utils.sse import EventStreamResponse
 from pydantic import BaseModel
 from typing import Optional
 import logging
-import json
 import asyncio
 
 from controller.standard_rag_controller import standard_rag_controller
@@ -100,6 +99,48 @@ async def delete_source(request: DeleteSourceRequest):
         logging.error(f"Error deleting source: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+class RetrievalModeRequest(BaseModel):
+    chatbot_id: str
+    retrieval_mode: str  # 'vector' or 'hybrid'
+
+@router.post("/api/retrieval_mode")
+async def set_retrieval_mode(request: RetrievalModeRequest):
+    """
+    Switches a chatbot between pure vector and hybrid (keyword + vector) retrieval
+    """
+    from DB.postgresDB import set_retrieval_mode as save_retrieval_mode, RETRIEVAL_MODES
+
+    if request.retrieval_mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval_mode must be one of {list(RETRIEVAL_MODES)}")
+
+    try:
+        success = await asyncio.to_thread(save_retrieval_mode, request.chatbot_id, request.retrieval_mode)
+        if not success:
+            raise HTTPException(status_code=500, detail="Failed to save retrieval mode")
+        return {"status": "success", "chatbot_id": request.chatbot_id, "retrieval_mode": request.retrieval_mode}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error setting retrieval mode: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+class ConfigInvalidateRequest(BaseModel):
+    chatbot_id: Optional[str] = None
+    organization_id: Optional[int] = None
+
+@router.post("/api/chatbot_config/invalidate")
+async def invalidate_chatbot_config(request: ConfigInvalidateRequest):
+    """
+    Drops cached chatbot configuration (org type, pre-chat form) after rtserver edits a form or org setting.
+    Without chatbot_id, every chatbot of the organization (or all, if neither is given) is reloaded.
+    """
+    from DB.config_cache import invalidate_chatbot_config as invalidate, notify_config_change
+
+    invalidate(request.chatbot_id, request.organization_id)
+    # Reach the other workers through NOTIFY (see DB/config_cache.py)
+    notified = await asyncio.to_thread(notify_config_change, request.chatbot_id, request.organization_id)
+    return {"status": "success", "broadcast": notified}
+
 @router.post("/standard/chat")
 async def chat_standard(request: ChatRequest):
     """
@@ -116,12 +157,7 @@ async def chat_standard(request: ChatRequest):
     if not chatbot_id or not prompt:
          raise HTTPException(status_code=400, detail="chatbot_id and prompt are required")
 
-    return StreamingResponse(
+    # Closes the generator on client disconnect (stops the OpenAI stream, saves the partial answer)
+    return EventStreamResponse(
         standard_rag_controller.chat_stream(chatbot_id, user_id, prompt, conversation_id, user_email, user_plan), # Pass plan
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        }
     )
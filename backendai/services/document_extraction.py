@@ -0,0 +1,307 @@
+"""
+Document text extraction in a process pool.
+
+PDF, Word and PowerPoint files used to be downloaded into a BytesIO and
+parsed with PyPDF2 / python-docx / python-pptx on the calling thread: a
+large PDF pinned a CPU for minutes and held the GIL against the event loop
+and every other thread of the process. Now:
+
+- downloads are streamed to a temporary file (at most EXTRACT_MAX_FILE_MB)
+- parsing runs in a ProcessPoolExecutor of EXTRACT_WORKERS processes; PDFs
+  are split into batches of EXTRACT_PAGE_BATCH pages parsed in parallel
+- every file has EXTRACT_TIMEOUT seconds (enforced inside the worker with
+  an alarm, so a stuck parser frees its process) and each worker process
+  is capped at EXTRACT_MEMORY_MB of address space (Linux)
+- page text is yielded batch by batch, in order, as it becomes available
+
+A worker killed by the OS (e.g. out of memory) breaks the whole pool, and
+with it every file being extracted at that moment. The pool is replaced,
+and each of those files is retried once in a private single-process pool,
+so only a file that kills its worker again fails.
+
+Only the OOXML formats are supported: python-docx / python-pptx cannot read
+legacy binary .doc / .ppt files, which callers report as unsupported.
+
+Worker processes are spawned, and spawning re-imports the parent's __main__
+module in each of them: entry scripts that use the pool (training_worker.py,
+benchmarks/) must not import the DB / controller modules at their top level,
+or every worker would open database pools and API clients. The API, started
+with the uvicorn CLI, is not affected.
+
+Usage:
+    text = await extract_document_text(response, ".pdf")     # async callers, pages separated by PAGE_BREAK
+    for text in iter_document_pages(path, ".pdf"): ...       # threads / scripts
+"""
+
+import os
+import time
+import signal
+import asyncio
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils import metrics
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "300"))
+EXTRACT_MEMORY_MB = int(os.getenv("EXTRACT_MEMORY_MB", "1024"))
+EXTRACT_MAX_FILE_MB = int(os.getenv("EXTRACT_MAX_FILE_MB", "200"))
+EXTRACT_PAGE_BATCH = int(os.getenv("EXTRACT_PAGE_BATCH", "20"))
+
+DOCUMENT_TYPES = ['.pdf', '.docx', '.pptx']
+
+# Separates pages / slides in extracted text so the cleaner can find running
+# headers, footers and page numbers (utils/text_cleaner.py)
+PAGE_BREAK = "\x0c"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# ---- worker process side ---------------------------------------------------
+
+def _init_worker(memory_mb: int):
+    try:
+        import resource
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:  # not available on every platform
+        logging.warning(f"Could not cap extraction worker memory: {e}")
+
+
+def _on_alarm(signum, frame):
+    raise TimeoutError("Document extraction timed out")
+
+
+class _Deadline:
+    """Raises TimeoutError in the worker when the file's deadline passes."""
+
+    def __init__(self, deadline: float):
+        self.remaining = deadline - time.time()
+
+    def __enter__(self):
+        if self.remaining <= 0:
+            raise TimeoutError("Document extraction timed out")
+        if hasattr(signal, "setitimer"):
+            signal.signal(signal.SIGALRM, _on_alarm)
+            # Repeats every second: parsers swallow some exceptions (PyPDF2 logs and carries on)
+            signal.setitimer(signal.ITIMER_REAL, self.remaining, 1.0)
+
+    def __exit__(self, *exc):
+        if hasattr(signal, "setitimer"):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _pdf_page_count(path: str, deadline: float) -> int:
+    import PyPDF2
+    with _Deadline(deadline):
+        return len(PyPDF2.PdfReader(path).pages)
+
+
+def _pdf_pages(path: str, start: int, stop: int, deadline: float) -> list:
+    import PyPDF2
+    with _Deadline(deadline):
+        reader = PyPDF2.PdfReader(path)
+        return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _docx_text(path: str, deadline: float) -> list:
+    import docx
+    with _Deadline(deadline):
+        return ["\n".join(para.text for para in docx.Document(path).paragraphs)]
+
+
+def _pptx_slides(path: str, deadline: float) -> list:
+    from pptx import Presentation
+    with _Deadline(deadline):
+        return [
+            "".join(shape.text + "\n" for shape in slide.shapes if hasattr(shape, "text"))
+            for slide in Presentation(path).slides
+        ]
+
+
+# ---- caller side -----------------------------------------------------------
+
+def _new_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn: forking a process that runs an event loop and DB pool threads is unsafe
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(EXTRACT_MEMORY_MB,),
+    )
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = _new_pool(EXTRACT_WORKERS)
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is not broken:
+            return  # already replaced by another caller
+        _pool = None
+    broken.shutdown(wait=False)  # its futures are failed by the pool itself (see _pages)
+    metrics.increment("extraction.pool_restarts")
+
+
+def shutdown_extraction_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit_parts(pool, path: str, ext: str, deadline: float, page_count: int = 0) -> list:
+    """Futures of the document's parts in order; each resolves to a list of page/slide texts."""
+    if ext == '.pdf':
+        return [
+            pool.submit(_pdf_pages, path, start, min(start + EXTRACT_PAGE_BATCH, page_count), deadline)
+            for start in range(0, page_count, EXTRACT_PAGE_BATCH)
+        ]
+    if ext == '.docx':
+        return [pool.submit(_docx_text, path, deadline)]
+    if ext == '.pptx':
+        return [pool.submit(_pptx_slides, path, deadline)]
+    raise ValueError(f"Unsupported document type: {ext}")
+
+
+# A broken pool's manager thread fails all its futures; cancelling them at the same
+# time makes it die with InvalidStateError (CPython 3.11), hanging the other callers
+def _pages(pool, path: str, ext: str, deadline: float):
+    futures = []
+    try:
+        page_count = pool.submit(_pdf_page_count, path, deadline).result(max(deadline - time.time(), 0)) if ext == '.pdf' else 0
+        futures = _submit_parts(pool, path, ext, deadline, page_count)
+        for future in futures:
+            yield from future.result(max(deadline - time.time(), 0))
+    except BrokenProcessPool:
+        futures = []
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+async def _apages(pool, path: str, ext: str, deadline: float):
+    futures = []
+
+    async def result(future):
+        return await asyncio.wait_for(asyncio.wrap_future(future), max(deadline - time.time(), 0))
+
+    try:
+        page_count = await result(pool.submit(_pdf_page_count, path, deadline)) if ext == '.pdf' else 0
+        futures = _submit_parts(pool, path, ext, deadline, page_count)
+        for future in futures:
+            for text in await result(future):
+                yield text
+    except BrokenProcessPool:
+        futures = []  # see _pages
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def iter_document_pages(path: str, ext: str, timeout: float = EXTRACT_TIMEOUT):
+    """Yields the text of each page (PDF) / slide (PowerPoint) / document (Word) of a local file."""
+    deadline = time.time() + timeout
+    pool = _get_pool()
+    done = 0
+    try:
+        for text in _pages(pool, path, ext, deadline):
+            yield text
+            done += 1
+        return
+    except BrokenProcessPool:
+        _reset_pool(pool)
+
+    # Possibly another file's worker that died: retry alone, skipping the pages already yielded
+    metrics.increment("extraction.retries")
+    private = _new_pool(1)
+    try:
+        for i, text in enumerate(_pages(private, path, ext, deadline)):
+            if i >= done:
+                yield text
+    finally:
+        private.shutdown(wait=False, cancel_futures=True)
+
+
+async def aiter_document_pages(path: str, ext: str, timeout: float = EXTRACT_TIMEOUT):
+    """Async version of iter_document_pages; waits on the pool without blocking the event loop."""
+    deadline = time.time() + timeout
+    pool = _get_pool()
+    done = 0
+    try:
+        async for text in _apages(pool, path, ext, deadline):
+            yield text
+            done += 1
+        return
+    except BrokenProcessPool:
+        _reset_pool(pool)
+
+    metrics.increment("extraction.retries")
+    private = _new_pool(1)
+    try:
+        i = 0
+        async for text in _apages(private, path, ext, deadline):
+            if i >= done:
+                yield text
+            i += 1
+    finally:
+        private.shutdown(wait=False, cancel_futures=True)
+
+
+def download_to_tempfile(response, ext: str, max_mb: int = EXTRACT_MAX_FILE_MB) -> str:
+    """Streams a response body to a temporary file and returns its path (the caller deletes it)."""
+    max_bytes = max_mb * 1024 * 1024
+    size = 0
+    with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as f:
+        try:
+            for block in response.iter_content(chunk_size=1024 * 1024):
+                size += len(block)
+                if size > max_bytes:
+                    raise ValueError(f"File is larger than {max_mb} MB")
+                f.write(block)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+        finally:
+            response.close()
+    return f.name
+
+
+def extract_document_text_sync(response, ext: str) -> str:
+    """Downloads and extracts a document from a requests response; blocks the calling thread."""
+    path = download_to_tempfile(response, ext)
+    start = time.perf_counter()
+    try:
+        return PAGE_BREAK.join(iter_document_pages(path, ext))
+    finally:
+        os.unlink(path)
+        metrics.observe("extraction.document", time.perf_counter() - start)
+
+
+async def extract_document_text(response, ext: str) -> str:
+    """
+    Downloads and extracts a document from a requests response (ideally made with
+    stream=True). Raises TimeoutError past EXTRACT_TIMEOUT.
+    """
+    path = await asyncio.to_thread(download_to_tempfile, response, ext)
+    start = time.perf_counter()
+    try:
+        return PAGE_BREAK.join([text async for text in aiter_document_pages(path, ext)])
+    finally:
+        os.unlink(path)
+        metrics.observe("extraction.document", time.perf_counter() - start)
@@ -0,0 +1,83 @@
+"""
+Query embedding cache.
+
+Widget users repeat the same short questions constantly, so query vectors are
+cached by (model, normalized text) in two tiers:
+- an in-process LRU with TTL (always on)
+- a shared Redis tier (only when REDIS_URL is set)
+"""
+
+import os
+import array
+import hashlib
+import logging
+
+from utils import metrics
+from utils.redis_client import get_async_redis
+from utils.ttl_cache import TTLCache
+
+CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "5000"))
+CACHE_TTL = int(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "86400"))
+REDIS_PREFIX = "query_embedding:"
+
+
+def normalize_query(text: str) -> str:
+    """Case-folds and collapses whitespace so trivially different prompts share an entry."""
+    return " ".join(text.casefold().split())
+
+
+class QueryEmbeddingCache:
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: int = CACHE_TTL):
+        self.ttl = ttl
+        self._memory = TTLCache(maxsize, ttl)
+
+    @staticmethod
+    def _key(text: str, model: str) -> str:
+        return hashlib.sha1(f"{model}\x00{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    async def get(self, text: str, model: str):
+        """Returns the cached vector or None."""
+        key = self._key(text, model)
+
+        vector = self._memory.get(key)
+        if vector is not None:
+            metrics.increment("query_embedding_cache.hits")
+            return vector
+
+        redis = get_async_redis()
+        if redis:
+            try:
+                raw = await redis.get(REDIS_PREFIX + key)
+                if raw:
+                    vector = array.array("f", raw).tolist()
+                    self._memory.set(key, vector)
+                    metrics.increment("query_embedding_cache.hits")
+                    metrics.increment("query_embedding_cache.redis_hits")  # share of hits served by Redis
+                    return vector
+            except Exception as e:
+                logging.warning(f"Query embedding cache Redis read failed: {e}")
+
+        metrics.increment("query_embedding_cache.misses")
+        return None
+
+    async def set(self, text: str, model: str, vector: list):
+        if not vector:
+            return
+        key = self._key(text, model)
+        self._memory.set(key, vector)
+
+        redis = get_async_redis()
+        if redis:
+            try:
+                await redis.set(REDIS_PREFIX + key, array.array("f", vector).tobytes(), ex=self.ttl)
+            except Exception as e:
+                logging.warning(f"Query embedding cache Redis write failed: {e}")
+
+    def size(self) -> int:
+        return len(self._memory)
+
+
+# Global instance
+query_embedding_cache = QueryEmbeddingCache()
+metrics.register_gauge("query_embedding_cache.size", query_embedding_cache.size)
+metrics.register_gauge("query_embedding_cache.hit_rate", lambda: metrics.hit_rate("query_embedding_cache"))
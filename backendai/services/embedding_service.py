@@ -1,9 +1,24 @@
 from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
 import os
 import logging
 
+from services.openai_services import async_client
+from services.embedding_cache import query_embedding_cache
+
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# OpenAI embeddings limits: 2048 inputs and 300k tokens per request.
+# We stay under the token limit with a conservative estimate (~3 chars/token).
+MAX_BATCH_ITEMS = 2048
+MAX_BATCH_TOKENS = 250_000
+MAX_CONCURRENT_BATCHES = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 3 + 1
+
 class OpenAIEmbeddingService:
     _instance = None
     _client = None
@@ -20,17 +35,118 @@ class OpenAIEmbeddingService:
     def embed_text(self, text: str):
         if not text:
             return []
-        
+
         try:
             # text-embedding-3-small is cost effective and high performance (1536 dim)
             response = self._client.embeddings.create(
                 input=text,
-                model="text-embedding-3-small"
+                model=EMBEDDING_MODEL
             )
             return response.data[0].embedding
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             return []
 
+    async def embed_text_async(self, text: str):
+        """
+        Non-blocking embed_text for async code (chat and search entry points).
+        Uses the shared AsyncOpenAI client so connections are reused.
+        """
+        if not text:
+            return []
+
+        try:
+            response = await async_client.embeddings.create(
+                input=text,
+                model=EMBEDDING_MODEL
+            )
+            return response.data[0].embedding
+        except Exception as e:
+            logger.error(f"Error generating embedding: {e}")
+            return []
+
+    async def embed_query_async(self, text: str):
+        """
+        embed_text_async for user queries, served from the query embedding cache when possible.
+        """
+        if not text:
+            return []
+
+        vector = await query_embedding_cache.get(text, EMBEDDING_MODEL)
+        if vector is not None:
+            return vector
+
+        vector = await self.embed_text_async(text)
+        await query_embedding_cache.set(text, EMBEDDING_MODEL, vector)
+        return vector
+
+    def embed_batch(self, texts: list) -> list:
+        """
+        Embeds many texts with as few requests as possible.
+        Texts are packed into requests under the item/token limits and up to
+        MAX_CONCURRENT_BATCHES requests run at once.
+        Returns: list of vectors in input order. Failed or empty items are [].
+        """
+        if not texts:
+            return []
+
+        batches = self._pack_batches(texts)
+        vectors = [[] for _ in texts]
+
+        with ThreadPoolExecutor(max_workers=max(1, MAX_CONCURRENT_BATCHES)) as executor:
+            for embedded, errors in executor.map(lambda b: self._embed_indices(texts, b), batches):
+                for i, vector in embedded.items():
+                    vectors[i] = vector
+                for i, error in errors.items():
+                    logger.error(f"Error generating embedding for item {i}: {error}")
+
+        return vectors
+
+    @staticmethod
+    def _pack_batches(texts: list) -> list:
+        """
+        Groups input indices into request-sized batches. Empty texts are skipped.
+        """
+        batches = []
+        current = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            if not text:
+                continue
+            tokens = _estimate_tokens(text)
+            if current and (len(current) >= MAX_BATCH_ITEMS or current_tokens + tokens > MAX_BATCH_TOKENS):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_indices(self, texts: list, indices: list):
+        """
+        Embeds texts[indices] in one request.
+        On failure the batch is bisected so one bad input only fails itself.
+        Returns: Tuple(dict index -> vector, dict index -> error message)
+        """
+        try:
+            response = self._client.embeddings.create(
+                input=[texts[i] for i in indices],
+                model=EMBEDDING_MODEL
+            )
+            return {indices[d.index]: d.embedding for d in response.data}, {}
+        except Exception as e:
+            if len(indices) == 1:
+                return {}, {indices[0]: str(e)}
+
+            logger.warning(f"Embedding batch of {len(indices)} failed ({e}), retrying in halves")
+            mid = len(indices) // 2
+            left_vectors, left_errors = self._embed_indices(texts, indices[:mid])
+            right_vectors, right_errors = self._embed_indices(texts, indices[mid:])
+            left_vectors.update(right_vectors)
+            left_errors.update(right_errors)
+            return left_vectors, left_errors
+
 # Global instance
 embedding_service = OpenAIEmbeddingService()
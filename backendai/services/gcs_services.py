@@ -15,6 +15,7 @@ from typing import Optional, List, Dict, Any, AsyncGenerator
 import google.generativeai as genai
 from google.generativeai.types import FunctionDeclaration, Tool
 
+GEMINI_CHAT_MODEL = "gemini-2.5-flash"
 
 class GCSServices:
     """
@@ -111,7 +112,7 @@ class GCSServices:
         try:
             # Configure model with system instruction
             model = genai.GenerativeModel(
-                "gemini-2.5-flash",
+                GEMINI_CHAT_MODEL,
                 system_instruction=system_instruction
             )
             
@@ -1,15 +1,67 @@
 import os
+import logging
+import importlib.util
+from contextlib import asynccontextmanager
 
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
 
 
 # Load environment variables from .env file
-load_dotenv() 
+load_dotenv()
 
 # Now you can use the API key
 client = OpenAI(api_key = os.getenv("OPENAI_API_KEY"))
 
+# Connection pool of the async client. HTTP/2 multiplexes concurrent streams over a
+# few connections and needs the optional 'h2' package (pip install httpx[http2]).
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true"
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "200"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "50"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "120"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))
+
+if OPENAI_HTTP2 and importlib.util.find_spec("h2") is None:
+    logging.info("h2 not installed, OpenAI async client uses HTTP/1.1")
+    OPENAI_HTTP2 = False
+
+def _async_http_client():
+    return DefaultAsyncHttpxClient(
+        http2=OPENAI_HTTP2,
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    )
+
+# Shared async client for code running on the event loop (chat / search hot path).
+# One instance per process so its HTTP connection pool is reused across requests.
+async_client = AsyncOpenAI(api_key = os.getenv("OPENAI_API_KEY"), http_client=_async_http_client())
+
+@asynccontextmanager
+async def stream_chat_completion(**kwargs):
+    """
+    Streams a chat completion without blocking the event loop:
+        async with stream_chat_completion(model=..., messages=...) as stream:
+            async for chunk in stream: ...
+    The upstream response is closed when the block exits, including when the
+    SSE client disconnects and the request task is cancelled, so no tokens are
+    read (or billed) for nobody and the connection goes back to the pool.
+    """
+    stream = await async_client.chat.completions.create(stream=True, **kwargs)
+    try:
+        yield stream
+    finally:
+        await stream.close()
+
+async def close_async_client():
+    """Closes the shared async client's connections (FastAPI lifespan shutdown)."""
+    await async_client.close()
+
 def chat_completion(messages):
     response = client.chat.completions.create(
         model="gpt-3.5-turbo",
@@ -17,3 +69,4 @@ def chat_completion(messages):
         messages=messages
     )
     return response
+
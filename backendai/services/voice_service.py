@@ -3,7 +3,7 @@ import requests
 from fastapi import HTTPException
 from openai import OpenAI
 
-from DB.postgresDB import postgres_connection, run_query
+from DB.postgresDB import get_db_connection, run_query
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
@@ -11,10 +11,9 @@ client = OpenAI(api_key=OPENAI_API_KEY)
 
 
 async def get_assistant(chatbot_id):
-    conn = postgres_connection()
     query = "SELECT assistant_id FROM bot_assistants WHERE chatbot_id = %s;"
-    result = run_query(conn, query, (chatbot_id,))
-    conn.close()
+    with get_db_connection() as conn:
+        result = run_query(conn, query, (chatbot_id,))
     if result:
         return result[0][0]
     return None
@@ -0,0 +1,12 @@
+"""
+Shared setup for the unit tests. Run from backendai/: python -m pytest -q
+
+The tests cover the pure modules only (no database, OpenAI or webhook
+calls); the API key is a placeholder so importing the OpenAI clients works.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
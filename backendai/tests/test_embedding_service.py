@@ -0,0 +1,72 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from services import embedding_service as module
+from services.embedding_service import OpenAIEmbeddingService
+
+
+class FakeEmbeddings:
+    """Embeds each text as [len(text)]; a request containing a text with 'bad' fails."""
+
+    def __init__(self):
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def create(self, input, model):
+        with self._lock:
+            self.requests.append(list(input))
+        if any("bad" in text for text in input):
+            raise ValueError("invalid input")
+        # Returned out of order: results are matched by index
+        data = [SimpleNamespace(index=i, embedding=[len(text)]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+
+@pytest.fixture
+def service(monkeypatch):
+    embeddings = FakeEmbeddings()
+    service = OpenAIEmbeddingService()
+    monkeypatch.setattr(OpenAIEmbeddingService, "_client", SimpleNamespace(embeddings=embeddings))
+    service.fake = embeddings
+    return service
+
+
+def test_pack_batches_respects_item_limit(monkeypatch):
+    monkeypatch.setattr(module, "MAX_BATCH_ITEMS", 3)
+    assert OpenAIEmbeddingService._pack_batches(["a"] * 7) == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_pack_batches_respects_token_limit(monkeypatch):
+    monkeypatch.setattr(module, "MAX_BATCH_TOKENS", 10)
+    texts = ["x" * 12, "x" * 12, "x" * 3, "x" * 30]   # 5, 5, 2 and 11 estimated tokens
+    # An item over the limit on its own still gets a batch
+    assert OpenAIEmbeddingService._pack_batches(texts) == [[0, 1], [2], [3]]
+
+
+def test_pack_batches_skips_empty_texts():
+    assert OpenAIEmbeddingService._pack_batches(["", "a", None, "b"]) == [[1, 3]]
+
+
+def test_embed_batch_returns_vectors_in_input_order(service, monkeypatch):
+    monkeypatch.setattr(module, "MAX_BATCH_ITEMS", 2)
+    texts = ["a", "bb", "", "cccc", "ddddd"]
+    assert service.embed_batch(texts) == [[1], [2], [], [4], [5]]
+    assert sorted(service.fake.requests) == [["a", "bb"], ["cccc", "ddddd"]]
+    assert service.embed_batch([]) == []
+
+
+def test_failed_batch_is_bisected_down_to_the_bad_item(service):
+    texts = ["one", "two", "bad three", "four", "five", "six", "seven", "eight"]
+    vectors = service.embed_batch(texts)
+    assert vectors == [[3], [3], [], [4], [4], [3], [5], [5]]
+    # 8 -> 4 + 4 -> (2 + 2) -> (1 + 1): the good half is sent once, the bad item alone last
+    assert service.fake.requests[0] == texts
+    assert ["bad three"] in service.fake.requests
+    assert texts[4:] in service.fake.requests
+    assert len(service.fake.requests) == 7
+
+
+def test_every_item_failing(service):
+    assert service.embed_batch(["bad", "also bad"]) == [[], []]
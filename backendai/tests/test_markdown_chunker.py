@@ -0,0 +1,106 @@
+from utils.markdown_chunker import iter_markdown_chunks
+from utils.tokenizer import count_tokens
+
+
+def chunks(text, **kwargs):
+    return list(iter_markdown_chunks(text, **kwargs))
+
+
+def test_heading_path_is_tracked_and_prepended():
+    text = "# Pricing\n\nIntro.\n\n## Plans\n\nBasic and Pro.\n\n# Support\n\nEmail us."
+    result = chunks(text)
+    assert [c["heading_path"] for c in result] == [["Pricing"], ["Pricing", "Plans"], ["Support"]]
+    assert result[1]["content"] == "Pricing > Plans\n\nBasic and Pro."
+    assert result[2]["content"] == "Support\n\nEmail us."
+
+
+def test_chunk_never_crosses_a_heading():
+    result = chunks("# A\n\nfirst\n\n# B\n\nsecond")
+    assert len(result) == 2
+    assert "second" not in result[0]["content"]
+    assert "first" not in result[1]["content"]
+
+
+def test_text_without_headings():
+    result = chunks("Just a paragraph.\n\nAnd another.")
+    assert result == [{
+        "content": "Just a paragraph.\n\nAnd another.",
+        "heading_path": [],
+        "tokens": count_tokens("Just a paragraph.\n\nAnd another."),
+    }]
+
+
+def test_accepts_an_iterable_of_lines():
+    lines = ["# Title\n", "\n", "Body line\n"]
+    assert chunks(lines) == chunks("".join(lines))
+
+
+def test_chunks_respect_max_tokens():
+    paragraphs = [f"Paragraph {i} " + "word " * 30 for i in range(20)]
+    text = "# Doc\n\n" + "\n\n".join(paragraphs)
+    result = chunks(text, max_tokens=100, overlap_tokens=0)
+    assert len(result) > 1
+    assert all(c["tokens"] <= 100 for c in result)
+    for paragraph in paragraphs:
+        assert any(paragraph in c["content"] for c in result)
+
+
+def test_oversized_paragraph_is_split_on_sentences():
+    sentences = [f"Sentence number {i} has a few words in it." for i in range(40)]
+    result = chunks(" ".join(sentences), max_tokens=60, overlap_tokens=0)
+    assert len(result) > 1
+    assert all(c["tokens"] <= 60 for c in result)
+    # No sentence is cut in half
+    for sentence in sentences:
+        assert any(sentence in c["content"] for c in result)
+
+
+def test_oversized_table_repeats_its_header():
+    header = "| Name | Price |\n|---|---|"
+    rows = [f"| Product {i} | {i * 10} USD |" for i in range(60)]
+    result = chunks("# Prices\n\n" + header + "\n" + "\n".join(rows), max_tokens=80, overlap_tokens=0)
+    assert len(result) > 1
+    for chunk in result:
+        assert chunk["content"].startswith("Prices\n\n" + header + "\n")
+        assert chunk["tokens"] <= 80
+    for row in rows:
+        assert sum(row in c["content"] for c in result) == 1
+
+
+def test_code_block_is_kept_whole_and_split_by_lines():
+    code = ["```python"] + [f"value_{i} = compute({i})" for i in range(50)] + ["```"]
+    result = chunks("\n".join(code), max_tokens=60, overlap_tokens=0)
+    assert len(result) > 1
+    for chunk in result:
+        assert chunk["content"].startswith("```\n") and chunk["content"].endswith("\n```")
+    for line in code[1:-1]:
+        assert sum(line in c["content"] for c in result) == 1
+
+
+def test_fenced_code_is_not_parsed_as_headings():
+    result = chunks("# Setup\n\n```\n# not a heading\n```")
+    assert len(result) == 1
+    assert result[0]["heading_path"] == ["Setup"]
+    assert "# not a heading" in result[0]["content"]
+
+
+def test_small_previous_block_is_carried_over_as_overlap():
+    first, second, third = (" ".join([word] * 30) for word in ("alpha", "beta", "gamma"))
+    size = count_tokens(first)
+    # Room for two blocks (plus the 2 tokens reserved for the breadcrumb separator)
+    result = chunks("\n\n".join([first, second, third]), max_tokens=2 * size + 2, overlap_tokens=size)
+    assert len(result) == 2
+    assert second in result[0]["content"] and second in result[1]["content"]
+    assert third in result[1]["content"]
+
+
+def test_no_overlap_when_previous_block_is_too_big():
+    first, second = (" ".join([word] * 30) for word in ("alpha", "beta"))
+    size = count_tokens(first)
+    result = chunks("\n\n".join([first, second]), max_tokens=size + 3, overlap_tokens=size - 1)
+    assert [c["content"] for c in result] == [first, second]
+
+
+def test_empty_text():
+    assert chunks("") == []
+    assert chunks("\n\n   \n") == []
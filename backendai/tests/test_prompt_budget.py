@@ -0,0 +1,111 @@
+from utils.prompt_budget import (
+    DEFAULT_CONTEXT_TOKENS, KNOWLEDGE_PLACEHOLDER, MIN_TRUNCATED_TOKENS, NO_KNOWLEDGE_TEXT,
+    PROMPT_MAX_TOKENS, assemble_prompt, context_window, prompt_budget,
+)
+from utils.tokenizer import count_tokens
+
+MODEL = "gpt-4o-mini"
+
+
+def words(word, n):
+    return " ".join([word] * n)
+
+
+def test_context_window_matches_longest_prefix():
+    assert context_window("gpt-4o-mini-2024-07-18") == 128000
+    assert context_window("gpt-4-0613") == 8192
+    assert context_window("unknown-model") == DEFAULT_CONTEXT_TOKENS
+    assert context_window(None) == DEFAULT_CONTEXT_TOKENS
+
+
+def test_prompt_budget_is_capped():
+    assert prompt_budget("gpt-4", 1024) == min(8192 - 1024, PROMPT_MAX_TOKENS)
+    assert prompt_budget("gpt-4.1", 1024) == PROMPT_MAX_TOKENS
+
+
+def test_placeholder_is_replaced_by_chunks():
+    result = assemble_prompt(MODEL, f"Before {KNOWLEDGE_PLACEHOLDER} after", "hi", chunks=["one", "two"])
+    assert result.system_prompt == "Before [CHUNK]: one\n\n[CHUNK]: two after"
+    assert result.dropped == {} and result.truncated == []
+    assert result.tokens == sum(result.sections.values())
+
+
+def test_knowledge_is_appended_without_placeholder():
+    result = assemble_prompt(MODEL, "Be helpful.", "hi", chunks=["one"])
+    assert result.system_prompt == "Be helpful.\n\n[CHUNK]: one"
+
+
+def test_no_chunks_uses_fallback_text():
+    result = assemble_prompt(MODEL, KNOWLEDGE_PLACEHOLDER, "hi")
+    assert result.system_prompt == NO_KNOWLEDGE_TEXT
+
+
+def test_lower_ranked_chunks_are_dropped_first():
+    chunks = [words("best", 40), words("second", 40), words("third", 40)]
+    fixed = assemble_prompt(MODEL, KNOWLEDGE_PLACEHOLDER, "hi", budget=10_000).sections
+    chunk_tokens = count_tokens(f"[CHUNK]: {chunks[0]}") + 2
+    budget = fixed["persona"] + fixed["prompt"] + chunk_tokens + 1
+    result = assemble_prompt(MODEL, KNOWLEDGE_PLACEHOLDER, "hi", chunks=chunks, budget=budget)
+    assert chunks[0] in result.system_prompt
+    assert chunks[1] not in result.system_prompt
+    assert result.dropped == {"chunks": 2}
+    assert result.tokens <= budget
+
+
+def test_best_chunk_is_truncated_when_it_alone_does_not_fit():
+    chunk = words("knowledge", 2000)
+    budget = 300
+    result = assemble_prompt(MODEL, KNOWLEDGE_PLACEHOLDER, "hi", chunks=[chunk, "other"], budget=budget)
+    assert result.truncated == ["chunks"]
+    assert result.dropped == {"chunks": 1}
+    assert result.system_prompt.startswith("[CHUNK]: knowledge")
+    assert result.tokens <= budget
+
+
+def test_history_keeps_newest_messages():
+    history = [{"role": "user", "content": words(f"m{i}", 30)} for i in range(10)]
+    fixed = assemble_prompt(MODEL, "p", "hi", budget=10_000).tokens
+    message_tokens = count_tokens(history[0]["content"]) + 4
+    result = assemble_prompt(MODEL, "p", "hi", history=history, budget=fixed + 3 * message_tokens + 2)
+    assert result.history == history[-3:]
+    assert result.dropped == {"history": 7}
+
+
+def test_form_state_parts_in_priority_order():
+    parts = ["\nFirst.", words("long", 500), "\nThird."]
+    fixed = assemble_prompt(MODEL, "p", "hi", budget=10_000).tokens
+    result = assemble_prompt(MODEL, "p", "hi", form_state=parts, budget=fixed + 50)
+    # The part that does not fit ends the section
+    assert result.system_prompt.endswith(NO_KNOWLEDGE_TEXT + "\nFirst.")
+    assert result.dropped == {"form_state": 2}
+
+
+def test_summary_is_truncated_or_dropped():
+    summary = words("summary", 1000)
+    fixed = assemble_prompt(MODEL, "p", "hi", budget=10_000).tokens
+
+    result = assemble_prompt(MODEL, "p", "hi", summary=summary, budget=fixed + MIN_TRUNCATED_TOKENS + 10)
+    assert result.truncated == ["summary"]
+    assert "summary" in result.system_prompt
+
+    result = assemble_prompt(MODEL, "p", "hi", summary=summary, budget=fixed + MIN_TRUNCATED_TOKENS - 10)
+    assert result.dropped == {"summary": 1}
+    assert "summary" not in result.system_prompt
+
+
+def test_truncated_persona_keeps_the_knowledge_block():
+    persona = words("intro", 1500) + f"\n{KNOWLEDGE_PLACEHOLDER}\n" + words("rules", 1500)
+    budget = 400
+    result = assemble_prompt(MODEL, persona, "hi", chunks=["the answer is 42"], budget=budget)
+    assert "persona" in result.truncated
+    assert "[CHUNK]: the answer is 42" in result.system_prompt
+    assert result.system_prompt.startswith("intro intro")
+    assert result.tokens <= budget
+
+
+def test_truncated_persona_without_placeholder_keeps_the_knowledge_block():
+    budget = 400
+    result = assemble_prompt(MODEL, words("persona", 3000), "hi", chunks=["the answer is 42"], budget=budget)
+    assert "persona" in result.truncated
+    assert result.system_prompt.endswith("\n\n[CHUNK]: the answer is 42")
+    assert result.tokens <= budget
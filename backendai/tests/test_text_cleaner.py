@@ -0,0 +1,75 @@
+from utils.text_cleaner import clean_text, count_tables, quality_score, split_segments
+
+
+def test_unicode_noise_is_normalized():
+    assert clean_text("ofﬁce hours, in­formation\x07") == "office hours, information"
+
+
+def test_empty_text():
+    assert clean_text("") == ""
+    assert clean_text(None) == ""
+
+
+def test_running_headers_footers_and_page_numbers_are_removed():
+    pages = [
+        f"ACME Handbook\nSection {i} explains topic {i}.\n© 2024 ACME Inc.\n{i}"
+        for i in range(1, 5)
+    ]
+    cleaned = clean_text("\x0c".join(pages))
+    assert "ACME Handbook" not in cleaned
+    assert "© 2024" not in cleaned
+    for i in range(1, 5):
+        assert f"Section {i} explains topic {i}." in cleaned
+    assert not any(line.strip().isdigit() for line in cleaned.split("\n"))
+
+
+def test_repeated_lines_in_the_page_body_are_kept():
+    pages = [f"Title {i}\nIntro {i}.\nRepeated note.\nMore {i}.\nEnd {i}." for i in range(4)]
+    assert clean_text("\x0c".join(pages)).count("Repeated note.") == 4
+
+
+def test_single_page_text_keeps_its_edges():
+    assert clean_text("1\nIntro.") == "1\nIntro."
+
+
+def test_hyphenated_and_wrapped_lines_are_merged():
+    text = "The exam-\nple shows how wrapped\nlines are joined.\n\nNew paragraph."
+    assert clean_text(text) == "The example shows how wrapped lines are joined.\n\nNew paragraph."
+
+
+def test_bullets_are_normalized_and_kept_on_their_own_lines():
+    assert clean_text("Options:\n• First\n● second\n▪ Third") == "Options:\n- First\n- second\n- Third"
+
+
+def test_aligned_columns_become_a_markdown_table():
+    text = "Plan      Price     Seats\nBasic     10        1\nPro       25        5\n\nAfter."
+    cleaned = clean_text(text)
+    assert cleaned == (
+        "| Plan | Price | Seats |\n|---|---|---|\n| Basic | 10 | 1 |\n| Pro | 25 | 5 |\n\nAfter."
+    )
+    assert count_tables(cleaned) == 1
+
+
+def test_two_aligned_rows_are_not_a_table():
+    assert count_tables(clean_text("Name    Value\nA    1")) == 0
+
+
+def test_quality_score():
+    good = "This is a clean paragraph of text extracted from a document about products and pricing."
+    assert quality_score(good) == 1.0
+    assert quality_score("T h i s  i s  s p a c e d  o u t  t e x t  f r o m  a  P D F") < 0.5
+    assert quality_score("(cid:12)(cid:34)(cid:56) text (cid:78)") == 0.0
+    assert quality_score("") == 0.0
+
+
+def test_split_segments_prefers_paragraph_boundaries():
+    text = "\n\n".join(["a" * 40, "b" * 40, "c" * 40])
+    assert split_segments(text, 90) == ["a" * 40 + "\n\n" + "b" * 40, "c" * 40]
+    assert split_segments("short", 90) == ["short"]
+    assert split_segments("", 90) == []
+
+
+def test_split_segments_cuts_long_paragraphs():
+    segments = split_segments("x" * 250, 100)
+    assert all(len(segment) <= 100 for segment in segments)
+    assert "".join(segments).replace("\n", "") == "x" * 250
@@ -0,0 +1,26 @@
+import pytest
+
+from utils.tokenizer import count_tokens, split_by_tokens
+
+
+def test_count_tokens_empty():
+    assert count_tokens("") == 0
+    assert count_tokens(None) == 0
+
+
+@pytest.mark.parametrize("max_tokens,overlap", [(1, 0), (7, 0), (50, 10), (64, 0)])
+def test_split_pieces_fit_max_tokens(max_tokens, overlap):
+    text = " ".join(f"word{i}" for i in range(500))
+    pieces = list(split_by_tokens(text, max_tokens, overlap))
+    assert len(pieces) > 1
+    assert all(count_tokens(piece) <= max_tokens for piece in pieces)
+    assert pieces[0] and text.startswith(pieces[0])
+
+
+def test_split_without_overlap_loses_nothing():
+    text = " ".join(f"word{i}" for i in range(500))
+    assert "".join(split_by_tokens(text, 30)) == text
+
+
+def test_split_short_text_is_one_piece():
+    assert list(split_by_tokens("short text", 100)) == ["short text"]
@@ -0,0 +1,155 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from controller import training_progress
+from controller.training_progress import ProgressReporter
+from utils import metrics
+
+URL = "http://rtserver/webhook"
+
+
+class FakeClient:
+    """Records webhook payloads; post() waits on `gate` when set and raises while `failures` > 0."""
+
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.sent = []
+        self.gate = None
+        self.failures = 0
+        FakeClient.instances.append(self)
+
+    async def post(self, url, json):
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("rtserver down")
+        self.sent.append(json)
+        return SimpleNamespace(raise_for_status=lambda: None)
+
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """Rows written to automations, as (status, progress, message, organization_id)."""
+    rows = []
+
+    async def execute(query, params=None):
+        rows.append(params)
+        return True
+
+    FakeClient.instances = []
+    monkeypatch.setattr(training_progress, "execute", execute)
+    monkeypatch.setattr(training_progress.httpx, "AsyncClient", FakeClient)
+    return rows
+
+
+def sent():
+    return [(p["organization_id"], p["status"], p["progress"]) for p in FakeClient.instances[-1].sent]
+
+
+def test_updates_are_coalesced_per_organization(written):
+    async def scenario():
+        reporter = ProgressReporter(interval=60)
+        before = metrics.get_counter("training_progress.coalesced")
+        for progress in (10, 20, 30):
+            reporter.report(URL, 1, "training", progress, f"step {progress}")
+        reporter.report(URL, 2, "training", 5, "starting")
+        await reporter.close()
+        return metrics.get_counter("training_progress.coalesced") - before
+
+    assert asyncio.run(scenario()) == 2
+    assert sorted(sent()) == [(1, "training", 30), (2, "training", 5)]
+    assert sorted(written) == [("training", 5, "starting", 2), ("training", 30, "step 30", 1)]
+
+
+def test_updates_are_rate_limited(written):
+    async def scenario():
+        reporter = ProgressReporter(interval=0.2)
+        reporter.report(URL, 1, "training", 10, "")
+        await asyncio.sleep(0.05)
+        first = sent()
+        reporter.report(URL, 1, "training", 20, "")
+        reporter.report(URL, 1, "training", 30, "")
+        await asyncio.sleep(0.05)
+        during_interval = sent()
+        await asyncio.sleep(0.3)
+        after_interval = sent()
+        await reporter.close()
+        return first, during_interval, after_interval
+
+    first, during_interval, after_interval = asyncio.run(scenario())
+    assert first == [(1, "training", 10)]
+    assert during_interval == first
+    assert after_interval == [(1, "training", 10), (1, "training", 30)]
+
+
+def test_terminal_update_replaces_pending_progress(written):
+    async def scenario():
+        reporter = ProgressReporter(interval=60)
+        reporter.report(URL, 1, "training", 50, "")
+        delivered = await reporter.deliver(URL, 1, "completed", 100, "done")
+        await reporter.close()
+        return delivered
+
+    assert asyncio.run(scenario()) is True
+    assert sent() == [(1, "completed", 100)]
+    assert written == [("completed", 100, "done", 1)]
+
+
+def test_progress_taken_before_a_terminal_update_is_not_sent_after_it(written):
+    async def scenario():
+        reporter = ProgressReporter(interval=0)
+        reporter.report(URL, 1, "training", 10, "")
+        await asyncio.sleep(0)
+        client = FakeClient.instances[-1]
+        client.gate = asyncio.Event()       # the sender is now stuck posting 10%
+        await asyncio.sleep(0.01)
+        reporter.report(URL, 1, "training", 90, "")
+        late_flush = asyncio.create_task(reporter.flush())    # takes 90%, waits for the lock
+        await asyncio.sleep(0.01)
+        terminal = asyncio.create_task(reporter.deliver(URL, 1, "completed", 100, "done"))
+        await asyncio.sleep(0.01)
+        before = metrics.get_counter("training_progress.superseded")
+        client.gate.set()
+        await asyncio.gather(late_flush, terminal)
+        await reporter.close()
+        return metrics.get_counter("training_progress.superseded") - before
+
+    assert asyncio.run(scenario()) == 1
+    assert sent() == [(1, "training", 10), (1, "completed", 100)]
+    assert [row[0] for row in written] == ["training", "completed"]
+
+
+def test_terminal_update_is_retried(written, monkeypatch):
+    sleep = asyncio.sleep
+    monkeypatch.setattr(training_progress.asyncio, "sleep", lambda seconds: sleep(0))
+
+    async def scenario(failures):
+        reporter = ProgressReporter(interval=60)
+        reporter.report(None, 1, "training", 0, "")     # starts the reporter and its client
+        FakeClient.instances[-1].failures = failures
+        delivered = await reporter.deliver(URL, 1, "failed", 40, "error", error="boom")
+        await reporter.close()
+        return delivered
+
+    assert asyncio.run(scenario(training_progress.TRAINING_WEBHOOK_RETRIES)) is True
+    assert FakeClient.instances[-1].sent[-1]["error"] == "boom"
+    assert asyncio.run(scenario(training_progress.TRAINING_WEBHOOK_RETRIES + 1)) is False
+
+
+def test_updates_without_webhook_are_only_written(written):
+    async def scenario():
+        reporter = ProgressReporter(interval=60)
+        delivered = await reporter.deliver(None, 7, "completed", 100, "done")
+        await reporter.close()
+        return delivered
+
+    assert asyncio.run(scenario()) is True
+    assert sent() == []
+    assert written == [("completed", 100, "done", 7)]
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+from utils import ttl_cache
+from utils.ttl_cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ttl_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_get_set_pop():
+    cache = TTLCache(10)
+    assert cache.get("a") is None
+    assert cache.get("a", "default") == "default"
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.pop("a") == 1
+    assert cache.pop("a", "gone") == "gone"
+    assert len(cache) == 0
+
+
+def test_falsy_values_are_cached():
+    cache = TTLCache(10)
+    cache.set("zero", 0)
+    cache.set("empty", [])
+    assert cache.get("zero", "missing") == 0
+    assert cache.get("empty", "missing") == []
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")          # b is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(10, ttl=5)
+    cache.set("a", 1)
+    clock[0] += 5
+    assert cache.get("a") == 1
+    clock[0] += 0.1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_per_entry_ttl_overrides_default(clock):
+    cache = TTLCache(10, ttl=5)
+    cache.set("short", 1, ttl=1)
+    cache.set("long", 2, ttl=60)
+    clock[0] += 10
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+
+
+def test_no_ttl_never_expires(clock):
+    cache = TTLCache(10)
+    cache.set("a", 1)
+    clock[0] += 10 ** 9
+    assert cache.get("a") == 1
+
+
+def test_clear():
+    cache = TTLCache(10)
+    cache.set("a", 1)
+    cache.clear()
+    assert cache.get("a") is None
+
+
+def test_concurrent_use_keeps_maxsize():
+    cache = TTLCache(50)
+
+    def worker(offset):
+        for i in range(1000):
+            cache.set(offset + i, i)
+            cache.get(offset + i // 2)
+
+    threads = [threading.Thread(target=worker, args=(n * 10000,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache) == 50
@@ -0,0 +1,166 @@
+"""
+Training worker: runs queued training jobs (DB/training_jobs.py) outside the API.
+
+/api/ingest only queues a job; one or more of these processes claim and run
+them, so PDF parsing and embedding do not compete with chat requests and a
+deploy of the API does not lose a training. Workers scale independently of
+the API replicas; they coordinate only through the training_jobs table.
+
+- Up to --concurrency jobs per worker, TRAINING_ORG_CONCURRENCY per organization.
+- Heartbeats every TRAINING_HEARTBEAT_INTERVAL seconds; each worker also
+  requeues (or fails) jobs of workers that stopped sending them.
+- Failed jobs are retried with exponential backoff (TRAINING_MAX_ATTEMPTS).
+- SIGTERM / SIGINT: stops claiming, waits up to TRAINING_SHUTDOWN_TIMEOUT
+  seconds for running jobs, then puts the rest back in the queue.
+
+Run with:
+    python training_worker.py
+    python training_worker.py --concurrency 4
+
+Keep this module's top level light: document extraction processes are
+spawned and re-import __main__ (services/document_extraction.py), so the
+DB / controller modules are imported inside the functions that use them.
+"""
+
+import os
+import uuid
+import signal
+import socket
+import asyncio
+import argparse
+import logging
+
+TRAINING_WORKER_CONCURRENCY = int(os.getenv("TRAINING_WORKER_CONCURRENCY", "2"))
+TRAINING_POLL_INTERVAL = float(os.getenv("TRAINING_POLL_INTERVAL", "2"))
+TRAINING_HEARTBEAT_INTERVAL = float(os.getenv("TRAINING_HEARTBEAT_INTERVAL", "15"))
+TRAINING_SHUTDOWN_TIMEOUT = float(os.getenv("TRAINING_SHUTDOWN_TIMEOUT", "30"))
+
+
+class TrainingWorker:
+    def __init__(self, concurrency: int = TRAINING_WORKER_CONCURRENCY, poll_interval: float = TRAINING_POLL_INTERVAL):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._running = {}   # job_id -> task
+        self._stopping = False
+        self._wake = asyncio.Event()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    async def run(self):
+        from DB.training_jobs import claim_job
+
+        logging.info(f"Training worker {self.worker_id} started (concurrency {self.concurrency})")
+        heartbeats = asyncio.create_task(self._heartbeat_loop())
+        try:
+            while not self._stopping:
+                if len(self._running) < self.concurrency:
+                    job = await asyncio.to_thread(claim_job, self.worker_id)
+                    if job:
+                        task = asyncio.create_task(self._run_job(job))
+                        self._running[job["job_id"]] = task
+                        continue  # fill the remaining slots right away
+                # Sleep until the next poll, a finished job or stop()
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self._shutdown()
+            heartbeats.cancel()
+
+    async def _run_job(self, job: dict):
+        from DB.training_jobs import complete_job, fail_job, retry_delay
+        from controller.async_training import ingest_to_vector_db_async, mark_training_failed, send_webhook
+        # Import here to avoid circular import
+        from controller.standard_rag_controller import StandardRAGController
+
+        job_id, organization_id, webhook_url = job["job_id"], job["organization_id"], job["webhook_url"]
+        logging.info(f"Running training job {job_id} (attempt {job['attempts']}/{job['max_attempts']})")
+        try:
+            await ingest_to_vector_db_async(
+                job_id, job["chatbot_id"], organization_id, webhook_url, StandardRAGController
+            )
+            await asyncio.to_thread(complete_job, job_id, self.worker_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Training job {job_id} failed: {e}", exc_info=True)
+            retry = await asyncio.to_thread(fail_job, job_id, self.worker_id, job["attempts"], job["max_attempts"], str(e))
+            # None: no longer ours (recovered meanwhile); the job's new run reports its own outcome
+            if retry:
+                await send_webhook(
+                    webhook_url, organization_id, 'training', 5,
+                    f"Training error, retrying in {int(retry_delay(job['attempts']))}s "
+                    f"(attempt {job['attempts']}/{job['max_attempts']})..."
+                )
+            elif retry is False:
+                await mark_training_failed(organization_id, webhook_url, str(e))
+        finally:
+            self._running.pop(job_id, None)
+            self._wake.set()
+
+    async def _heartbeat_loop(self):
+        from DB.training_jobs import heartbeat, recover_stale_jobs
+        from controller.async_training import mark_training_failed
+
+        while True:
+            await asyncio.sleep(TRAINING_HEARTBEAT_INTERVAL)
+            try:
+                await asyncio.to_thread(heartbeat, list(self._running), self.worker_id)
+                for job_id, organization_id, webhook_url, requeued in await asyncio.to_thread(recover_stale_jobs):
+                    if not requeued:
+                        await mark_training_failed(organization_id, webhook_url, "Training worker stopped")
+            except Exception as e:
+                logging.error(f"Training worker heartbeat failed: {e}")
+
+    async def _shutdown(self):
+        from DB.training_jobs import release_job
+
+        if not self._running:
+            return
+        logging.info(f"Waiting up to {TRAINING_SHUTDOWN_TIMEOUT}s for {len(self._running)} training job(s)")
+        done, pending = await asyncio.wait(list(self._running.values()), timeout=TRAINING_SHUTDOWN_TIMEOUT)
+        interrupted = [job_id for job_id, task in self._running.items() if task in pending]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for job_id in interrupted:
+            # Another worker picks it up again (unchanged documents are skipped)
+            if await asyncio.to_thread(release_job, job_id, self.worker_id):
+                logging.warning(f"Training job {job_id} interrupted by shutdown, requeued")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=TRAINING_WORKER_CONCURRENCY)
+    parser.add_argument("--poll-interval", type=float, default=TRAINING_POLL_INTERVAL)
+    args = parser.parse_args()
+
+    from DB.async_pool import open_async_pool, close_async_pool
+    from DB.postgresDB import close_db_pools
+    from controller.training_progress import stop_progress_reporter
+    from services.document_extraction import shutdown_extraction_pool
+
+    worker = TrainingWorker(args.concurrency, args.poll_interval)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+
+    await open_async_pool()
+    try:
+        await worker.run()
+    finally:
+        await stop_progress_reporter()
+        shutdown_extraction_pool()
+        await close_async_pool()
+        close_db_pools()
+
+
+# Run with: python training_worker.py
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(main())
@@ -0,0 +1,197 @@
+# markdown_chunker.py
+# Structure-aware chunking for the Markdown produced by generate_chatbot_training_instruction.
+#
+# Text is read line by line and grouped into blocks (heading, paragraph/list,
+# table, fenced code). Blocks are packed into chunks of at most max_tokens
+# tokens without crossing a heading, so a chunk never mixes two sections and
+# never cuts a word, table row or code line in half. Oversized blocks are
+# split on their own boundaries: tables by rows (repeating the header),
+# code by lines, paragraphs by sentences, then by tokens as a last resort.
+#
+# Each chunk carries the path of headings above it; the path is also
+# prepended to the chunk text so the embedding knows which section it is from.
+
+import io
+import re
+
+from utils.tokenizer import count_tokens, split_by_tokens
+
+DEFAULT_MAX_TOKENS = 350
+DEFAULT_OVERLAP_TOKENS = 50
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE_RE = re.compile(r"^\s*(```|~~~)")
+TABLE_SEPARATOR_RE = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _iter_lines(text):
+    if isinstance(text, str):
+        # StringIO iterates lazily instead of materialising splitlines()
+        for line in io.StringIO(text):
+            yield line.rstrip("\n")
+    else:
+        for line in text:
+            yield line.rstrip("\n")
+
+
+def _iter_blocks(lines):
+    """
+    Yields (kind, text, meta) with kind in heading/paragraph/table/code.
+    meta is (level, title) for headings and the header rows for tables.
+    """
+    buffer, kind = [], None
+    fence = None
+
+    def flush():
+        nonlocal buffer, kind
+        if buffer:
+            block = (kind, "\n".join(buffer), _table_header(buffer) if kind == "table" else None)
+            buffer, kind = [], None
+            return block
+        buffer, kind = [], None
+        return None
+
+    for line in lines:
+        if fence:
+            buffer.append(line)
+            if line.strip().startswith(fence):
+                fence = None
+                yield flush()
+            continue
+
+        fence_match = FENCE_RE.match(line)
+        if fence_match:
+            block = flush()
+            if block:
+                yield block
+            fence, kind, buffer = fence_match.group(1), "code", [line]
+            continue
+
+        heading = HEADING_RE.match(line)
+        if heading:
+            block = flush()
+            if block:
+                yield block
+            yield ("heading", line.strip(), (len(heading.group(1)), heading.group(2)))
+            continue
+
+        is_table_row = line.lstrip().startswith("|")
+        if not line.strip() or (kind == "table") != is_table_row:
+            block = flush()
+            if block:
+                yield block
+            if not line.strip():
+                continue
+
+        kind = "table" if is_table_row else "paragraph"
+        buffer.append(line)
+
+    block = flush()
+    if block:
+        yield block
+
+
+def _table_header(rows):
+    if len(rows) >= 2 and TABLE_SEPARATOR_RE.match(rows[1]):
+        return rows[:2]
+    return []
+
+
+def _split_block(kind, text, header, max_tokens, overlap_tokens):
+    """Splits one oversized block on its own boundaries."""
+    if kind == "table":
+        rows = text.split("\n")[len(header):]
+        units, prefix = rows, "\n".join(header)
+    elif kind == "code":
+        lines = text.split("\n")
+        units, prefix = lines[1:-1] if len(lines) > 2 else lines, None
+        fence = lines[0].strip()[:3]
+    else:
+        units, prefix = SENTENCE_RE.split(text), None
+
+    prefix_tokens = count_tokens(prefix) if prefix else 0
+    budget = max(1, max_tokens - prefix_tokens - (2 if kind == "code" else 0))
+    joiner = " " if kind == "paragraph" else "\n"
+
+    def wrap(parts):
+        body = joiner.join(parts)
+        if kind == "code":
+            body = f"{fence}\n{body}\n{fence}"
+        return f"{prefix}\n{body}" if prefix else body
+
+    current, current_tokens = [], 0
+    for unit in units:
+        unit_tokens = count_tokens(unit)
+        if unit_tokens > budget:
+            if current:
+                yield wrap(current)
+                current, current_tokens = [], 0
+            for piece in split_by_tokens(unit, budget, overlap_tokens):
+                yield wrap([piece])
+            continue
+        if current and current_tokens + unit_tokens > budget:
+            yield wrap(current)
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        yield wrap(current)
+
+
+def iter_markdown_chunks(text, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS):
+    """
+    Streams chunks from Markdown text (a string or an iterable of lines).
+    Yields: {'content': str, 'heading_path': list[str], 'tokens': int}
+    """
+    headings = []  # [(level, title)]
+    parts, parts_tokens = [], 0
+
+    def breadcrumb():
+        return " > ".join(title for _, title in headings)
+
+    def emit(parts):
+        path = breadcrumb()
+        body = "\n\n".join(parts)
+        content = f"{path}\n\n{body}" if path else body
+        return {"content": content, "heading_path": [title for _, title in headings], "tokens": count_tokens(content)}
+
+    # Room for the breadcrumb prepended to every chunk
+    def budget():
+        return max(1, max_tokens - count_tokens(breadcrumb()) - 2)
+
+    for kind, block_text, meta in _iter_blocks(_iter_lines(text)):
+        if kind == "heading":
+            if parts:
+                yield emit(parts)
+                parts, parts_tokens = [], 0
+            level, title = meta
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, title))
+            continue
+
+        block_tokens = count_tokens(block_text)
+        if block_tokens > budget():
+            if parts:
+                yield emit(parts)
+                parts, parts_tokens = [], 0
+            for piece in _split_block(kind, block_text, meta or [], budget(), overlap_tokens):
+                yield emit([piece])
+            continue
+
+        if parts and parts_tokens + block_tokens > budget():
+            yield emit(parts)
+            # Carry the previous block over as overlap when it is small enough
+            previous = parts[-1]
+            previous_tokens = count_tokens(previous)
+            if overlap_tokens and previous_tokens <= overlap_tokens and previous_tokens + block_tokens <= budget():
+                parts, parts_tokens = [previous], previous_tokens
+            else:
+                parts, parts_tokens = [], 0
+
+        parts.append(block_text)
+        parts_tokens += block_tokens
+
+    if parts:
+        yield emit(parts)
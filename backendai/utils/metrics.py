@@ -0,0 +1,61 @@
+# metrics.py
+# Lightweight in-process metrics served by the /metrics endpoint.
+
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_timings = {}  # name -> [count, total_seconds, max_seconds]
+_gauges = {}   # name -> zero-arg callable
+
+def increment(name: str, value: float = 1):
+    """Adds value to a counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def observe(name: str, seconds: float):
+    """Records one duration sample for a timing."""
+    with _lock:
+        timing = _timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+def get_counter(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0)
+
+def hit_rate(prefix: str) -> float:
+    """Hit ratio for a cache that reports '<prefix>.hits' and '<prefix>.misses' counters."""
+    hits = get_counter(f"{prefix}.hits")
+    total = hits + get_counter(f"{prefix}.misses")
+    return round(hits / total, 4) if total else 0.0
+
+def register_gauge(name: str, fn):
+    """Registers a callable whose value is read on every snapshot (e.g. queue depth)."""
+    with _lock:
+        _gauges[name] = fn
+
+def snapshot() -> dict:
+    """Returns the current value of every counter, timing and gauge."""
+    with _lock:
+        counters = dict(_counters)
+        timings = {
+            name: {
+                "count": count,
+                "total_ms": round(total * 1000, 3),
+                "avg_ms": round(total / count * 1000, 3) if count else 0.0,
+                "max_ms": round(max_seconds * 1000, 3),
+            }
+            for name, (count, total, max_seconds) in _timings.items()
+        }
+        gauges = dict(_gauges)
+
+    gauge_values = {}
+    for name, fn in gauges.items():
+        try:
+            gauge_values[name] = fn()
+        except Exception as e:
+            gauge_values[name] = f"error: {e}"
+
+    return {"counters": counters, "timings": timings, "gauges": gauge_values}
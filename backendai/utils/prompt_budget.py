@@ -0,0 +1,212 @@
+# prompt_budget.py
+# Token-budgeted prompt assembly shared by the OpenAI and Gemini chat controllers.
+#
+# The prompt is filled in priority order and every part is measured with
+# utils/tokenizer (cl100k_base; an approximation for Gemini, which is far
+# from its context limit at these budgets):
+#   1. persona / answer instructions and the user's message (always kept, cut only if alone over budget;
+#      a cut persona leaves room for part of the best chunk)
+#   2. retrieved chunks, best first
+#   3. form state (lead capture / returning user instructions), part by part
+#   4. conversation summary, then recent history, newest first
+# Chunks, form parts and history messages are kept whole or dropped; the first
+# part that does not fit ends its section (later, lower priority sections still
+# get the remaining budget). Only the first chunk and the summary are cut
+# mid-text when they alone do not fit, so the result depends only on the inputs.
+#
+# The budget is the smaller of the model's context window minus the reply
+# (max_output_tokens) and PROMPT_MAX_TOKENS, the most we want to pay for
+# per turn. assemble_prompt reports tokens per section and what was dropped or
+# truncated (logged and counted as prompt.* metrics).
+
+import os
+import json
+import logging
+from dataclasses import dataclass, field
+
+from utils import metrics
+from utils.tokenizer import count_tokens, split_by_tokens
+
+KNOWLEDGE_PLACEHOLDER = "{knowledge}"
+NO_KNOWLEDGE_TEXT = "No knowledge base available."
+
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "12000"))
+DEFAULT_OUTPUT_TOKENS = 1024
+DEFAULT_CONTEXT_TOKENS = 8192
+MESSAGE_OVERHEAD_TOKENS = 4     # role and separators per chat message
+MIN_TRUNCATED_TOKENS = 64       # below this a cut chunk/summary is not worth sending
+
+# Context windows (prompt + completion); matched by prefix, longest first
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1000000,
+    "gpt-4-turbo": 128000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "gemini-2.5-flash": 1048576,
+    "gemini-2.5-pro": 1048576,
+    "gemini-2.0-flash": 1048576,
+    "gemini-1.5-flash": 1048576,
+    "gemini-1.5-pro": 2097152,
+}
+
+
+@dataclass
+class AssembledPrompt:
+    system_prompt: str
+    history: list                                   # [{"role", "content"}], oldest first
+    tokens: int                                     # estimated prompt tokens, tools included
+    budget: int
+    sections: dict = field(default_factory=dict)    # section -> tokens used
+    dropped: dict = field(default_factory=dict)     # section -> number of parts left out
+    truncated: list = field(default_factory=list)   # sections cut mid-text
+
+
+def context_window(model: str) -> int:
+    for name in sorted(MODEL_CONTEXT_TOKENS, key=len, reverse=True):
+        if model and model.startswith(name):
+            return MODEL_CONTEXT_TOKENS[name]
+    return DEFAULT_CONTEXT_TOKENS
+
+
+def prompt_budget(model: str, max_output_tokens: int = DEFAULT_OUTPUT_TOKENS) -> int:
+    return max(0, min(context_window(model) - max_output_tokens, PROMPT_MAX_TOKENS))
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    return next(iter(split_by_tokens(text, max_tokens)), "") if max_tokens > 0 else ""
+
+
+def assemble_prompt(model: str, persona: str, prompt: str, chunks=(), form_state=(), history=(),
+                    summary: str = "", tools=None, max_output_tokens: int = DEFAULT_OUTPUT_TOKENS,
+                    budget: int = None) -> AssembledPrompt:
+    """
+    Builds the system prompt and history for one chat turn within the model's budget.
+
+    persona:    system instructions; KNOWLEDGE_PLACEHOLDER is replaced by the chunks
+                (appended when the persona has none; kept when the persona is cut)
+    prompt:     the user's message (sent by the caller, counted here)
+    chunks:     retrieved chunk texts, best first
+    form_state: instruction parts appended after the persona, in priority order
+    history:    [{"role", "content"}] oldest first
+    summary:    summary section of older messages (controller/conversation_summary.py)
+    tools:      tool definitions sent with the request (counted only)
+    """
+    budget = prompt_budget(model, max_output_tokens) if budget is None else budget
+    remaining = budget
+    sections, dropped, truncated = {}, {}, []
+
+    def take(name, tokens):
+        nonlocal remaining
+        remaining -= tokens
+        sections[name] = sections.get(name, 0) + tokens
+
+    # 1. Required: tools, persona, user message
+    if tools:
+        take("tools", count_tokens(json.dumps(tools)))
+
+    # The text before and after the knowledge block; without a placeholder it goes at the end
+    head, placeholder, tail = persona.partition(KNOWLEDGE_PLACEHOLDER)
+    tail = tail.replace(KNOWLEDGE_PLACEHOLDER, "") if placeholder else "\n\n"
+    prompt_tokens = count_tokens(prompt) + MESSAGE_OVERHEAD_TOKENS
+    persona_tokens = count_tokens(head + tail) + MESSAGE_OVERHEAD_TOKENS
+    if persona_tokens + prompt_tokens > remaining:
+        # Only with a tiny budget or a huge message; keep the persona head, then as much of the tail
+        # as fits, leaving room for the start of the best chunk (answers without knowledge are worse)
+        reserve = MIN_TRUNCATED_TOKENS + 2 if chunks else 0
+        allowed = max(0, remaining - prompt_tokens - MESSAGE_OVERHEAD_TOKENS - reserve)
+        if placeholder:
+            head = _truncate(head, allowed)
+            tail = _truncate(tail, allowed - count_tokens(head))
+        else:
+            # tail is only the separator before the appended knowledge
+            head = _truncate(head, allowed - count_tokens(tail))
+        persona_tokens = count_tokens(head + tail) + MESSAGE_OVERHEAD_TOKENS
+        truncated.append("persona")
+    take("persona", persona_tokens)
+    take("prompt", prompt_tokens)
+
+    # 2. Retrieved chunks
+    kept_chunks = []
+    for chunk in chunks:
+        text = f"[CHUNK]: {chunk}"
+        tokens = count_tokens(text) + 2
+        if tokens > remaining:
+            # The best chunk is cut rather than dropped when a useful part of it fits
+            if not kept_chunks and remaining - 2 >= MIN_TRUNCATED_TOKENS:
+                text = _truncate(text, remaining - 2)
+                tokens = count_tokens(text) + 2
+                truncated.append("chunks")
+            else:
+                break
+        kept_chunks.append(text)
+        take("chunks", tokens)
+        if "chunks" in truncated:
+            break
+    if len(chunks) > len(kept_chunks):
+        dropped["chunks"] = len(chunks) - len(kept_chunks)
+    knowledge = "\n\n".join(kept_chunks) if kept_chunks else NO_KNOWLEDGE_TEXT
+    if not kept_chunks:
+        take("chunks", count_tokens(knowledge))
+
+    # 3. Form state
+    form_parts = [part for part in form_state if part]
+    kept_form = []
+    for part in form_parts:
+        tokens = count_tokens(part)
+        if tokens > remaining:
+            break
+        kept_form.append(part)
+        take("form_state", tokens)
+    if len(form_parts) > len(kept_form):
+        dropped["form_state"] = len(form_parts) - len(kept_form)
+
+    # 4. Summary, then recent history (newest first)
+    summary_text = summary or ""
+    if summary_text and count_tokens(summary_text) > remaining:
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            summary_text = _truncate(summary_text, remaining)
+            truncated.append("summary")
+        else:
+            summary_text = ""
+            dropped["summary"] = 1
+    if summary_text:
+        take("summary", count_tokens(summary_text))
+
+    kept_history = []
+    for msg in reversed(history):
+        tokens = count_tokens(msg.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+        if tokens > remaining:
+            break
+        kept_history.append(msg)
+        take("history", tokens)
+    if len(history) > len(kept_history):
+        dropped["history"] = len(history) - len(kept_history)
+    kept_history.reverse()
+
+    system_prompt = head + (knowledge + tail if placeholder else tail + knowledge) + "".join(kept_form) + summary_text
+    result = AssembledPrompt(
+        system_prompt=system_prompt,
+        history=kept_history,
+        tokens=budget - remaining,
+        budget=budget,
+        sections=sections,
+        dropped=dropped,
+        truncated=truncated,
+    )
+    _report(model, result)
+    return result
+
+
+def _report(model: str, result: AssembledPrompt):
+    metrics.observe("prompt.tokens", result.tokens)
+    for name, count in result.dropped.items():
+        metrics.increment(f"prompt.dropped.{name}", count)
+    for name in result.truncated:
+        metrics.increment(f"prompt.truncated.{name}")
+    if result.dropped or result.truncated:
+        logging.info(
+            f"Prompt for {model} over budget ({result.tokens}/{result.budget} tokens): "
+            f"dropped={result.dropped} truncated={result.truncated} sections={result.sections}"
+        )
@@ -0,0 +1,37 @@
+# redis_client.py
+# Shared Redis clients. Redis is optional: set REDIS_URL to enable the shared cache tiers.
+
+import os
+import logging
+
+try:
+    import redis
+    import redis.asyncio as redis_async
+except ImportError:  # redis is optional
+    redis = None
+    redis_async = None
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+_client = None
+_async_client = None
+
+def get_redis():
+    """Returns a process-wide sync Redis client, or None if Redis is not configured."""
+    global _client
+    if _client is None and REDIS_URL and redis:
+        try:
+            _client = redis.Redis.from_url(REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+        except Exception as e:
+            logging.error(f"Redis client init failed: {e}")
+    return _client
+
+def get_async_redis():
+    """Returns a process-wide asyncio Redis client, or None if Redis is not configured."""
+    global _async_client
+    if _async_client is None and REDIS_URL and redis_async:
+        try:
+            _async_client = redis_async.Redis.from_url(REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+        except Exception as e:
+            logging.error(f"Async Redis client init failed: {e}")
+    return _async_client
@@ -0,0 +1,58 @@
+# sse.py
+# Server-sent event responses for the chat endpoints, with client-disconnect handling.
+#
+# Starlette cancels the response when the client disconnects (a closed widget
+# tab): a chat generator awaiting the model gets CancelledError, but one that
+# is suspended at `yield` is only closed whenever it is garbage collected.
+# EventStreamResponse closes the generator as soon as the response ends, so its
+# cleanup runs right away in the request task:
+#   - upstream model streams are closed by their `async with` / aclosing blocks
+#   - the generator saves the partial transcript and calls record_abandoned()
+#
+#     try:
+#         ... yield tokens ...
+#     except DISCONNECTED:
+#         record_abandoned("chat_stream", partial_text)
+#         save_partial(...)    # synchronous: nothing can be awaited after a cancel
+#         raise
+
+import asyncio
+import logging
+
+from fastapi.responses import StreamingResponse
+
+from utils import metrics
+from utils.tokenizer import count_tokens
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+# Raised inside a chat generator when its client went away
+DISCONNECTED = (asyncio.CancelledError, GeneratorExit)
+
+
+class EventStreamResponse(StreamingResponse):
+    """text/event-stream response that closes its generator when the response ends."""
+
+    def __init__(self, content, headers: dict = None, **kwargs):
+        super().__init__(content, media_type="text/event-stream", headers={**SSE_HEADERS, **(headers or {})}, **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+def record_abandoned(stream: str, partial_text: str = "") -> int:
+    """Counts a stream abandoned by its client and the tokens generated for it."""
+    tokens = count_tokens(partial_text) if partial_text else 0
+    metrics.increment(f"{stream}.abandoned")
+    metrics.increment(f"{stream}.abandoned_tokens", tokens)
+    logging.info(f"{stream}: client disconnected after {tokens} generated token(s)")
+    return tokens
@@ -0,0 +1,204 @@
+# text_cleaner.py
+# Deterministic cleanup of extracted training text (no LLM).
+#
+# clean_text() fixes what PDF / slide / HTML extraction typically leaves behind:
+#   - unicode noise: non-breaking spaces, soft hyphens, ligatures, control characters
+#   - running headers / footers, page numbers and copyright lines at page edges
+#     (only for text with page breaks, "\x0c", as produced by services/document_extraction.py;
+#     a header / footer is the exact same line at the edge of >= MIN_REPEATED pages)
+#   - words hyphenated across lines, paragraphs broken at every line
+#   - bullets normalized to "- "
+#   - column-aligned tables (tabs or runs of spaces, >= 3 rows) rewritten as Markdown tables
+# quality_score() estimates whether the result is good enough to index as is;
+# extractions that score low (garbled encodings, spaced-out letters, layout
+# soup) are the ones worth an LLM cleanup (see controller/chatbot_config.py).
+# split_segments() cuts long text at paragraph boundaries for segment-wise cleanup.
+
+import re
+from collections import Counter
+
+LIGATURES = {"ﬀ": "ff", "ﬁ": "fi", "ﬂ": "fl", "ﬃ": "ffi", "ﬄ": "ffl"}
+BULLETS = "•●▪◦■□➢►‣⁃·"
+
+PAGE_NUMBER_RE = re.compile(r"^(page\s*)?\d{1,4}(\s*(of|/)\s*\d{1,4})?$", re.IGNORECASE)
+COPYRIGHT_RE = re.compile(r"^(©|\(c\)\s*\d{4}|copyright\b|all rights reserved\b)", re.IGNORECASE)
+LIST_ITEM_RE = re.compile(r"^(- |\* |\d{1,3}[.)] |[a-zA-Z][.)] )")
+CELL_SPLIT_RE = re.compile(r"\t+| {2,}")
+CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0e-\x1f\x7f]")
+
+MIN_REPEATED = 3            # pages a line must appear on (at their edges) to be a running header / footer
+MAX_BOILERPLATE_CHARS = 80
+EDGE_LINES = 2              # first / last non-empty lines of a page that can be headers / footers
+MIN_TABLE_ROWS = 3
+WRAPPED_LINE_CHARS = 60     # lines at least this long that end mid-sentence were wrapped by the layout
+
+
+def _normalize(text: str) -> str:
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = text.replace("\u00a0", " ").replace("\u00ad", "")  # non-breaking space, soft hyphen
+    for ligature, letters in LIGATURES.items():
+        text = text.replace(ligature, letters)
+    return CONTROL_RE.sub("", text)
+
+
+def _strip_page_furniture(pages: list) -> list:
+    """
+    pages: one list of lines per page. Drops page numbers, copyright lines and
+    running headers / footers from the first and last EDGE_LINES lines of each page.
+    """
+    if len(pages) < 2:
+        return pages
+
+    def edges(lines):
+        filled = [i for i, line in enumerate(lines) if line]
+        return set(filled[:EDGE_LINES] + filled[-EDGE_LINES:])
+
+    # Pages each edge line appears on (exact text: "Error 4012" and "Error 4013" differ)
+    seen = Counter()
+    for lines in pages:
+        seen.update({lines[i] for i in edges(lines) if len(lines[i]) <= MAX_BOILERPLATE_CHARS})
+
+    out = []
+    for lines in pages:
+        drop = {
+            i for i in edges(lines)
+            if seen[lines[i]] >= MIN_REPEATED or PAGE_NUMBER_RE.match(lines[i])
+            or (COPYRIGHT_RE.match(lines[i]) and len(lines[i]) <= MAX_BOILERPLATE_CHARS)
+        }
+        out.append([line for i, line in enumerate(lines) if i not in drop])
+    return out
+
+
+def _table_cells(line: str):
+    if line.startswith("|"):
+        return None  # already Markdown
+    cells = [cell.strip() for cell in CELL_SPLIT_RE.split(line.strip())]
+    return cells if len(cells) >= 2 else None
+
+
+def _markdown_table(rows) -> list:
+    header, body = rows[0], rows[1:]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    lines += ["| " + " | ".join(row) + " |" for row in body]
+    return lines
+
+
+def _rewrite_tables(lines: list):
+    """Replaces runs of >= MIN_TABLE_ROWS lines with the same number of aligned cells. Returns (lines, tables)."""
+    out, tables, i = [], 0, 0
+    while i < len(lines):
+        cells = _table_cells(lines[i])
+        j = i + 1
+        if cells:
+            while j < len(lines):
+                row = _table_cells(lines[j])
+                if not row or len(row) != len(cells):
+                    break
+                j += 1
+        if cells and j - i >= MIN_TABLE_ROWS:
+            out.append("")
+            out += _markdown_table([_table_cells(line) for line in lines[i:j]])
+            out.append("")
+            tables += 1
+            i = j
+        else:
+            out.append(lines[i])
+            i += 1
+    return out, tables
+
+
+def _is_block_line(line: str) -> bool:
+    """Lines that always start on their own: list items, Markdown headings and table rows."""
+    return bool(LIST_ITEM_RE.match(line)) or line.startswith(("#", "|", "```"))
+
+
+def _merge_lines(lines: list) -> list:
+    """Joins lines broken by the page layout back into paragraphs."""
+    out = []
+    for line in lines:
+        prev = out[-1] if out else ""
+        if not line or not prev or _is_block_line(line) or prev.startswith(("|", "```")):
+            out.append(line)
+            continue
+        if prev.endswith("-") and len(prev) > 1 and prev[-2].isalpha() and line[0].islower():
+            out[-1] = prev[:-1] + line            # exam-\nple -> example
+        elif line[0].islower() or prev.endswith((",", ";", "(", "–", "—")) or (
+            len(prev) >= WRAPPED_LINE_CHARS and not prev.endswith((".", "!", "?", ":"))
+        ):
+            out[-1] = prev + " " + line
+        else:
+            out.append(line)
+    return out
+
+
+def clean_text(text: str) -> str:
+    """Deterministic cleanup of extracted text; keeps all body content."""
+    if not text:
+        return ""
+    pages = [[line.strip() for line in page.split("\n")] for page in _normalize(text).split("\x0c")]
+    # Pages are rejoined so paragraphs and tables continuing on the next page are merged
+    lines = [line for page in _strip_page_furniture(pages) for line in page]
+    lines = [
+        "- " + line.lstrip(BULLETS + " ") if line and line[0] in BULLETS else line
+        for line in lines
+    ]
+    # Cells are split on runs of spaces, so tables are found before spaces are collapsed
+    lines, _ = _rewrite_tables(lines)
+    kept = [line if line.startswith("|") else re.sub(r"[ \t]+", " ", line) for line in lines]
+
+    merged = _merge_lines(kept)
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(merged)).strip()
+
+
+def count_tables(text: str) -> int:
+    """Markdown tables in cleaned text."""
+    return len(re.findall(r"^\|(?:---\|)+$", text, re.MULTILINE))
+
+
+def quality_score(text: str) -> float:
+    """
+    0..1 estimate of how readable cleaned text is; the lowest of:
+      - share of letters among non-space characters (symbols / digits soup)
+      - garbage: replacement characters and '(cid:NN)' glyph references
+      - single-letter words ("T h i s  i s" spacing from some PDFs)
+      - very short lines (layout fragments left after merging)
+    """
+    if not text or not text.strip():
+        return 0.0
+    chars = [c for c in text if not c.isspace()]
+    letters = sum(c.isalpha() for c in chars) / len(chars)
+    garbage = (text.count("\ufffd") + 5 * text.count("(cid:")) / len(chars)
+    words = re.findall(r"\w+", text)
+    single = sum(1 for w in words if len(w) == 1 and w.isalpha() and w not in ("a", "A", "I")) / max(len(words), 1)
+    lines = [line for line in text.split("\n") if line and not _is_block_line(line)]
+    short = sum(1 for line in lines if len(line) < 20) / max(len(lines), 1)
+
+    def scale(value, bad, good):
+        return min(1.0, max(0.0, (value - bad) / (good - bad)))
+
+    return round(min(
+        scale(letters, 0.45, 0.7),
+        scale(garbage, 0.02, 0.0),
+        scale(single, 0.3, 0.1),
+        scale(short, 0.9, 0.5),
+    ), 3)
+
+
+def split_segments(text: str, max_chars: int) -> list:
+    """Splits text into pieces of at most max_chars, at paragraph, then line, then character boundaries."""
+    if len(text) <= max_chars:
+        return [text] if text else []
+    segments, current = [], ""
+    for block in text.split("\n\n"):
+        pieces = [block]
+        if len(block) > max_chars:
+            pieces = [line[i:i + max_chars] for line in block.split("\n") for i in range(0, max(len(line), 1), max_chars)]
+        for piece in pieces:
+            sep = "\n\n" if block is piece else "\n"
+            if current and len(current) + len(sep) + len(piece) > max_chars:
+                segments.append(current)
+                current = ""
+            current = current + sep + piece if current else piece
+    if current:
+        segments.append(current)
+    return segments
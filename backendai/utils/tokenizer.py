@@ -0,0 +1,43 @@
+# tokenizer.py
+# Token counting for chunking and prompt budgets.
+# Uses tiktoken's cl100k_base (the encoding of text-embedding-3-small) when
+# installed, otherwise a ~4 characters/token estimate.
+
+import logging
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception as e:  # tiktoken is optional (not installed, or encoding download failed)
+    logging.info(f"tiktoken unavailable, using approximate token counts: {e}")
+    _encoding = None
+
+CHARS_PER_TOKEN = 4
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def split_by_tokens(text: str, max_tokens: int, overlap_tokens: int = 0):
+    """
+    Yields consecutive pieces of text of at most max_tokens tokens.
+    Used for single blocks (one huge paragraph or line) that have no structure left to split on.
+    """
+    step = max(1, max_tokens - overlap_tokens)
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        for start in range(0, len(tokens), step):
+            yield _encoding.decode(tokens[start:start + max_tokens])
+            if start + max_tokens >= len(tokens):
+                break
+        return
+
+    # count_tokens rounds up, so a piece of max_tokens * CHARS_PER_TOKEN characters would count one over
+    size, stride = max(1, max_tokens * CHARS_PER_TOKEN - 1), max(1, step * CHARS_PER_TOKEN - 1)
+    for start in range(0, len(text), stride):
+        yield text[start:start + size]
+        if start + size >= len(text):
+            break
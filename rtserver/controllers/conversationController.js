@@ -1,4 +1,6 @@
+const { QueryTypes } = require("sequelize");
 const {
+  sequelize,
   bot_conversations,
   support_conversations,
   customers,
@@ -149,7 +151,27 @@ const getChatbotConversationByConversationId = async (req, res) => {
       return res.status(404).json({ message: "Conversation not found" });
     }
 
-    res.json(conversation);
+    // backendai appends messages to bot_conversation_messages; the history
+    // column only holds conversations that were never migrated
+    const result = conversation.toJSON();
+    try {
+      const messages = await sequelize.query(
+        `SELECT data FROM bot_conversation_messages
+         WHERE conversation_id = :conversation_id
+         ORDER BY seq`,
+        {
+          replacements: { conversation_id: chatId },
+          type: QueryTypes.SELECT,
+        }
+      );
+      if (messages.length > 0) {
+        result.history = messages.map((m) => m.data);
+      }
+    } catch (err) {
+      console.error("Error fetching conversation messages:", err.message);
+    }
+
+    res.json(result);
   } catch (err) {
     res
       .status(500)
@@ -1,5 +1,16 @@
 const { forms, customers, chatbots } = require("../models");
 const { logActivity } = require("../utils/activityLogger");
+const axios = require("axios");
+
+// backendai caches pre-chat forms; tell it to reload this chatbot's config
+const invalidateChatbotConfig = (chatbot_id) => {
+  const AI_URL = process.env.INTERNAL_AI_API_URL || "http://backendai:5002";
+  axios
+    .post(`${AI_URL}/api/chatbot_config/invalidate`, { chatbot_id })
+    .catch((error) =>
+      console.error("Failed to invalidate backendai chatbot config:", error.message)
+    );
+};
 
 const getForms = async (req, res) => {
   try {
@@ -40,6 +51,7 @@ const updateForms = async (req, res) => {
         pre_chat_form: pre_chat_form || {},
         post_chat_form: post_chat_form || {},
       });
+      invalidateChatbotConfig(chatbot_id);
 
       //log activity
       logActivity(user_id, organization_id, "FORMS", "Updated the forms", {
@@ -58,6 +70,7 @@ const updateForms = async (req, res) => {
     formConfig.post_chat_form = post_chat_form ?? formConfig.post_chat_form;
 
     await formConfig.save();
+    invalidateChatbotConfig(chatbot_id);
 
     //log activity
     logActivity(user_id, organization_id, "FORMS", "Updated the forms", {